@@ -1,10 +1,32 @@
 import sys
+import argparse
+import tempfile
 import requests
 import json
 import os
+import re
+import html
+import bisect
+import base64
+import math
+import codecs
+import zlib
+import bz2
+import lzma
+import zipfile
+import struct
+import hashlib
+import gc
+import socket
 import threading
+import multiprocessing
 import time
 import keyboard
+from array import array
+from itertools import accumulate
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from urllib.parse import urlsplit
 import ctypes
 import traceback
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QMenu,
@@ -12,15 +34,20 @@ from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QMenu,
                              QSpinBox, QPushButton, QSystemTrayIcon, QStyle,
                              QColorDialog, QCheckBox, QHBoxLayout,
                              QFrame, QTextEdit, QShortcut, QListWidget,
-                             QListWidgetItem, QLabel, QFontComboBox, QSizePolicy, QFileDialog)
-from PyQt5.QtCore import Qt, QPoint, QRect, pyqtSignal, QObject, QThread, QTimer, QEvent
-from PyQt5.QtGui import QFont, QColor, QCursor, QKeySequence, QPainter, QPen, QFontMetrics
+                             QListWidgetItem, QLabel, QComboBox, QSizePolicy, QFileDialog,
+                             QInputDialog)
+from PyQt5.QtCore import (Qt, QPoint, QPointF, QRect, QRectF, pyqtSignal, QObject, QTimer, QEvent,
+                          QFileSystemWatcher, QElapsedTimer)
+from PyQt5.QtGui import (QFont, QFontDatabase, QColor, QCursor, QKeySequence, QPainter, QPen, QFontMetrics,
+                         QTextDocument, QAbstractTextDocumentLayout, QPalette, QPixmap,
+                         QKeyEvent, QWheelEvent, QGuiApplication, QTextOption)
 
 # 启用高分屏支持
 QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
 QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps)
 
 CONFIG_FILE = "config.json"
+CACHE_DIR = "cache"
 
 DEFAULT_CONFIG = {
     "ip": "http://192.168.1.10:1122",
@@ -36,7 +63,10 @@ DEFAULT_CONFIG = {
     "window_width": 400,
     "window_height": 300,
     "last_local_file": "",
-    "last_local_pos": 0
+    "last_local_pos": 0,
+    "last_local_anchor": None,
+    "replace_enabled": True,
+    "auto_scroll_speed": 30
 }
 
 DARK_STYLESHEET = """
@@ -67,6 +97,2197 @@ def set_window_protection(hwnd, enable=True):
         print(f"防截屏设置失败: {e}")
 
 
+def trim_working_set():
+    """把已释放的内存交还系统：先回收循环引用，再收缩进程工作集 (仅 Windows)"""
+    gc.collect()
+    try:
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetProcessWorkingSetSize(kernel32.GetCurrentProcess(), ctypes.c_size_t(-1), ctypes.c_size_t(-1))
+    except Exception:
+        pass
+
+
+# ================= 章节文本规整 (预编译变换) =================
+PARAGRAPH_INDENT = "\u3000\u3000"
+CHAPTER_CACHE_SIZE = 64
+
+# 常见换行标签先走 str.replace，剩余标签才交给正则
+_BREAK_TAGS = ("<br>", "<br/>", "<br />", "<BR>", "<p>", "</p>")
+# 只去掉常见 HTML 标签名、且后面是 HTML 属性 (ASCII 属性名，值可带引号) 的记号；
+# 正文里的 <我不信>、a<b 与 c>d 之类尖括号保留
+_TAG_ATTRS = r'(?:\s+[A-Za-z_:][-\w:.]*(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'<>]+))?)*\s*/?>'
+_RE_BREAK_TAG = re.compile(r'<\s*(?:br|/?p|/?div)' + _TAG_ATTRS, re.I | re.A)
+_HTML_TAG_NAMES = ("a|abbr|article|b|big|blockquote|body|center|cite|code|dd|del|div|dl|dt|em|font|h[1-6]|head|"
+                   "header|hr|html|i|img|ins|li|mark|meta|ol|p|pre|q|rp|rt|ruby|s|section|small|span|strike|"
+                   "strong|style|sub|sup|table|tbody|td|th|thead|tr|tt|u|ul|wbr")
+_RE_ANY_TAG = re.compile(r'</?(?:%s)' % _HTML_TAG_NAMES + _TAG_ATTRS, re.I | re.A)
+# 高频实体先走 str.replace (都不含 &amp;，不会二次解码)；其余实体一遍正则切分，只解码匹配到的记号，
+# 解码结果按记号缓存，命中时整段查表不回到 Python 层
+_COMMON_ENTITIES = (("&nbsp;", " "), ("&ensp;", " "), ("&emsp;", "\u3000"),
+                    ("&quot;", '"'), ("&lt;", "<"), ("&gt;", ">"))
+_RE_ENTITY = re.compile(r'(&(?:#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6}|[A-Za-z][A-Za-z0-9]{1,31});)')
+_ENTITY_CACHE_SIZE = 1 << 14
+
+
+class _EntityTable(dict):
+    """实体记号 -> 解码结果；没见过的记号交给 html.unescape 解一次，满了清空重来"""
+
+    def __missing__(self, entity):
+        if len(self) >= _ENTITY_CACHE_SIZE:
+            self.clear()
+        char = self[entity] = html.unescape(entity)
+        return char
+
+
+_entity_table = _EntityTable()
+
+
+def _decode_entities(text):
+    parts = _RE_ENTITY.split(text)
+    if len(parts) > 1:
+        parts[1::2] = map(_entity_table.__getitem__, parts[1::2])
+        text = "".join(parts)
+    return text
+
+
+# 行首空白 (含全角空格) 去掉，缩进最后统一加；只剩空白的行随之变成空行
+_RE_LINE_INDENT = re.compile(r'\n[ \t\u3000\xa0]+')
+
+
+def normalize_chapter_text(raw):
+    """把 Legado 返回的章节内容规整为纯文本：解码实体、去标签、折叠空行、统一段首缩进。
+    各步都是整段 str.replace 或一遍预编译正则，实体只解码匹配到的记号；1 MB 章节约在几毫秒到十几毫秒。"""
+    text = raw or ""
+    markup = False
+    if '<' in text:
+        length = len(text)
+        for tag in _BREAK_TAGS:
+            text = text.replace(tag, '\n')
+        if '<' in text:
+            text = _RE_BREAK_TAG.sub('\n', text)
+        markup = len(text) != length
+        if '<' in text:
+            text = _RE_ANY_TAG.sub('', text)
+    if '&' in text:
+        for entity, char in _COMMON_ENTITIES:
+            text = text.replace(entity, char)
+        if '&' in text:
+            text = _decode_entities(text)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    text = _RE_LINE_INDENT.sub('\n', text).strip()
+    # 纯文本里连续空行折叠为一个，作者有意留的场景分隔仍保留一行空行；
+    # 带标签的内容里换行与空行都由标签拼出来 (</p>\n<p>、<br><br>)，一律折叠为单个换行。
+    # 用 str.replace 逐轮折叠，比正则逐字试探快得多
+    if markup:
+        while '\n\n' in text:
+            text = text.replace('\n\n', '\n')
+    else:
+        while '\n\n\n' in text:
+            text = text.replace('\n\n\n', '\n\n')
+    if not text:
+        return ""
+    # 空行不加缩进
+    text = PARAGRAPH_INDENT + text.replace('\n', '\n' + PARAGRAPH_INDENT)
+    return text.replace('\n' + PARAGRAPH_INDENT + '\n', '\n\n')
+
+
+class ChapterTextCache:
+    """已规整章节文本的 LRU 缓存，键为 (bookUrl, 章节索引)，可跨线程访问"""
+
+    def __init__(self, capacity=CHAPTER_CACHE_SIZE):
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, book_url, chapter_index):
+        key = (book_url, chapter_index)
+        with self._lock:
+            text = self._data.get(key)
+            if text is not None:
+                self._data.move_to_end(key)
+            return text
+
+    def put(self, book_url, chapter_index, text):
+        key = (book_url, chapter_index)
+        with self._lock:
+            self._data[key] = text
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# ================= 内容净化规则 (多模式匹配) =================
+REPLACE_RULES_FILE = "replace_rules.json"  # 阅读APP导出的替换净化规则
+TRANSFORM_CACHE_SIZE = 32  # 净化结果缓存 (章节/分页窗口)
+
+_RE_REPLACEMENT_TOKEN = re.compile(r'\\(.)|\$(\d)')
+# 反向引用与命名分组：合并后编号错位或组名重复，只能单独成遍
+_RE_PATTERN_BACKREF = re.compile(r'\\[1-9]|\(\?P[=<]')
+
+
+def load_replace_rules():
+    try:
+        with open(REPLACE_RULES_FILE, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return rules if isinstance(rules, list) else [rules]
+
+
+def rule_in_scope(rule, book_name):
+    """规则未限定范围，或范围中列出的书名/书源出现在当前书名里"""
+    if not rule.get("isEnabled", True) or rule.get("scopeContent") is False:
+        return False
+    scope = (rule.get("scope") or "").strip()
+    if not scope:
+        return True
+    return any(part.strip() and part.strip() in book_name for part in re.split(r'[,;，；]', scope))
+
+
+class OffsetMap:
+    """一次替换前后的位置换算。edits 为按位置排序的 (原起点, 原终点, 新起点, 新终点)"""
+
+    def __init__(self, edits):
+        self.edits = edits
+        self.src_starts = [e[0] for e in edits]
+        self.dst_starts = [e[2] for e in edits]
+
+    def to_source(self, pos):
+        """替换后的位置 → 原文位置 (落在替换结果内部时取被替换片段的起点)"""
+        i = bisect.bisect_right(self.dst_starts, pos) - 1
+        if i < 0:
+            return pos
+        src_start, src_end, dst_start, dst_end = self.edits[i]
+        return src_start if pos < dst_end else src_end + (pos - dst_end)
+
+    def to_display(self, pos):
+        i = bisect.bisect_right(self.src_starts, pos) - 1
+        if i < 0:
+            return pos
+        src_start, src_end, dst_start, dst_end = self.edits[i]
+        return dst_start if pos < src_end else dst_end + (pos - src_end)
+
+
+class TransformResult:
+    """净化后的文本，以及逐层的位置换算"""
+
+    def __init__(self, text, maps):
+        self.text = text
+        self.maps = maps
+
+    def to_source(self, pos):
+        for offset_map in reversed(self.maps):
+            pos = offset_map.to_source(pos)
+        return pos
+
+    def to_display(self, pos):
+        for offset_map in self.maps:
+            pos = offset_map.to_display(pos)
+        return pos
+
+
+class WindowTransform:
+    """带上下文净化后，只露出原文 [start, end) 对应的那段显示文本；位置换算以该段开头为 0"""
+
+    def __init__(self, result, start, end):
+        self.result = result
+        self.source_offset = start
+        self.display_offset = result.to_display(start)
+        self.text = result.text[self.display_offset:result.to_display(end)]
+
+    def to_source(self, pos):
+        # 跨过段首的替换整段显示在本段开头，其原文起点在段首之前，按段首算
+        return max(0, self.result.to_source(pos + self.display_offset) - self.source_offset)
+
+    def to_display(self, pos):
+        return max(0, self.result.to_display(pos + self.source_offset) - self.display_offset)
+
+
+def splice_text(text, spans):
+    """按 [(起点, 终点, 替换文本)] 一次拼出新文本，同时记录位置换算"""
+    pieces, edits = [], []
+    last = delta = 0
+    for start, end, replacement in spans:
+        pieces.append(text[last:start])
+        pieces.append(replacement)
+        dst_start = start + delta
+        delta += len(replacement) - (end - start)
+        edits.append((start, end, dst_start, end + delta))
+        last = end
+    pieces.append(text[last:])
+    return "".join(pieces), OffsetMap(edits)
+
+
+class LiteralMatcher:
+    """Aho–Corasick 自动机：一次扫描找出所有字面量规则的命中，取最左最长、互不重叠的一组"""
+
+    def __init__(self, replacements):
+        self.replacements = replacements
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]  # 在该状态结束的各模式长度 (含后缀链上的)
+        for pattern in replacements:
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            self.out[state] = (len(pattern),)
+
+        # 广度优先建立失配指针，并把后缀的输出并入
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, nxt in self.goto[state].items():
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+        # 根状态下直接跳到下一个可能起始的字符 (C 速度)，正文中无关的大段文字不进 Python 循环
+        first_chars = "".join(sorted({re.escape(p[0]) for p in replacements}))
+        self.prefilter = re.compile(f"[{first_chars}]")
+
+    def find(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        matches = []
+        state, i, n = 0, 0, len(text)
+        while i < n:
+            if state == 0:
+                m = self.prefilter.search(text, i)
+                if m is None:
+                    break
+                i = m.start()
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length in out[state]:
+                matches.append((i + 1 - length, i + 1))
+            i += 1
+
+        matches.sort(key=lambda span: (span[0], -span[1]))
+        spans, last_end = [], 0
+        for start, end in matches:
+            if start >= last_end:
+                spans.append((start, end, self.replacements[text[start:end]]))
+                last_end = end
+        return spans
+
+
+class ReplaceRuleEngine:
+    """净化规则引擎：单字对单字的规则 (繁简转换等) 走 str.translate，其余字面量规则合成一个 Aho–Corasick 自动机，
+    正则规则合成一个分组交替的大正则，每种一遍扫描；正则按多行模式编译，^/$ 匹配每一行的行首/行尾。
+    同一遍内按“最左命中优先、同位置按规则顺序”替换，不做逐条规则的串行叠加。"""
+
+    def __init__(self, rules):
+        translate, literals, regex_rules = {}, {}, []
+        for rule in sorted(rules, key=lambda r: r.get("order", 0)):
+            pattern = rule.get("pattern") or ""
+            replacement = rule.get("replacement") or ""
+            if not pattern:
+                continue
+            if rule.get("isRegex"):
+                regex_rules.append((pattern, replacement))
+            elif len(pattern) == 1 and len(replacement) == 1:
+                translate.setdefault(ord(pattern), replacement)
+            else:
+                literals.setdefault(pattern, replacement)
+
+        self.translate_table = translate or None
+        self.literal_matcher = LiteralMatcher(literals) if literals else None
+        self.regex_passes = self._compile_regex_passes(regex_rules)
+        self.rule_count = len(translate) + len(literals) + len(regex_rules)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def clear_cache(self):
+        with self.lock:
+            self.cache.clear()
+
+    @staticmethod
+    def _parse_replacement(replacement):
+        """阅读APP的替换串：$n 引用分组，反斜杠转义"""
+        tokens, last = [], 0
+        for m in _RE_REPLACEMENT_TOKEN.finditer(replacement):
+            tokens.append(replacement[last:m.start()])
+            tokens.append(m.group(1) if m.group(1) is not None else int(m.group(2)))
+            last = m.end()
+        tokens.append(replacement[last:])
+        return [t for t in tokens if t != ""]
+
+    def _compile_regex_passes(self, regex_rules):
+        """能合并的正则合成一遍；含反向引用、命名分组或全局标志的单独成遍；无法编译的规则跳过"""
+        combined, separate = [], []
+        for pattern, replacement in regex_rules:
+            try:
+                re.compile(f"(?P<r>{pattern})", re.M)
+                mergeable = not _RE_PATTERN_BACKREF.search(pattern)
+            except re.error:
+                try:
+                    re.compile(pattern, re.M)
+                    mergeable = False
+                except re.error as e:
+                    print(f"净化规则无法使用: {pattern} ({e})")
+                    continue
+            (combined if mergeable else separate).append((pattern, replacement))
+
+        passes = []
+        if combined:
+            try:
+                regex = re.compile("|".join(f"(?P<r{k}>{p})" for k, (p, _) in enumerate(combined)), re.M)
+            except re.error as e:
+                # 单条能编译、合起来却不行 (如内联标志冲突)：退回逐条成遍
+                print(f"净化规则无法合并，改为逐条执行 ({e})")
+                separate = combined + separate
+            else:
+                passes.append((regex, {f"r{k}": (regex.groupindex[f"r{k}"], self._parse_replacement(r))
+                                       for k, (_, r) in enumerate(combined)}))
+        for pattern, replacement in separate:
+            regex = re.compile(pattern, re.M)
+            passes.append((regex, {None: (0, self._parse_replacement(replacement))}))
+        return passes
+
+    def apply(self, source, cache=True):
+        """净化一段文本 (一章或一个分页窗口)；相同文本直接取缓存结果"""
+        if cache:
+            with self.lock:
+                result = self.cache.get(source)
+                if result is not None:
+                    self.cache.move_to_end(source)
+                    return result
+
+        text, maps = source, []
+        if self.translate_table:
+            text = text.translate(self.translate_table)  # 逐字替换，位置不变
+        if self.literal_matcher:
+            spans = self.literal_matcher.find(text)
+            if spans:
+                text, offset_map = splice_text(text, spans)
+                maps.append(offset_map)
+        for regex, rules in self.regex_passes:
+            spans = []
+            for m in regex.finditer(text):
+                base, tokens = rules[m.lastgroup] if m.lastgroup in rules else rules[None]
+                replacement = "".join(t if isinstance(t, str) else (m.group(base + t) or "") for t in tokens)
+                if m.start() != m.end() or replacement:
+                    spans.append((m.start(), m.end(), replacement))
+            if spans:
+                text, offset_map = splice_text(text, spans)
+                maps.append(offset_map)
+
+        result = TransformResult(text, maps)
+        if cache:
+            with self.lock:
+                self.cache[source] = result
+                if len(self.cache) > TRANSFORM_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        return result
+
+
+# ================= 后台任务调度 (优先级通道) =================
+# 通道按优先级排列：交互 (用户正在等的章节/书架) > 搜索 (书内搜索拉取章节) > 预取 > 索引 (整书下载) > 同步
+LANE_INTERACTIVE, LANE_SEARCH, LANE_PREFETCH, LANE_INDEXING, LANE_SYNC = range(5)
+LANE_LIMITS = {LANE_INTERACTIVE: 2, LANE_SEARCH: 2, LANE_PREFETCH: 1, LANE_INDEXING: 3, LANE_SYNC: 1}  # 各通道并发上限
+IDLE_LANES = (LANE_PREFETCH, LANE_INDEXING)      # 只在用户停止操作后才开始
+PAUSABLE_LANES = (LANE_PREFETCH, LANE_INDEXING)  # 老板键隐藏窗口时暂停；同步照常，避免丢进度
+SCHEDULER_WORKERS = 5
+IDLE_GRACE = 0.3  # 最后一次翻页/滚轮后多久算空闲 (秒)
+
+
+class TaskScheduler:
+    """全局后台任务调度：固定工作线程 + 优先级通道。
+    submit 返回 concurrent.futures.Future，可 cancel / as_completed；同 key 的新任务会取消尚未开始的旧任务。
+    始终留一个线程给交互通道，低优先级任务再多也不会让用户等待的请求排队。"""
+
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.worker_count = workers
+        self.cond = threading.Condition()
+        self.queues = {lane: deque() for lane in LANE_LIMITS}
+        self.running = {lane: 0 for lane in LANE_LIMITS}
+        self.keyed = {}  # key -> 尚未开始的 Future
+        self.paused = False
+        self.last_activity = 0.0
+        self.threads = []
+
+    def submit(self, lane, fn, *args, key=None):
+        future = Future()
+        with self.cond:
+            if key is not None:
+                previous = self.keyed.get(key)
+                if previous is not None:
+                    previous.cancel()
+                self.keyed[key] = future
+            self.queues[lane].append((future, fn, args, key))
+            if len(self.threads) < self.worker_count:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.cond.notify_all()
+        return future
+
+    def cancel(self, key):
+        with self.cond:
+            future = self.keyed.pop(key, None)
+        if future is not None:
+            future.cancel()
+
+    def pause(self):
+        with self.cond:
+            self.paused = True
+
+    def resume(self):
+        with self.cond:
+            self.paused = False
+            self.cond.notify_all()
+
+    def note_activity(self):
+        """用户正在操作 (翻页/滚轮)：空闲通道顺延"""
+        self.last_activity = time.monotonic()
+
+    def _next_task(self):
+        """按优先级找下一个可执行的任务；都不能执行时返回需要等待的秒数 (None 表示等通知)"""
+        busy = sum(self.running.values())
+        wait = None
+        for lane in LANE_LIMITS:
+            queue = self.queues[lane]
+            while queue and queue[0][0].cancelled():
+                self._forget(queue.popleft())
+            if not queue or self.running[lane] >= LANE_LIMITS[lane]:
+                continue
+            if lane != LANE_INTERACTIVE:
+                if busy >= self.worker_count - 1:
+                    continue
+                if self.paused and lane in PAUSABLE_LANES:
+                    continue
+                if lane in IDLE_LANES:
+                    if self.running[LANE_INTERACTIVE] or self.queues[LANE_INTERACTIVE]:
+                        continue
+                    idle_in = self.last_activity + IDLE_GRACE - time.monotonic()
+                    if idle_in > 0:
+                        wait = idle_in if wait is None else min(wait, idle_in)
+                        continue
+            return lane, queue.popleft(), None
+        return None, None, wait
+
+    def _forget(self, task):
+        key = task[3]
+        if key is not None and self.keyed.get(key) is task[0]:
+            del self.keyed[key]
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                lane, task, wait = self._next_task()
+                while task is None:
+                    self.cond.wait(wait)
+                    lane, task, wait = self._next_task()
+                self._forget(task)
+                future, fn, args, _ = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.running[lane] += 1
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.cond:
+                    self.running[lane] -= 1
+                    self.cond.notify_all()
+
+
+# ================= Legado 连接监测 (熔断与自适应超时) =================
+CONNECT_TIMEOUT = (0.5, 2.0, 3.0)  # 建连超时 (下限, 初始, 上限)，按探测到的往返时间自适应
+# 各类请求的读超时 (下限, 初始, 上限)，按实测耗时自适应
+READ_TIMEOUTS = {
+    "bookshelf": (2.0, 3.0, 10.0),
+    "toc": (3.0, 10.0, 30.0),
+    "content": (3.0, 5.0, 20.0),
+    "sync": (2.0, 3.0, 5.0),
+}
+PROBE_INTERVAL = 15      # 连接正常时的探测间隔 (秒)
+BREAKER_THRESHOLD = 2    # 连续几次连不上就熔断
+BREAKER_MAX_BACKOFF = 60  # 熔断后重新探测的最长间隔 (秒)
+SYNC_DEBOUNCE = 1500     # 章内翻页停下多久后把进度同步给阅读APP (毫秒)
+QUIT_SYNC_TIMEOUT = 1.5  # 退出时等待最后一次进度同步的上限 (秒)
+
+
+class EndpointUnavailable(requests.exceptions.ConnectionError):
+    """熔断期间直接拒绝请求，不再等待超时"""
+
+
+class LatencyEstimator:
+    """平滑往返时间与抖动 (同 TCP 重传超时的估算)，超时 = 平滑值 + 4 倍抖动"""
+
+    def __init__(self, floor, initial, ceiling):
+        self.floor, self.initial, self.ceiling = floor, initial, ceiling
+        self.srtt = None
+        self.rttvar = 0.0
+
+    def add(self, sample):
+        if self.srtt is None:
+            self.srtt, self.rttvar = sample, sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+
+    def timeout(self):
+        if self.srtt is None:
+            return self.initial
+        return min(self.ceiling, max(self.floor, self.srtt + 4 * self.rttvar))
+
+
+class EndpointMonitor:
+    """后台探测阅读APP接口的可达性与往返时间；连续连不上时熔断，所有请求立即失败，按退避间隔重新探测恢复"""
+
+    def __init__(self, ip, on_change=None):
+        self.on_change = on_change  # 可用性变化回调 (在探测线程中调用)
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.thread = None
+        self.paused = False  # 窗口隐藏期间不探测
+        self.set_ip(ip)
+
+    def set_ip(self, ip):
+        """地址变化后重置全部统计，并立即探测一次"""
+        with self.lock:
+            recovered = getattr(self, 'available', True) is False
+            self.ip = (ip or "").rstrip('/')
+            self.connect_latency = LatencyEstimator(*CONNECT_TIMEOUT)
+            self.read_latency = {kind: LatencyEstimator(*limits) for kind, limits in READ_TIMEOUTS.items()}
+            self.failures = 0
+            self.trips = 0
+            self.retry_at = 0.0
+            self.available = True
+        self.wake_event.set()
+        if recovered and self.on_change:
+            self.on_change(True)  # 托盘提示不再停在"未连接"；新地址连不上时探测会再熔断
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self.thread.start()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        """恢复探测并立即探测一次，重新显示时拿到最新的连接状态"""
+        self.paused = False
+        self.wake_event.set()
+
+    def is_available(self):
+        return self.available
+
+    def retry_in(self):
+        return max(0, int(self.retry_at - time.time() + 0.5))
+
+    # --- 请求入口：熔断检查 + 自适应超时 + 统计 ---
+    def get(self, path, kind, **kwargs):
+        return self._request("GET", path, kind, **kwargs)
+
+    def post(self, path, kind, **kwargs):
+        return self._request("POST", path, kind, **kwargs)
+
+    def _request(self, method, path, kind, **kwargs):
+        if not self.available:
+            raise EndpointUnavailable(f"阅读APP未连接，{self.retry_in()} 秒后重试")
+        read_latency = self.read_latency[kind]
+        timeout = (self.connect_latency.timeout(), read_latency.timeout())
+        t0 = time.perf_counter()
+        try:
+            res = requests.request(method, f"{self.ip}{path}", timeout=timeout, **kwargs)
+        except requests.exceptions.ReadTimeout:
+            # 连得上但响应慢：拉长该类请求的超时，不算作断线
+            read_latency.add(timeout[1])
+            raise
+        except requests.exceptions.ConnectionError:
+            self._record_failure()
+            raise
+        if not kwargs.get("stream"):
+            # 流式请求此刻只收到响应头，耗时不代表整个响应，不计入往返时间统计
+            read_latency.add(time.perf_counter() - t0)
+        self._record_success()
+        return res
+
+    # --- 熔断状态 ---
+    def _record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def _record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if not self.available or self.failures < BREAKER_THRESHOLD:
+                return
+            self.available = False
+            self.trips = 1
+            self.retry_at = time.time() + 1
+        self.wake_event.set()
+        if self.on_change:
+            self.on_change(False)
+
+    def _probe_loop(self):
+        while True:
+            if self.paused:
+                wait = None  # 一直睡到 resume() 唤醒
+            elif self.available:
+                wait = PROBE_INTERVAL
+            else:
+                wait = max(0.0, self.retry_at - time.time())
+            self.wake_event.wait(wait)
+            self.wake_event.clear()
+            if self.paused:
+                continue
+            if self.available or time.time() >= self.retry_at:
+                self._probe()
+
+    def _probe(self):
+        """探测 = 一次 TCP 建连，不占用手机端的接口处理"""
+        parts = urlsplit(self.ip)
+        if not parts.hostname:
+            return
+        t0 = time.perf_counter()
+        try:
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            with socket.create_connection((parts.hostname, port),
+                                          timeout=self.connect_latency.ceiling):
+                pass
+        except OSError:
+            if self.available:
+                self._record_failure()
+            else:
+                with self.lock:
+                    self.trips += 1
+                    self.retry_at = time.time() + min(BREAKER_MAX_BACKOFF, 2 ** (self.trips - 1))
+            return
+
+        self.connect_latency.add(time.perf_counter() - t0)
+        with self.lock:
+            recovered = not self.available
+            self.available = True
+            self.failures = 0
+            self.trips = 0
+        if recovered and self.on_change:
+            self.on_change(True)
+
+
+# ================= 离线章节仓库与整书下载 =================
+DOWNLOAD_CONCURRENCY = 3  # 同时进行的请求数，手机上的 Web 服务扛不住太多并发
+DOWNLOAD_INTERVAL = 0.15  # 相邻两次请求的最小间隔 (秒)
+DOWNLOAD_RETRIES = 3
+
+
+def book_cache_key(book_url):
+    return hashlib.sha1(book_url.encode('utf-8')).hexdigest()[:16]
+
+
+class ChapterStore:
+    """按书存放在磁盘上的已规整章节正文，每章一个文件：cache/chapters/<书>/<索引>.txt"""
+
+    def __init__(self, book_url):
+        self.directory = os.path.join(CACHE_DIR, "chapters", book_cache_key(book_url))
+
+    def _path(self, chapter_index):
+        return os.path.join(self.directory, f"{chapter_index}.txt")
+
+    def has(self, chapter_index):
+        return os.path.exists(self._path(chapter_index))
+
+    def stored_indices(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return set()
+        return {int(name[:-4]) for name in names if name.endswith(".txt") and name[:-4].isdigit()}
+
+    def load(self, chapter_index):
+        try:
+            with open(self._path(chapter_index), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save(self, chapter_index, text):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(chapter_index)
+        # 先写临时文件再替换，中断时不会留下半章
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+# ================= 目录流式解析 (边下载边解析) =================
+TOC_STREAM_CHUNK = 32 << 10  # 每次从连接读取的字节数，每读一块交出一批章节
+
+_RE_JSON_SPACE = re.compile(r'\s*')
+_RE_JSON_SEPARATOR = re.compile(r'[\s,]*')
+_RE_JSON_NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*')
+
+
+class ChapterListStream:
+    """增量解析 {"isSuccess": ..., "errorMsg": ..., "data": [章节, ...]} 形式的响应 (仅用标准库)。
+
+    feed() 每喂入一块字节，就返回 data 数组中新近完整的章节对象；数组外的顶层字段留在 fields 里。
+    已解析的文本随即丢弃，不同时持有整个响应与整份章节列表。
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ""
+        self.pos = 0
+        self.state = "start"  # start → key → colon → value / array → ... → end
+        self.key = None
+        self.fields = {}
+
+    def feed(self, data, final=False):
+        self.buf = self.buf[self.pos:] + self.text_decoder.decode(data, final)
+        self.pos = 0
+        items = []
+        while self._step(items, final):
+            pass
+        return items
+
+    def close(self):
+        items = self.feed(b"", final=True)
+        if self.state != "end":
+            raise ValueError("目录数据不完整")
+        return items
+
+    def _decode(self, final):
+        """从当前位置解出一个完整的 JSON 值；数据还没收全时返回 (None, False)"""
+        try:
+            value, end = self.decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None, False
+        # 数字后面直到缓冲区末尾都还是数字字符时可能还没收全 (如 12 后面还有 3，"4." 后面还有 "5e10")
+        if not final and (end >= len(self.buf) or (self.buf[self.pos] in '-0123456789'
+                                                   and _RE_JSON_NUMBER_TAIL.fullmatch(self.buf, end))):
+            return None, False
+        self.pos = end
+        return value, True
+
+    def _step(self, items, final):
+        """推进一个记号，返回是否还能继续 (False 表示等待更多数据或已结束)"""
+        buf, state = self.buf, self.state
+        skip = _RE_JSON_SEPARATOR if state in ("key", "array") else _RE_JSON_SPACE
+        self.pos = skip.match(buf, self.pos).end()
+        if self.pos >= len(buf) or state == "end":
+            return False
+        ch = buf[self.pos]
+        if state == "start":
+            if ch != '{':
+                raise ValueError("目录数据不是 JSON 对象")
+            self.pos += 1
+            self.state = "key"
+        elif state == "key":
+            if ch == '}':
+                self.pos += 1
+                self.state = "end"
+                return False
+            key, ok = self._decode(final)
+            if not ok:
+                return False
+            self.key = key
+            self.state = "colon"
+        elif state == "colon":
+            if ch != ':':
+                raise ValueError("目录数据格式错误")
+            self.pos += 1
+            self.state = "value"
+        elif state == "value":
+            if self.key == "data" and ch == '[':
+                self.pos += 1
+                self.state = "array"
+            else:
+                value, ok = self._decode(final)
+                if not ok:
+                    return False
+                self.fields[self.key] = value
+                self.state = "key"
+        else:  # array
+            if ch == ']':
+                self.pos += 1
+                self.state = "key"
+            else:
+                item, ok = self._decode(final)
+                if not ok:
+                    return False
+                items.append(item)
+        return True
+
+
+def iter_toc_batches(endpoint, book_url):
+    """流式下载目录，每从连接读到一块就交出其中完整的章节 (工作线程中调用)"""
+    res = endpoint.get("/getChapterList", "toc", params={"url": book_url}, stream=True)
+    with res:
+        if res.status_code != 200:
+            raise RuntimeError(f"HTTP {res.status_code}")
+        parser = ChapterListStream()
+        for chunk in res.iter_content(TOC_STREAM_CHUNK):
+            batch = parser.feed(chunk)
+            if batch:
+                yield batch
+        batch = parser.close()
+    if not parser.fields.get('isSuccess'):
+        raise RuntimeError(parser.fields.get('errorMsg') or '目录获取失败')
+    if batch:
+        yield batch
+
+
+def fetch_toc(endpoint, book_url):
+    """在工作线程中同步获取目录"""
+    return [chapter for batch in iter_toc_batches(endpoint, book_url) for chapter in batch]
+
+
+# ================= 目录紧凑存储 (按书缓存) =================
+TOC_CACHE_VERSION = 1
+
+
+class CompactToc:
+    """目录的紧凑表示：标题驻留、章节序号存数组、各章 URL 拼成一个字符串按偏移切取。
+    按下标取出的是 {'title', 'index', 'url'} 字典，与接口返回的章节条目用法一致。"""
+
+    def __init__(self, titles, indices, urls, meta=None):
+        # 目录内驻留：重复的标题 (卷名、“番外”等) 共用一个对象；不用 sys.intern，免得全局驻留表只增不减
+        pool = {}
+        self.titles = [pool.setdefault(t, t) for t in titles]
+        self.indices = array('l', indices)
+        self.url_blob = "".join(urls)
+        self.url_offsets = array('l', [0])
+        for url in urls:
+            self.url_offsets.append(self.url_offsets[-1] + len(url))
+        self.meta = meta or {}  # 生成目录时书架上的章节数与更新时间
+
+    @classmethod
+    def from_chapters(cls, chapters, meta=None):
+        titles = [str(c.get('title') or f"第 {i + 1} 章") for i, c in enumerate(chapters)]
+        indices = [c.get('index', i) for i, c in enumerate(chapters)]
+        urls = [c.get('url') or "" for c in chapters]
+        return cls(titles, indices, urls, meta)
+
+    @staticmethod
+    def book_meta(book):
+        return {"totalChapterNum": book.get("totalChapterNum"),
+                "latestChapterTime": book.get("latestChapterTime")}
+
+    def is_current(self, book):
+        """书架上的章节数、更新时间与生成目录时一致；书架不提供这两项时总要重新核对"""
+        meta = self.book_meta(book)
+        return any(v is not None for v in meta.values()) and meta == self.meta
+
+    def url(self, i):
+        return self.url_blob[self.url_offsets[i]: self.url_offsets[i + 1]]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __getitem__(self, i):
+        if not -len(self.titles) <= i < len(self.titles):
+            raise IndexError(i)
+        i %= len(self.titles)
+        return {'title': self.titles[i], 'index': self.indices[i], 'url': self.url(i)}
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self.titles)))
+
+
+def toc_cache_path(book_url):
+    return os.path.join(CACHE_DIR, "toc", f"{book_cache_key(book_url)}.json")
+
+
+def load_cached_toc(book_url):
+    try:
+        with open(toc_cache_path(book_url), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("v") != TOC_CACHE_VERSION:
+        return None
+    return CompactToc(data["titles"], data["indices"], data["urls"], data.get("meta"))
+
+
+def save_cached_toc(book_url, toc):
+    path = toc_cache_path(book_url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"v": TOC_CACHE_VERSION, "meta": toc.meta, "titles": toc.titles,
+                   "indices": list(toc.indices), "urls": [toc.url(i) for i in range(len(toc))]},
+                  f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def fetch_compact_toc(endpoint, book, on_batch=None):
+    """流式下载目录、边收边转为紧凑表示并写入缓存 (工作线程中调用)；on_batch 收到每批新到的章节"""
+    titles, indices, urls = [], [], []
+    for batch in iter_toc_batches(endpoint, book['bookUrl']):
+        for chapter in batch:
+            i = len(titles)
+            titles.append(str(chapter.get('title') or f"第 {i + 1} 章"))
+            indices.append(chapter.get('index', i))
+            urls.append(chapter.get('url') or "")
+        if on_batch:
+            on_batch(batch)
+    toc = CompactToc(titles, indices, urls, CompactToc.book_meta(book))
+    try:
+        save_cached_toc(book['bookUrl'], toc)
+    except OSError as e:
+        print(f"目录缓存写入失败: {e}")
+    return toc
+
+
+class RateLimiter:
+    """多线程共享：保证相邻两次请求的发出间隔不小于 interval 秒"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, cancel_event):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            cancel_event.wait(slot - now)
+
+
+class BookDownloader:
+    """整书/后续 N 章离线下载：有界并发 + 限速，已存章节跳过，中断后再次下载即续传"""
+
+    def __init__(self, endpoint, scheduler, book_url, toc, first_index=0, count=None,
+                 on_progress=None, on_finished=None):
+        self.endpoint = endpoint
+        self.scheduler = scheduler
+        self.book_url = book_url
+        self.toc = toc
+        self.first_index = first_index
+        self.count = count
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.store = ChapterStore(book_url)
+        self.limiter = RateLimiter(DOWNLOAD_INTERVAL)
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _chapter_indices(self):
+        toc = self.toc or fetch_toc(self.endpoint, self.book_url)
+        indices = [chapter.get('index', i) for i, chapter in enumerate(toc)]
+        indices = [i for i in indices if i >= self.first_index]
+        return indices[:self.count] if self.count else indices
+
+    def _run(self):
+        done = total = failed = 0
+        try:
+            indices = self._chapter_indices()
+            stored = self.store.stored_indices()
+            pending = [i for i in indices if i not in stored]
+            total = len(indices)
+            done = total - len(pending)
+            self.on_progress(done, total)
+
+            # 逐章作为索引通道任务：只在空闲时下载，随时让位给正在阅读的章节
+            futures = [self.scheduler.submit(LANE_INDEXING, self._fetch_one, i) for i in pending]
+            try:
+                for future in as_completed(futures):
+                    if self.cancel_event.is_set():
+                        break
+                    if future.result():
+                        done += 1
+                    else:
+                        failed += 1
+                    self.on_progress(done, total)
+            finally:
+                for future in futures:
+                    future.cancel()
+        except Exception as e:
+            print(f"离线下载失败: {e}")
+            failed = max(failed, 1)
+        self.on_finished(done, total, failed, self.cancel_event.is_set())
+
+    def _fetch_one(self, chapter_index):
+        for attempt in range(DOWNLOAD_RETRIES):
+            if self.cancel_event.is_set():
+                return False
+            self.limiter.wait(self.cancel_event)
+            try:
+                res = self.endpoint.get("/getBookContent", "content",
+                                        params={'url': self.book_url, 'index': chapter_index})
+                if res.status_code == 200:
+                    data = res.json()
+                    if data.get("isSuccess"):
+                        self.store.save(chapter_index, normalize_chapter_text(data.get("data", "")))
+                        return True
+            except Exception:
+                pass
+            # 失败退避，避免压垮手机端
+            self.cancel_event.wait(0.5 * (2 ** attempt))
+        return False
+
+
+# ================= 书内全文搜索 =================
+SEARCH_MAX_HITS = 500     # 命中过多时提前结束
+SEARCH_SNIPPET = 18       # 摘要中关键词前后各保留的字数
+SEARCH_ANCHOR_SLACK = 120  # 命中处离段首不远时从段首开始显示
+SEARCH_INTERVAL = 0.05    # 搜索是交互操作，限速比后台下载宽松
+
+
+class BookSearcher:
+    """在整本书中查找关键词：已缓存/已下载的章节先搜，其余以有限并发拉取；每章的命中即时回报"""
+
+    def __init__(self, endpoint, scheduler, book_url, toc, keyword, chapter_cache,
+                 on_hits=None, on_progress=None, on_finished=None, engine=None):
+        self.endpoint = endpoint
+        self.scheduler = scheduler
+        self.engine = engine  # 与阅读时相同的净化规则，命中位置才能与显示对应
+        self.book_url = book_url
+        self.toc = toc
+        self.keyword = keyword
+        self.chapter_cache = chapter_cache
+        self.store = ChapterStore(book_url)
+        self.limiter = RateLimiter(SEARCH_INTERVAL)
+        self.cancel_event = threading.Event()
+        self.on_hits = on_hits or (lambda hits: None)
+        self.on_progress = on_progress or (lambda done, total: None)
+        self.on_finished = on_finished or (lambda done, total, hits, truncated: None)
+        self.hit_count = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _run(self):
+        done = total = 0
+        try:
+            toc = self.toc or fetch_toc(self.endpoint, self.book_url)
+            chapters = [(chapter.get('index', i), str(chapter.get('title') or f"第 {i + 1} 章"))
+                        for i, chapter in enumerate(toc)]
+            total = len(chapters)
+            stored = self.store.stored_indices()
+
+            # 本地已有的章节不走网络，先出结果
+            pending = []
+            for chapter_index, title in chapters:
+                if self.cancel_event.is_set():
+                    break
+                text = self.chapter_cache.get(self.book_url, chapter_index)
+                if text is None and chapter_index in stored:
+                    text = self.store.load(chapter_index)
+                if text is None:
+                    pending.append((chapter_index, title))
+                    continue
+                self._scan(chapter_index, title, text)
+                done += 1
+                self.on_progress(done, total)
+
+            if pending and not self.cancel_event.is_set():
+                # 用户正等着结果：走搜索通道，不等空闲也不随隐藏暂停，且不占交互通道的名额
+                futures = {self.scheduler.submit(LANE_SEARCH, self._fetch, i): (i, title) for i, title in pending}
+                try:
+                    for future in as_completed(futures):
+                        if self.cancel_event.is_set():
+                            break
+                        text = future.result()
+                        if text is not None:
+                            self._scan(*futures[future], text)
+                        done += 1
+                        self.on_progress(done, total)
+                finally:
+                    for future in futures:
+                        future.cancel()
+        except Exception as e:
+            print(f"书内搜索失败: {e}")
+        self.on_finished(done, total, self.hit_count, self.hit_count >= SEARCH_MAX_HITS)
+
+    def _fetch(self, chapter_index):
+        """拉取一章用于搜索；只读不缓存，避免挤掉阅读用的章节缓存"""
+        if self.cancel_event.is_set():
+            return None
+        self.limiter.wait(self.cancel_event)
+        try:
+            res = self.endpoint.get("/getBookContent", "content",
+                                    params={'url': self.book_url, 'index': chapter_index})
+            if res.status_code != 200:
+                return None  # 5xx 等错误页不是 JSON，不去解析
+            data = res.json()
+            if data.get("isSuccess"):
+                return normalize_chapter_text(data.get("data", ""))
+        except Exception:
+            pass
+        return None
+
+    def _scan(self, chapter_index, title, text):
+        """回报 [(章节序号, 标题, 章内跳转位置, 命中位置, 摘要)]"""
+        if self.engine:
+            text = self.engine.apply(text, cache=False).text
+        keyword = self.keyword
+        hits = []
+        pos = text.find(keyword)
+        while pos != -1 and self.hit_count + len(hits) < SEARCH_MAX_HITS:
+            anchor, snippet = search_hit(text, pos, keyword, text.rfind('\n', 0, pos) + 1)
+            hits.append((chapter_index, title, anchor, pos, snippet))
+            pos = text.find(keyword, pos + len(keyword))
+        if hits:
+            self.hit_count += len(hits)
+            self.on_hits(hits)
+        if self.hit_count >= SEARCH_MAX_HITS:
+            self.cancel_event.set()
+
+
+def search_hit(text, pos, keyword, para_start):
+    """命中的 (跳转位置, 摘要)：离段首不远时从段首开始显示"""
+    anchor = para_start if pos - para_start <= SEARCH_ANCHOR_SLACK else pos
+    before = text[max(para_start, pos - SEARCH_SNIPPET): pos]
+    after = text[pos + len(keyword): pos + len(keyword) + SEARCH_SNIPPET].split('\n', 1)[0]
+    return anchor, f"{before}【{keyword}】{after}".strip()
+
+
+class LocalBookSearcher:
+    """在本地书全文中查找关键词，回调与 BookSearcher 相同；命中位置与跳转位置都是全文偏移。
+    按章节分段查找、逐章回报；命中所在段落用行首索引二分定位 (预处理过的书直接用缓存的索引，否则向前找换行)。
+    查找的是原文，与阅读进度一样按原文位置跳转。"""
+
+    def __init__(self, text, chapters, line_index, book_name, keyword,
+                 on_hits=None, on_progress=None, on_finished=None):
+        self.text = text
+        self.chapters = chapters
+        self.line_index = line_index  # 打包的行首偏移表，可为 None
+        self.book_name = book_name
+        self.keyword = keyword
+        self.cancel_event = threading.Event()
+        self.on_hits = on_hits or (lambda hits: None)
+        self.on_progress = on_progress or (lambda done, total: None)
+        self.on_finished = on_finished or (lambda done, total, hits, truncated: None)
+        self.hit_count = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _run(self):
+        # 第一章之前的内容 (书名、简介等) 单独成一段，序号 -1 排在最前
+        sections = [(i, offset, title) for i, (offset, title) in enumerate(self.chapters)]
+        if not sections or sections[0][1] > 0:
+            sections.insert(0, (-1, 0, self.book_name))
+        line_starts = unpack_offsets(self.line_index) if self.line_index else None
+        done = 0
+        for k, (chapter_index, start, title) in enumerate(sections):
+            if self.cancel_event.is_set():
+                break
+            end = sections[k + 1][1] if k + 1 < len(sections) else len(self.text)
+            self._scan(chapter_index, title, start, end, line_starts)
+            done += 1
+            self.on_progress(done, len(sections))
+        self.on_finished(done, len(sections), self.hit_count, self.hit_count >= SEARCH_MAX_HITS)
+
+    def _scan(self, chapter_index, title, start, end, line_starts):
+        text, keyword = self.text, self.keyword
+        hits = []
+        pos = text.find(keyword, start, end)
+        while pos != -1 and self.hit_count + len(hits) < SEARCH_MAX_HITS:
+            if line_starts is not None:
+                para_start = line_starts[bisect.bisect_right(line_starts, pos) - 1]
+            else:
+                para_start = text.rfind('\n', 0, pos) + 1
+            anchor, snippet = search_hit(text, pos, keyword, para_start)
+            hits.append((chapter_index, title, anchor, pos, snippet))
+            pos = text.find(keyword, pos + len(keyword), end)
+        if hits:
+            self.hit_count += len(hits)
+            self.on_hits(hits)
+        if self.hit_count >= SEARCH_MAX_HITS:
+            self.cancel_event.set()
+
+
+# ================= 本地文本解码与章节索引 =================
+LOCAL_ENCODINGS = ("utf-8-sig", "gb18030")
+# 续读追加内容时使用的编码 (BOM 只出现在文件开头)
+TAIL_ENCODINGS = {"utf-8-sig": "utf-8"}
+
+_RE_CHAPTER_HEADING = re.compile(
+    r'^[ \t\u3000]*((?:第[0-9０-９零〇一二两三四五六七八九十百千万]+[章回节卷集部篇]|序章|楔子|尾声|番外)[^\n]{0,40})$',
+    re.M)
+
+
+def translate_newlines(text):
+    """与文本模式读取一致：\r\n 和 \r 统一为 \n"""
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def decode_book_bytes(raw):
+    """依次尝试 UTF-8 / GB18030 解码，返回 (文本, 编码)；都失败时返回 (None, None)"""
+    for encoding in LOCAL_ENCODINGS:
+        try:
+            return translate_newlines(raw.decode(encoding)), encoding
+        except UnicodeDecodeError:
+            continue
+    return None, None
+
+
+def scan_chapter_headings(text, start=0):
+    """从 start (须为行首) 开始识别章节标题行，返回 [(行首偏移, 标题)]"""
+    return [(m.start(), m.group(1).strip()) for m in _RE_CHAPTER_HEADING.finditer(text, start)]
+
+
+def line_start_offsets(text):
+    """各行行首的字符偏移 (含 0)，书内搜索据此定位命中所在的段落"""
+    starts = array('l', [0])
+    starts.extend(m.end() for m in re.finditer('\n', text))
+    return starts
+
+
+def pack_offsets(offsets):
+    """升序偏移表存成差分 + zlib + base64 的字符串，随预处理结果缓存 (比 JSON 数组小一个数量级)"""
+    deltas = array('I', [b - a for a, b in zip([0] + list(offsets[:-1]), offsets)])
+    return base64.b64encode(zlib.compress(deltas.tobytes())).decode('ascii')
+
+
+def unpack_offsets(packed):
+    deltas = array('I')
+    deltas.frombytes(zlib.decompress(base64.b64decode(packed)))
+    return array('l', accumulate(deltas))
+
+
+PREFIX_CRC_CHUNK = 1 << 20       # 核对已读部分时每次读入的字节数
+PREFIX_EDGE_SPAN = 1 << 12       # 每次文件变化都核对的已读部分开头与末尾字节数
+PREFIX_FULL_CHECK_INTERVAL = 60  # 整段 crc 核对的最短间隔 (秒)，其间只核对两端
+
+
+def file_prefix_crc(f, length, chunk=PREFIX_CRC_CHUNK):
+    """文件前 length 字节的 crc32，分块流式计算，不解码。
+    与随读随更新的 crc 比较即可判断已读部分是否原样未动 (中间原地改同样长度的内容也能发现)。"""
+    f.seek(0)
+    crc = 0
+    while length > 0:
+        data = f.read(min(chunk, length))
+        if not data:
+            return None  # 文件比已读部分还短
+        crc = zlib.crc32(data, crc)
+        length -= len(data)
+    return crc
+
+
+def extend_prefix_edges(edges, data):
+    """已读字节追加 data 之后的 (开头, 末尾) 各 PREFIX_EDGE_SPAN 字节"""
+    head, tail = edges
+    if len(head) < PREFIX_EDGE_SPAN:
+        head += data[:PREFIX_EDGE_SPAN - len(head)]
+    return head, (tail + data[-PREFIX_EDGE_SPAN:])[-PREFIX_EDGE_SPAN:]
+
+
+def prefix_unchanged(f, length, crc, edges, full):
+    """文件前 length 字节是否仍是已读的内容：每次只比开头与旧文末两小段原始字节，
+    full 为真时再流式核对整段 crc (中间原地改同样长度的内容要靠它发现)"""
+    size = os.fstat(f.fileno()).st_size
+    if size < length:
+        return False
+    if size == length:
+        full = True  # 没有增长却收到变化通知，改动只可能在已读部分里
+    head, tail = edges
+    f.seek(0)
+    if f.read(len(head)) != head:
+        return False
+    f.seek(length - len(tail))
+    if f.read(len(tail)) != tail:
+        return False
+    return not full or file_prefix_crc(f, length) == crc
+
+
+def read_local_growth(path, length, crc, edges, full):
+    """核对已读部分后读出文件在 length 之后新增的字节；已读部分被改动时返回 None (工作线程中调用)"""
+    with open(path, 'rb') as f:
+        if not prefix_unchanged(f, length, crc, edges, full):
+            return None
+        f.seek(length)
+        return f.read()
+
+
+def decode_appended(data, encoding, pending_cr):
+    """解码追加的字节，返回 (新增文本, 消耗的字节数, 新增部分是否以 \r 结尾)。
+    末尾没写完的多字节字符不消耗，留到下次；旧文末的 \r 与新增开头的 \n 是同一个 CRLF"""
+    decoder = codecs.getincrementaldecoder(TAIL_ENCODINGS.get(encoding, encoding))()
+    tail = decoder.decode(data, final=False)
+    consumed = len(data) - len(decoder.getstate()[0])
+    if not consumed:
+        return "", 0, pending_cr
+    if pending_cr and tail.startswith('\n'):
+        tail = tail[1:]
+    return translate_newlines(tail), consumed, tail.endswith('\r')
+
+
+# ================= 阅读位置指纹 (文件改动后找回原位置) =================
+FINGERPRINT_WINDOW = 32       # 锚点前、后各取多少个非空白字符做指纹
+REANCHOR_FIRST_SPAN = 1 << 16  # 首轮在旧位置前后多少字符内查找，找不到每轮扩大 4 倍
+REANCHOR_MAX_SPAN = 1 << 20    # 最远查到旧位置前后多少字符，整本找不到时约 1~2 秒就放弃
+_FP_BASE = 131
+_FP_MOD = (1 << 61) - 1
+_RE_NON_SPACE = re.compile(r'\S+')
+
+
+def _window_hash(chars):
+    h = 0
+    for c in chars:
+        h = (h * _FP_BASE + ord(c)) % _FP_MOD
+    return h
+
+
+def position_fingerprint(text, pos, identity):
+    """锚点的内容指纹：前后各一段非空白字符的哈希 (不保存原文)，以及生成时文件的 (字节数, CRC)
+
+    只看非空白字符，重新下载/转码后缩进、空行不同也能认出同一段文字。
+    """
+    pos = min(max(0, pos), len(text))
+    before = after = ""
+    span = FINGERPRINT_WINDOW * 4
+    while len(after) < FINGERPRINT_WINDOW and pos + span // 2 < len(text):
+        after = "".join(text[pos:pos + span].split())
+        span *= 4
+    after = after or "".join(text[pos:].split())
+    span = FINGERPRINT_WINDOW * 4
+    while len(before) < FINGERPRINT_WINDOW and pos - span // 2 > 0:
+        before = "".join(text[max(0, pos - span):pos].split())
+        span *= 4
+    before = before or "".join(text[:pos].split())
+    return {
+        "identity": list(identity),
+        "before": _window_hash(before[-FINGERPRINT_WINDOW:]) if len(before) >= FINGERPRINT_WINDOW else None,
+        "after": _window_hash(after[:FINGERPRINT_WINDOW]) if len(after) >= FINGERPRINT_WINDOW else None,
+    }
+
+
+def _find_fingerprint(text, lo, hi, before, after):
+    """在 text[lo:hi] 中滚动哈希查找指纹，返回所有命中对应的锚点位置。
+    逐段跳过空白，只保留窗口大小的编码环，不为整段建逐字位置表；命中时再回头数出窗口起点。"""
+    w = FINGERPRINT_WINDOW
+    top = pow(_FP_BASE, w - 1, _FP_MOD)
+    ring = [0] * w  # 当前窗口各字符的编码 (环形)
+    h = count = 0
+    hits = []
+    pending = False  # 刚匹配上“前段”，锚点是下一个非空白字符
+    for m in _RE_NON_SPACE.finditer(text, lo, hi):
+        if pending:
+            hits.append(m.start())
+            pending = False
+        for i, code in enumerate(map(ord, m.group())):
+            slot = count % w
+            h = ((h - ring[slot] * top) * _FP_BASE + code) % _FP_MOD
+            ring[slot] = code
+            count += 1
+            if (h == after or h == before) and count >= w:
+                end = m.start() + i + 1  # 窗口末字符之后
+                if h == after:
+                    hits.append(_non_space_boundary(text, end, w, False))
+                elif end < m.end():
+                    hits.append(end)
+                else:
+                    pending = True
+    if pending:
+        # 前段就在区间末尾：锚点落在区间之后的第一个非空白字符
+        m = _RE_NON_SPACE.search(text, hi)
+        hits.append(m.start() if m else len(text))
+    return hits
+
+
+def _non_space_boundary(text, pos, count, forward=True):
+    """从 pos 起向后 (或向前) 数过 count 个非空白字符后的位置；不够时到文本端点"""
+    if forward:
+        for m in _RE_NON_SPACE.finditer(text, pos):
+            if m.end() - m.start() >= count:
+                return m.start() + count
+            count -= m.end() - m.start()
+        return len(text)
+    span = count * 4
+    while True:
+        lo = max(0, pos - span)
+        runs = [(m.start(), m.end()) for m in _RE_NON_SPACE.finditer(text, lo, pos)]
+        if lo == 0 or sum(e - s for s, e in runs) >= count:
+            break
+        span *= 4
+    for s, e in reversed(runs):
+        if e - s >= count:
+            return e - count
+        count -= e - s
+    return 0
+
+
+def relocate_position(text, old_pos, fingerprint):
+    """以旧位置为中心逐轮扩大范围查找指纹，返回离旧位置最近的命中；
+    每轮只扫新增的两侧 (接缝处多扫一个窗口)，最远查到旧位置前后 REANCHOR_MAX_SPAN，找不到返回 None"""
+    before, after = fingerprint.get("before"), fingerprint.get("after")
+    if before is None and after is None:
+        return None
+    old_pos = min(max(0, old_pos), len(text))
+    span = REANCHOR_FIRST_SPAN
+    lo, hi = max(0, old_pos - span), min(len(text), old_pos + span)
+    hits = _find_fingerprint(text, lo, hi, before, after)
+    while not hits:
+        if (lo == 0 and hi == len(text)) or span >= REANCHOR_MAX_SPAN:
+            return None
+        span *= 4
+        new_lo, new_hi = max(0, old_pos - span), min(len(text), old_pos + span)
+        if new_lo < lo:
+            # 跨接缝的窗口最多伸进旧区间 w-1 个字符，再多一个字符给“前段”命中定锚点
+            hits += _find_fingerprint(text, new_lo, _non_space_boundary(text, lo, FINGERPRINT_WINDOW),
+                                      before, after)
+        if new_hi > hi:
+            hits += _find_fingerprint(text, _non_space_boundary(text, hi, FINGERPRINT_WINDOW - 1, False),
+                                      new_hi, before, after)
+        lo, hi = new_lo, new_hi
+    return min(hits, key=lambda p: abs(p - old_pos))
+
+
+# ================= 压缩书籍读取 (检查点索引与末尾续解) =================
+ARCHIVE_SUFFIXES = ('.gz', '.bz2', '.xz', '.lzma', '.zip')
+ARCHIVE_MEMBER_SEP = "::"          # zip 内的书记为 "书库.zip::某书.txt"
+ARCHIVE_CHUNK = 1 << 20            # 每次读入的压缩数据量
+ARCHIVE_CHECKPOINT_SPAN = 4 << 20  # 检查点间隔 (解压后字节)，从检查点起解到任意位置最多多解这么多
+ARCHIVE_INDEX_VERSION = 2
+ARCHIVE_VERIFY_SPAN = 1 << 12      # 从检查点起解时先核对这么多字节的 crc，索引与文件不符就不用它
+DEFLATE_WINDOW = 1 << 15           # deflate 回溯窗口，从检查点重新起解时作为字典
+DEFLATE_BLOCK_PROBE = 1 << 12      # 试解一个块时先读入的压缩数据量，不够再按 4 倍放大
+BOOK_FILE_SUFFIXES = ('.txt', '.txt.gz', '.txt.bz2', '.txt.xz', '.txt.lzma', '.zip')
+
+
+def split_book_path(path):
+    """拆成 (磁盘文件路径, zip 成员名)；不是 zip 成员时成员名为 None"""
+    archive, sep, member = path.partition(ARCHIVE_MEMBER_SEP)
+    return (archive, member) if sep else (path, None)
+
+
+def absolute_book_path(path):
+    """磁盘文件部分转为绝对路径，zip 成员名保持不变"""
+    archive, member = split_book_path(path)
+    archive = os.path.abspath(archive)
+    return archive + ARCHIVE_MEMBER_SEP + member if member is not None else archive
+
+
+def is_archive_path(path):
+    return split_book_path(path)[0].lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def local_book_name(path):
+    """本地书的显示名 (zip 成员只取包内文件名)"""
+    return zip_member_label(os.path.basename(path))
+
+
+def local_file_stat(path):
+    """本地书所在磁盘文件的 (大小, 修改时间)，用于判断离开期间是否被改动"""
+    try:
+        st = os.stat(split_book_path(path)[0])
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def book_path_exists(path):
+    return os.path.exists(split_book_path(path)[0])
+
+
+def zip_text_members(path):
+    """zip 内的 TXT 成员，按体积从大到小"""
+    with zipfile.ZipFile(path) as zf:
+        infos = [i for i in zf.infolist() if not i.is_dir() and i.filename.lower().endswith('.txt')]
+    return [i.filename for i in sorted(infos, key=lambda i: -i.file_size)]
+
+
+def zip_member_label(name):
+    """Windows 打包的 zip 常以 GBK 存文件名，zipfile 按 cp437 解出的是乱码，显示时还原"""
+    try:
+        return name.encode('cp437').decode('gbk')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return name
+
+
+class BookArchive:
+    """压缩书籍的读取 (gzip/bz2/xz 单文件与 zip 成员)，在内存中解压，不落盘。
+    gzip 与 zip 的 deflate/stored 成员可从检查点起读 (iter_at)：检查点取在 deflate 块边界上，
+    把压缩数据按比特对齐到块首、以块前 32 KB 解压内容为字典，就能从这里重新起解。
+    bz2/xz 与 zip 中的 bzip2/lzma 成员只能从头整本解压。
+    gzip 读到末尾时留一份解压器状态，连载在末尾追加时只续解新增部分。"""
+
+    def __init__(self, path):
+        self.path, self.member = split_book_path(path)
+        self.kind = 'stream'
+        self.wbits = 31
+        self.data_start, self.data_end = 0, None
+        self.resume_point = None  # gzip 上次读到的末尾 (解压后偏移, 压缩数据偏移, 解压器)
+        self.source_len = 0    # 已读过的压缩字节数、其 crc32 与两端字节，用于判断文件是否只在末尾追加
+        self.source_crc = 0
+        self.source_edges = (b"", b"")
+        lower = self.path.lower()
+        if self.member is not None or lower.endswith('.zip'):
+            self._locate_zip_member()
+        elif lower.endswith('.gz'):
+            self.kind = 'zlib'
+
+    def _locate_zip_member(self):
+        with zipfile.ZipFile(self.path) as zf:
+            if self.member is None:
+                members = zip_text_members(self.path)
+                if not members:
+                    raise ValueError("压缩包内没有 TXT 文件")
+                self.member = members[0]
+            info = zf.getinfo(self.member)
+        if info.flag_bits & 0x1:
+            raise ValueError("不支持加密的压缩包")
+        if info.compress_type not in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+            return  # bzip2/lzma 成员交给 zipfile 顺序解压
+        # 本地文件头 30 字节，之后是文件名与扩展字段，再之后才是压缩数据
+        with open(self.path, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        self.data_start = info.header_offset + 30 + name_len + extra_len
+        self.data_end = self.data_start + info.compress_size
+        self.kind = 'zlib' if info.compress_type == zipfile.ZIP_DEFLATED else 'stored'
+        self.wbits = -15
+
+    def read(self):
+        """从头整本解压，返回全部字节 (不支持按偏移随机读取)"""
+        if self.kind == 'zlib':
+            return self._inflate_from(0)
+        if self.kind == 'stored':
+            with open(self.path, 'rb') as f:
+                f.seek(self.data_start)
+                return f.read(self.data_end - self.data_start)
+        if self.member is not None:
+            with zipfile.ZipFile(self.path) as zf, zf.open(self.member) as f:
+                return f.read()
+        opener = bz2.open if self.path.lower().endswith('.bz2') else lzma.open
+        with opener(self.path, 'rb') as f:
+            return f.read()
+
+    def iter_at(self, bit, window):
+        """从检查点 (压缩数据中的比特位置，及其前 32 KB 解压内容) 起逐段解压 (生成器)，调用方读够了就停；
+        先读一小段，之后每次放大，只看一页时不必读入、移位整块压缩数据"""
+        with open(self.path, 'rb') as f:
+            if self.kind == 'stored':
+                f.seek(bit >> 3)
+                remaining = self.data_end - (bit >> 3)
+                while remaining > 0:
+                    chunk = f.read(min(ARCHIVE_CHUNK, remaining))
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+                    yield chunk
+                return
+            decompressor = zlib.decompressobj(-15, zdict=window)
+            size = DEFLATE_BLOCK_PROBE
+            while True:
+                chunk = _read_bits(f, bit, size)
+                if not chunk:
+                    return
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+                if not decompressor.eof:
+                    bit += len(chunk) * 8
+                    size = min(size * 4, ARCHIVE_CHUNK)
+                    continue
+                # gzip 多个成员首尾相接：从下一个成员的压缩数据起点接着解
+                end = bit + (len(chunk) - len(decompressor.unused_data)) * 8
+                following = _next_gzip_member(f, end) if self.member is None else []
+                if not following:
+                    return
+                bit, decompressor = following[0], zlib.decompressobj(-15)
+
+    def checkpoints(self, raw):
+        """整本解压得到 raw 之后，沿 deflate 块边界每隔约 ARCHIVE_CHECKPOINT_SPAN 取一个检查点 [(比特位置, 解压后偏移)]。
+        zlib 不报告块边界的比特位置：把每个块的 BFINAL 位置 1 单独解一遍，块尾落在最后消耗的那个字节里，
+        下一块的起点就在这 8 个比特位置之中，逐个试解并与 raw 比对，取解出内容最长的 (误判的位置几 KB 内就对不上)。
+        检查点尽量取在恰好按字节对齐的块首 (约八分之一的块)，从这里起解不用移位。
+        中途对不上 (文件正在写入等) 时停下，已取的检查点仍然有效；不支持的格式返回空列表。"""
+        if self.kind == 'stored':
+            return [((self.data_start + out) * 8, out) for out in range(0, len(raw), ARCHIVE_CHECKPOINT_SPAN)]
+        if self.kind != 'zlib':
+            return []
+        points, out, member_out = [], 0, 0
+        with open(self.path, 'rb') as f:
+            start = self.data_start if self.member is not None else _gzip_header_end(f, 0)
+            candidates = [start * 8]
+            while candidates:
+                window = raw[max(0, out - DEFLATE_WINDOW):out]
+                best = None
+                for bit in candidates:
+                    try:
+                        data, final, end = _inflate_block(f, bit, window, raw, out)
+                    except zlib.error:
+                        continue
+                    if best is None or len(data) > len(best[1]):
+                        best = (bit, data, final, end)
+                if best is None or (not best[1] and not best[2]):
+                    break
+                bit, data, final, end = best
+                gap = out - points[-1][1] if points else None
+                if gap is None or gap >= 2 * ARCHIVE_CHECKPOINT_SPAN or (gap >= ARCHIVE_CHECKPOINT_SPAN and not bit & 7):
+                    points.append((bit, out))
+                out += len(data)
+                if not final:
+                    candidates = range(end - 7, end + 1)
+                elif self.member is None:
+                    candidates = _next_gzip_member(f, end, out - member_out)
+                    member_out = out
+                else:
+                    break
+        return points
+
+    def read_appended(self, offset, full=True):
+        """文件只在末尾追加时返回解压后从 offset 起的内容；前文有改动或格式不支持续读时返回 None。
+        full 为假时只核对已读压缩数据的两端 (见 prefix_unchanged)"""
+        if self.kind != 'zlib' or self.member is not None:
+            return None  # zip 更新会重写目录，bz2/xz 没有可复用的状态，一律整本重读
+        with open(self.path, 'rb') as f:
+            if not prefix_unchanged(f, self.source_len, self.source_crc, self.source_edges, full):
+                return None
+        return self._inflate_from(offset)
+
+    def _inflate_from(self, offset):
+        if self.resume_point is not None and offset >= self.resume_point[0]:
+            out_pos, in_pos, state = self.resume_point
+            decompressor = state.copy()
+        else:
+            out_pos, in_pos, decompressor = 0, self.data_start, zlib.decompressobj(self.wbits)
+        parts = []
+        with open(self.path, 'rb') as f:
+            f.seek(in_pos)
+            while self.data_end is None or in_pos < self.data_end:
+                size = ARCHIVE_CHUNK if self.data_end is None else min(ARCHIVE_CHUNK, self.data_end - in_pos)
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                in_pos += len(chunk)
+                if in_pos > self.source_len and self.data_end is None:
+                    fresh = in_pos - self.source_len
+                    self.source_crc = zlib.crc32(chunk[len(chunk) - fresh:], self.source_crc)
+                    self.source_edges = extend_prefix_edges(self.source_edges, chunk[len(chunk) - fresh:])
+                    self.source_len = in_pos
+
+                data = decompressor.decompress(chunk)
+                # gzip 允许多个成员首尾相接 (以追加方式更新的连载常见)
+                while self.wbits == 31 and decompressor.eof and decompressor.unused_data.strip(b'\0'):
+                    rest = decompressor.unused_data
+                    decompressor = zlib.decompressobj(self.wbits)
+                    data += decompressor.decompress(rest)
+
+                if out_pos + len(data) > offset:
+                    parts.append(data[max(0, offset - out_pos):])
+                out_pos += len(data)
+
+        # 存下末尾状态：追加的内容从这里接着解压
+        if self.data_end is None:
+            tail = zlib.decompressobj(self.wbits) if decompressor.eof else decompressor.copy()
+            self.resume_point = (out_pos, in_pos, tail)
+        return b"".join(parts)
+
+
+def _read_bits(f, bit, length):
+    """从文件第 bit 个比特起的 length 字节 (deflate 低位在前，移位后块首对齐到第 0 字节的最低位)"""
+    f.seek(bit >> 3)
+    data = f.read(length + 1)
+    shift = bit & 7
+    if shift:
+        data = (int.from_bytes(data, 'little') >> shift).to_bytes(len(data), 'little')
+    return data[:length]
+
+
+def _inflate_block(f, bit, window, expected, out):
+    """单独解出从 bit 开始的一个 deflate 块，返回 (内容, 原 BFINAL 位, 最后消耗的字节之后的比特位置)。
+    先读一小段试解，之后按 4 倍追加；解出的内容随时与 expected[out:] 比对，
+    不是合法的块或对不上时抛 zlib.error，误判的起点不必整块读入、移位"""
+    decompressor = zlib.decompressobj(-15, zdict=window)
+    parts, fed, size, final = [], 0, DEFLATE_BLOCK_PROBE, 0
+    while True:
+        data = _read_bits(f, bit + fed * 8, size)
+        if not data:
+            raise zlib.error("块不完整")
+        if not fed:
+            final = data[0] & 1
+            data = bytes([data[0] | 1]) + data[1:]  # 当作最后一块，解到块尾就停
+        piece = decompressor.decompress(data)
+        if not expected.startswith(piece, out):
+            raise zlib.error("解出的内容对不上")
+        parts.append(piece)
+        out += len(piece)
+        if decompressor.eof:
+            return b"".join(parts), final, bit + (fed + len(data) - len(decompressor.unused_data)) * 8
+        fed += len(data)
+        size = min(size * 4, ARCHIVE_CHUNK)
+
+
+def _gzip_header_end(f, offset):
+    """offset 处 gzip 成员头之后 (压缩数据起点) 的字节偏移"""
+    f.seek(offset)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'\x1f\x8b\x08':
+        raise zlib.error("不是 gzip 数据")
+    flags = header[3]
+    if flags & 4:  # FEXTRA
+        f.seek(struct.unpack('<H', f.read(2))[0], 1)
+    for flag in (8, 16):  # FNAME、FCOMMENT 以 0 结尾
+        if flags & flag:
+            while f.read(1) not in (b'\0', b''):
+                pass
+    if flags & 2:  # FHCRC
+        f.seek(2, 1)
+    return f.tell()
+
+
+def _next_gzip_member(f, end, member_size=None):
+    """成员最后一块的块尾在 end 之前 8 个比特内，据此找到成员结尾 (知道成员大小时再核对尾部的 ISIZE)；
+    后面还有成员时返回其压缩数据起点 [比特位置]，否则返回空列表"""
+    for data_end in sorted({end // 8, (end + 7) // 8}):
+        f.seek(data_end + 4)
+        trailer = f.read(6)
+        if len(trailer) < 6 or trailer[4:] != b'\x1f\x8b':
+            continue
+        if member_size is None or struct.unpack('<I', trailer[:4])[0] == member_size & 0xFFFFFFFF:
+            return [_gzip_header_end(f, data_end + 8) * 8]
+    return []
+
+
+def archive_index_path(file_path):
+    """压缩书检查点索引的缓存路径：cache/books/<路径摘要>.index.json"""
+    key = book_cache_key(os.path.normcase(os.path.abspath(file_path)))
+    return os.path.join(CACHE_DIR, "books", f"{key}.index.json")
+
+
+def build_archive_index(file_path, archive, raw, encoding, crc):
+    """整本读过一次后为压缩书建检查点索引并写入缓存，返回是否建成。
+    每个检查点记 [比特位置, 解压后偏移, 其后第一个完整字符的字节偏移, 该字符在正文中的位置, 前 32 KB 解压内容,
+    其后 ARCHIVE_VERIFY_SPAN 字节的 crc]"""
+    stat = local_file_stat(file_path)
+    points = archive.checkpoints(raw)
+    if stat is None or not points:
+        return False
+    decoder = codecs.getincrementaldecoder(encoding)()
+    entries, done, pos, carry = [], 0, 0, ""
+    for bit, out in points:
+        piece = carry + decoder.decode(raw[done:out])
+        start = out - len(decoder.getstate()[0])  # 没解完的多字节字符算在检查点之后
+        carry = ""
+        if piece.endswith('\r') and raw[start:start + 1] == b'\n':
+            piece, carry, start = piece[:-1], '\r', start - 1  # \r\n 不拆到检查点两边
+        pos += len(translate_newlines(piece))
+        done = out
+        window = zlib.compress(raw[max(0, out - DEFLATE_WINDOW):out])
+        entries.append([bit, out, start, pos, base64.b64encode(window).decode('ascii'),
+                        zlib.crc32(raw[out:out + ARCHIVE_VERIFY_SPAN])])
+
+    path = archive_index_path(file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"v": ARCHIVE_INDEX_VERSION, "stat": list(stat), "size": len(raw), "crc": crc,
+                   "encoding": encoding, "points": entries}, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return True
+
+
+def load_archive_index(file_path):
+    """读取检查点索引；压缩文件的大小或修改时间与建索引时不同则视为失效"""
+    try:
+        with open(archive_index_path(file_path), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = local_file_stat(file_path)
+    if index.get("v") != ARCHIVE_INDEX_VERSION or stat is None or index.get("stat") != list(stat):
+        return None
+    return index
+
+
+def read_archive_preview(file_path, pos, chars):
+    """不从头解压，只从 pos 之前最近的检查点起解到覆盖 [pos, pos + chars) 为止。
+    返回 (这段正文在全文中的起点, 正文)；没有有效索引时返回 None，起解处的内容与索引对不上时抛 zlib.error"""
+    index = load_archive_index(file_path)
+    if index is None:
+        return None
+    points = index["points"]
+    i = max(0, bisect.bisect_right([p[3] for p in points], pos) - 1)
+    bit, out, start, text_start, window, verify_crc = points[i]
+    window = zlib.decompress(base64.b64decode(window))
+    verify_len = min(ARCHIVE_VERIFY_SPAN, index["size"] - out)
+    encoding = index["encoding"]
+    if start:
+        encoding = TAIL_ENCODINGS.get(encoding, encoding)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    head = window[len(window) - (out - start):]  # 检查点前没解完的多字节字符 (或 \r\n 的 \r)
+    verify, parts, length, pending_cr = b"", [], 0, False
+    for data in BookArchive(file_path).iter_at(bit, window):
+        if len(verify) < verify_len:
+            verify += data[:verify_len - len(verify)]
+            if len(verify) == verify_len and zlib.crc32(verify) != verify_crc:
+                break
+        text = decoder.decode(head + data)
+        head = b""
+        if pending_cr:
+            text = '\r' + text
+        pending_cr = text.endswith('\r')  # \r\n 可能被切在两段之间
+        text = translate_newlines(text[:-1] if pending_cr else text)
+        parts.append(text)
+        length += len(text)
+        if text_start + length >= pos + chars and len(verify) == verify_len:
+            break
+    if len(verify) < verify_len or zlib.crc32(verify) != verify_crc:
+        raise zlib.error("压缩数据与检查点索引不符")
+    return text_start, "".join(parts) + ('\n' if pending_cr else "")
+
+
+def read_book_bytes(file_path):
+    """读入整本书的原始字节，返回 (字节, BookArchive)；普通文件时 BookArchive 为 None"""
+    if is_archive_path(file_path):
+        archive = BookArchive(file_path)
+        return archive.read(), archive
+    with open(file_path, 'rb') as f:
+        return f.read(), None
+
+
+def read_local_book(file_path):
+    """读入并解码整本本地书 (工作线程中调用)，返回 (字节, BookArchive, crc, 全文, 编码, 预处理结果)；
+    预处理过的书直接使用缓存的编码，编码无法识别时全文为 None"""
+    raw, archive = read_book_bytes(file_path)  # 压缩包边读边解压，不落盘
+    crc = zlib.crc32(raw)
+    artifact = load_book_artifact(file_path, len(raw), crc)
+    if artifact:
+        content, encoding = translate_newlines(raw.decode(artifact["encoding"])), artifact["encoding"]
+    else:
+        content, encoding = decode_book_bytes(raw)  # 尝试多种编码读取
+    return raw, archive, crc, content, encoding, artifact
+
+
+# ================= 排版测量 (离屏文档) =================
+PAGE_BUFFER_LENGTH = 5000  # 每页排版窗口的字符数，足以填满各种屏幕
+TRANSFORM_CONTEXT = 1000   # 分页窗口净化时向两侧补上下文的上限 (字符)
+AUTO_SCROLL_SPEED = 30  # 自动滚屏默认速度 (像素/秒)
+AUTO_SCROLL_MIN_SPEED, AUTO_SCROLL_MAX_SPEED = 5, 400
+
+def layout_plain_document(text, font, width, option=None):
+    """构造一个与阅读区排版参数一致的离屏文档 (无边距，按视图宽度折行)"""
+    doc = QTextDocument()
+    doc.setDocumentMargin(0)
+    doc.setDefaultFont(font)
+    if option is not None:
+        doc.setDefaultTextOption(option)
+    doc.setPlainText(text)
+    doc.setTextWidth(width)
+    return doc
+
+
+def line_geometry(doc, pos):
+    """返回 pos 所在视觉行的 (顶部 y, 行高)"""
+    block = doc.findBlock(pos)
+    doc.documentLayout().blockBoundingRect(block)  # 确保该段已排版
+    layout = block.layout()
+    line = layout.lineForTextPosition(pos - block.position())
+    if not line.isValid():
+        return layout.position().y(), 0.0
+    return layout.position().y() + line.y(), line.height()
+
+
+def page_break_at(doc, target_y):
+    """返回探测线 target_y 处那一行的 (行首位置, 行顶部)；探测线已在文末之后时位置为 None"""
+    pos = doc.documentLayout().hitTest(QPointF(0, target_y), Qt.FuzzyHit)
+    top, height = line_geometry(doc, pos)
+    if top + height > target_y:
+        return pos, top
+
+    # 命中的行在探测线处或之上结束：分页处是它的下一行 (若有)
+    block = doc.findBlock(pos)
+    layout = block.layout()
+    line = layout.lineForTextPosition(pos - block.position())
+    if line.isValid() and line.lineNumber() < layout.lineCount() - 1:
+        return block.position() + layout.lineAt(line.lineNumber() + 1).textStart(), top + height
+    next_block = block.next()
+    if not next_block.isValid():
+        return None, top
+    return next_block.position(), top + height
+
+
+def document_line_tops(doc):
+    """文档中每个视觉行的顶部 y 与行首位置 (两列递增数组)，逐行滚动时据此查找顶行"""
+    tops, positions = array('d'), array('l')
+    layout = doc.documentLayout()
+    block = doc.begin()
+    while block.isValid():
+        layout.blockBoundingRect(block)  # 确保该段已排版
+        block_layout = block.layout()
+        y = block_layout.position().y()
+        for i in range(block_layout.lineCount()):
+            line = block_layout.lineAt(i)
+            tops.append(y + line.y())
+            positions.append(block.position() + line.textStart())
+        block = block.next()
+    return tops, positions
+
+
+def render_document_pixmap(doc, size, color, ratio=1.0):
+    """把文档的可见区域光栅化到位图 (同时预热字形缓存)"""
+    if size.width() <= 0 or size.height() <= 0:
+        return QPixmap()
+    pixmap = QPixmap(int(size.width() * ratio), int(size.height() * ratio))
+    pixmap.setDevicePixelRatio(ratio)
+    pixmap.fill(Qt.transparent)
+    painter = QPainter(pixmap)
+    ctx = QAbstractTextDocumentLayout.PaintContext()
+    ctx.palette.setColor(QPalette.Text, color)
+    ctx.clip = QRectF(0, 0, size.width(), size.height())
+    doc.documentLayout().draw(painter, ctx)
+    painter.end()
+    return pixmap
+
+
+def display_window(text, start, end, transform=None):
+    """取原文 [start, end) 的显示文本；有净化规则时返回净化结果 (可换算回原文位置)。
+    净化前两侧补到整行：前面从所在行的行首开始，后面带上行尾换行符与下一行首字。
+    正则规则按行匹配 (^/$ 即行首/行尾)，跨窗口边缘的命中照样替换，^/$ 规则也不随窗口从哪一页开始而变，
+    前后翻页看到的同一段文字与整章净化的结果一致。"""
+    if transform is None:
+        return TransformResult(text[start:end], [])
+    lo = text.rfind('\n', max(0, start - TRANSFORM_CONTEXT), start) + 1
+    if not lo:
+        lo = max(0, start - TRANSFORM_CONTEXT)  # 开头就是文首，或这一行太长只能从行中间带一段
+    hi = text.find('\n', end, end + TRANSFORM_CONTEXT)
+    hi = min(len(text), end + TRANSFORM_CONTEXT if hi < 0 else hi + 2)
+    return WindowTransform(transform(text[lo:hi]), start - lo, end - lo)
+
+
+def paginate_forward(text, start, count, font, width, height, option=None, transform=None):
+    """从 start 起连续向后分页，最多 count 页，返回各页起点 (不含 start，均为原文位置)。
+    一次排版一整段文本、逐页命中测试，规则与单页探测一致：下一页首行 = 本页顶部 + 视图高度 + 2px 处的行。"""
+    starts = []
+    total = len(text)
+    while len(starts) < count and start < total:
+        end = min(total, start + PAGE_BUFFER_LENGTH * (count - len(starts) + 1))
+        window = display_window(text, start, end, transform)
+        doc = layout_plain_document(window.text, font, width, option)
+        pos, top = 0, 0.0
+        while len(starts) < count:
+            hit, line_top = page_break_at(doc, top + height + 2)
+            if hit is None:
+                # 排版窗口内剩余不足一页
+                break
+            hit = max(hit, pos + 1)
+            starts.append(start + window.to_source(hit))
+            pos, top = hit, line_top
+
+        if end >= total or pos == 0:
+            break
+        # 窗口用尽：从最后一个页首重新排版下一段 (从行首开始，折行结果不变)
+        start += window.to_source(pos)
+    return starts
+
+
+class PageFrame:
+    """一页的预备帧：已排版的离屏文档 + 下一页起点 + 光栅化后的页面 (只在空闲预备时生成，可为 None)"""
+
+    def __init__(self, start, doc, next_start, pixmap, signature, window=None):
+        self.start = start
+        self.doc = doc
+        self.next_start = next_start
+        self.prev_start = None  # 反向排版结果，按需计算后缓存
+        self.pixmap = pixmap
+        self.signature = signature
+        self.window = window  # 显示文本与原文位置的换算 (TransformResult)
+        self.lines = None  # 行索引 (document_line_tops)，自动滚屏时按需计算
+
+
+# ================= 书库预处理 (命令行批量) =================
+BOOK_ARTIFACT_VERSION = 1
+TEXT_SIDE_MARGIN = 5      # 阅读区左右留白，视图宽度 = 窗口宽度 - 2 * 留白
+PREPROCESS_DPI = 96       # 预处理默认按 100% 缩放排版，高分屏用 --dpi 指定
+PREPROCESS_BATCH = 64     # 整书分页时每次排版的页数
+PREPROCESS_LOG = os.path.join(CACHE_DIR, "preprocess.log")  # 打包版没有控制台，进度与错误同时写到这里
+
+_preprocess_app = None  # 预处理子进程内的无界面 QGuiApplication
+
+
+def book_artifact_path(file_path):
+    """本地书预处理结果的缓存路径：cache/books/<路径摘要>.json"""
+    key = book_cache_key(os.path.normcase(os.path.abspath(file_path)))
+    return os.path.join(CACHE_DIR, "books", f"{key}.json")
+
+
+def load_book_artifact(file_path, size, crc):
+    """读取预处理结果；文件大小或 CRC 与当前内容不符时视为失效"""
+    try:
+        with open(book_artifact_path(file_path), 'r', encoding='utf-8') as f:
+            artifact = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (artifact.get("v") != BOOK_ARTIFACT_VERSION or artifact.get("size") != size
+            or artifact.get("crc") != crc):
+        return None
+    return artifact
+
+
+def save_book_artifact(file_path, artifact):
+    path = book_artifact_path(file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def layout_profile_key(font_family, font_size, width, height, dpi):
+    """排版方案的标识：字体、字号、视图尺寸、逻辑 DPI 任一不同，分页结果都不同"""
+    return f"{font_family}|{font_size}|{width}x{height}|{dpi}"
+
+
+def parse_layout_profile(spec):
+    """解析 "字体,字号,宽x高" (宽高为窗口尺寸，与设置中一致)"""
+    family, size, window = [part.strip() for part in spec.rsplit(',', 2)]
+    width, height = window.lower().split('x')
+    return family, int(size), int(width), int(height)
+
+
+def reader_text_option():
+    """阅读区 QTextEdit 的默认排版选项 (按控件宽度折行，单词过长时任意断开)"""
+    option = QTextOption()
+    option.setWrapMode(QTextOption.WrapAtWordBoundaryOrAnywhere)
+    return option
+
+
+def _init_preprocess_worker(dpi):
+    global _preprocess_app
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    os.environ["QT_FONT_DPI"] = str(dpi)
+    _preprocess_app = QGuiApplication.instance() or QGuiApplication(["stealth-preprocess"])
+
+
+def preprocess_book(file_path, profiles, dpi):
+    """在子进程中完成一本书的解码、章节识别、搜索用的行首索引与各排版方案的整书分页，结果写入缓存"""
+    t0 = time.perf_counter()
+    try:
+        raw, archive = read_book_bytes(file_path)
+        content, encoding = decode_book_bytes(raw)
+        if not content:
+            return file_path, False, "编码无法识别或文件为空"
+
+        crc = zlib.crc32(raw)
+        if archive is not None:
+            build_archive_index(file_path, archive, raw, encoding, crc)  # 打开时从检查点起解，不必整本解压才见首屏
+        artifact = load_book_artifact(file_path, len(raw), crc) or {}
+        pages = artifact.get("pages", {})
+        option = reader_text_option()
+        for family, size, window_width, window_height in profiles:
+            width, height = window_width - 2 * TEXT_SIDE_MARGIN, window_height
+            key = layout_profile_key(family, size, width, height, dpi)
+            if key in pages:
+                continue
+            font = QFont(family, size)
+            starts = [0]
+            while True:
+                batch = paginate_forward(content, starts[-1], PREPROCESS_BATCH, font, width, height, option)
+                if not batch:
+                    break
+                starts.extend(batch)
+            pages[key] = starts
+
+        chapters = scan_chapter_headings(content)
+        save_book_artifact(file_path, {
+            "v": BOOK_ARTIFACT_VERSION,
+            "size": len(raw),
+            "crc": crc,
+            "encoding": encoding,
+            "chapters": chapters,
+            "pages": pages,
+            "lines": pack_offsets(line_start_offsets(content)),
+        })
+        page_counts = "/".join(str(len(v)) for v in pages.values())
+        return file_path, True, (f"{encoding}  {len(chapters)}章  {page_counts}页  "
+                                 f"{time.perf_counter() - t0:.1f}s")
+    except Exception as e:
+        return file_path, False, f"失败: {e}"
+
+
+def preprocess_library(root, profiles, jobs=None, dpi=PREPROCESS_DPI):
+    """用进程池并行预处理 root 下所有 TXT，打开这些书时不再现场识别编码、章节与分页。
+    返回退出码：0 全部成功，1 没有可处理的文件，2 有书处理失败；逐本结果写入 PREPROCESS_LOG。"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(PREPROCESS_LOG, 'w', encoding='utf-8') as log:
+        def report(line):
+            print(line)  # 打包的窗口版 sys.stdout 为 None，print 什么也不做
+            log.write(line + "\n")
+            log.flush()
+        return _preprocess_library(root, profiles, jobs, dpi, report)
+
+
+def _preprocess_library(root, profiles, jobs, dpi, report):
+    if os.path.isfile(root):
+        files = [root]
+    else:
+        files = sorted(os.path.join(folder, name)
+                       for folder, _, names in os.walk(root)
+                       for name in names if name.lower().endswith(BOOK_FILE_SUFFIXES))
+    paths = []
+    for path in files:
+        if path.lower().endswith(".zip"):
+            # zip 书库包中的每个 TXT 单独处理
+            try:
+                paths.extend(path + ARCHIVE_MEMBER_SEP + member for member in zip_text_members(path))
+            except (OSError, zipfile.BadZipFile) as e:
+                report(f"跳过 {os.path.basename(path)}: {e}")
+        else:
+            paths.append(path)
+    if not paths:
+        report(f"没有找到 TXT 文件: {root}")
+        return 1
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_preprocess_worker,
+                             initargs=(dpi,)) as pool:
+        futures = {pool.submit(preprocess_book, path, profiles, dpi): path for path in paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                path, ok, summary = future.result()
+            except Exception as e:  # 子进程崩溃 (BrokenProcessPool 等)
+                path, ok, summary = futures[future], False, f"失败: {e!r}"
+            failed += not ok
+            report(f"[{done}/{len(paths)}] {local_book_name(path)}  {summary}")
+    report(f"完成 {len(paths) - failed}/{len(paths)} 本，日志: {os.path.abspath(PREPROCESS_LOG)}")
+    return 2 if failed else 0
+
+
 # ================= 辅助类：绘制背景和角标 =================
 class CornerFrame(QFrame):
     def __init__(self, parent=None):
@@ -74,6 +2295,11 @@ class CornerFrame(QFrame):
         self.is_auto_mode = False
         self.corner_color = QColor(128, 128, 128, 200)
         self.auto_bg_fill = QColor(0, 0, 0, 2)
+        self.progress = None  # 后台任务进度 (0~1)，None 时不绘制
+
+    def set_progress(self, progress):
+        self.progress = progress
+        self.update()
 
     def set_mode(self, auto_mode):
         self.is_auto_mode = auto_mode
@@ -91,6 +2317,7 @@ class CornerFrame(QFrame):
     def paintEvent(self, event):
         if not self.is_auto_mode:
             super().paintEvent(event)
+            self.draw_progress()
             return
 
         painter = QPainter(self)
@@ -105,18 +2332,97 @@ class CornerFrame(QFrame):
             painter.drawLine(0, 0, 0, length)
             painter.drawLine(w, h, w - length, h)
             painter.drawLine(w, h, w, h - length)
+        painter.end()
+        self.draw_progress()
+
+    def draw_progress(self):
+        """底边一条细线表示后台任务进度，不占用正文区域"""
+        if self.progress is None:
+            return
+        painter = QPainter(self)
+        painter.fillRect(0, self.height() - 2, int(self.width() * self.progress), 2, self.corner_color)
+        painter.end()
+
+
+# ================= 辅助类：状态提示浮层 =================
+STATUS_TIMEOUT = 2500  # 状态提示默认显示时长 (毫秒)，0 表示一直显示到被替换或收起
+
+class StatusToast(QLabel):
+    """浮在正文上方的一行状态提示，不进布局、不吃鼠标，显示/隐藏都不触碰正文文档"""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setWordWrap(True)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.hide()
+        self.hide_timer = QTimer(self)
+        self.hide_timer.setSingleShot(True)
+        self.hide_timer.timeout.connect(self.hide)
+        parent.installEventFilter(self)  # 窗口大小变化时跟着贴底
+
+    def show_message(self, text, text_color, timeout=STATUS_TIMEOUT):
+        # 颜色跟随正文 (含变色龙模式)，底色取反色半透明，保证在任何背景上可读
+        back = 0 if text_color.lightness() > 128 else 255
+        self.setStyleSheet(f"""
+            QLabel {{
+                color: rgba({text_color.red()}, {text_color.green()}, {text_color.blue()}, 230);
+                background-color: rgba({back}, {back}, {back}, 170);
+                border-radius: 4px; padding: 1px 6px;
+            }}
+        """)
+        self.setText(text)
+        self.reposition()
+        self.show()
+        self.raise_()
+        if timeout > 0:
+            self.hide_timer.start(timeout)
+        else:
+            self.hide_timer.stop()
+
+    def dismiss(self):
+        self.hide_timer.stop()
+        self.hide()
+
+    def reposition(self):
+        parent = self.parentWidget()
+        max_width = max(parent.width() - 2 * TEXT_SIDE_MARGIN, 10)
+        width = min(self.sizeHint().width(), max_width)
+        height = min(self.heightForWidth(width), parent.height())
+        self.setGeometry(TEXT_SIDE_MARGIN, parent.height() - height - 2, width, height)
+
+    def eventFilter(self, source, event):
+        if event.type() == QEvent.Resize and self.isVisible():
+            self.reposition()
+        return False
 
 
 # ================= 独立窗口：书籍选择器 =================
+BOOK_WARM_DELAY = 150  # 书架选中停留多久才预热 (毫秒)
+
+
 class BookSelector(QDialog):
+    """创建一次反复使用：每次打开前 prepare() 刷新列表，书架数据没变时不重建列表项"""
+
     def __init__(self, main_window, parent=None):
         super().__init__(parent)
         self.main_window = main_window
+        self.selected_book = None
+        self.shown_books = None  # 列表当前展示的书架数据 (按对象判断是否需要重建)
         self.setWindowTitle("📚 书架")
         self.resize(400, 500)
         self.setStyleSheet(DARK_STYLESHEET)
         self.initUI()
-        self.populate_list(self.main_window.books)
+
+    def prepare(self):
+        self.selected_book = None
+        books = self.main_window.books
+        self.setWindowTitle(f"📚 书架 (共 {len(books)} 本)" if books else "📚 书架")
+        if self.search_input.text():
+            self.filter_books(self.search_input.text())
+        elif books is not self.shown_books:
+            self.populate_list(books)
+        self.search_input.setFocus()
+        self.search_input.selectAll()  # 保留上次的搜索词，直接输入即可替换
 
     def initUI(self):
         layout = QVBoxLayout()
@@ -133,10 +2439,31 @@ class BookSelector(QDialog):
 
         layout.addLayout(top_layout)
         self.list_widget = QListWidget()
+        self.list_widget.setUniformItemSizes(True)
         self.list_widget.itemDoubleClicked.connect(self.on_item_double_clicked)
+        self.list_widget.currentItemChanged.connect(self.on_current_item_changed)
         layout.addWidget(self.list_widget)
         self.setLayout(layout)
 
+        # 方向键连续移动时只预热停下来的那本
+        self.warm_timer = QTimer(self)
+        self.warm_timer.setSingleShot(True)
+        self.warm_timer.setInterval(BOOK_WARM_DELAY)
+        self.warm_timer.timeout.connect(self.warm_current_book)
+
+    def on_current_item_changed(self, current, previous):
+        # 只预热用户自己点选/方向键选中的书；打开书架、搜索时列表重建带来的选中不算
+        if current is not None and self.list_widget.hasFocus():
+            self.warm_timer.start()
+        else:
+            self.warm_timer.stop()
+
+    def warm_current_book(self):
+        """选中即预热，双击打开时正文多半已在缓存里"""
+        item = self.list_widget.currentItem()
+        if item is not None and self.isVisible():
+            self.main_window.warm_book(item.data(Qt.UserRole))
+
     def manual_refresh(self):
         self.setWindowTitle("📚 书架 (加载中...)")
         self.main_window.fetch_bookshelf_silent()
@@ -149,7 +2476,13 @@ class BookSelector(QDialog):
         else:
             self.populate_list(books)
 
+    def release(self):
+        """窗口隐藏时清空列表项，下次打开再按书架重建"""
+        self.shown_books = None
+        self.list_widget.clear()
+
     def populate_list(self, books_to_show):
+        self.shown_books = books_to_show
         self.list_widget.clear()
         if not books_to_show: return
         for book in books_to_show:
@@ -172,54 +2505,80 @@ class BookSelector(QDialog):
 
 
 # ================= 独立窗口：目录选择器 =================
-class ChapterLoader(QThread):
-    loaded = pyqtSignal(list)
+class ChapterLoader(QObject):
+    """在调度器的交互通道中下载目录，边下载边以 batch 信号交出新到的章节，完整目录以 loaded 交出"""
+    batch = pyqtSignal(list)
+    loaded = pyqtSignal(object)
     failed = pyqtSignal(str)
 
-    def __init__(self, ip, book_url):
+    def __init__(self, endpoint, scheduler, book):
         super().__init__()
-        self.ip = ip
-        self.book_url = book_url
+        self.endpoint = endpoint
+        self.scheduler = scheduler
+        self.book = book
+        self.future = None
+
+    def start(self):
+        self.future = self.scheduler.submit(LANE_INTERACTIVE, self.run)
+
+    def cancel(self):
+        if self.future:
+            self.future.cancel()
 
     def run(self):
         try:
-            url = f"{self.ip}/getChapterList"
-            res = requests.get(url, params={"url": self.book_url}, timeout=10)
-            if res.status_code == 200:
-                data = res.json()
-                if data['isSuccess']:
-                    self.loaded.emit(data['data'])
-                else:
-                    self.failed.emit(data.get('errorMsg', '未知错误'))
-            else:
-                self.failed.emit(f"HTTP {res.status_code}")
+            self.loaded.emit(fetch_compact_toc(self.endpoint, self.book, self.batch.emit))
         except Exception as e:
             self.failed.emit(str(e))
 
 
 class TocSelector(QDialog):
-    def __init__(self, ip, book_url, current_index, cached_toc=None, parent=None):
+    """创建一次反复使用 (本地与网络目录共用)：prepare() 换上要显示的目录，
+    与上次是同一份目录时只重新定位当前章，不重建几千个列表项"""
+
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.setWindowTitle("📖 目录加载中...")
         self.resize(400, 600)
-        self.ip = ip
-        self.book_url = book_url
-        self.selected_index = None
         self.main_window = parent
-        self.target_index = current_index
+        self.book_url = None
+        self.selected_index = None
+        self.target_index = 0
         self.loader = None
+        self.shown_toc = None  # 列表当前展示的目录对象
+        self.streamed = 0  # 本次下载中已边收边加入列表的章节数
         self.setStyleSheet(DARK_STYLESHEET)
 
         self.initUI()
 
+    def prepare(self, endpoint, book, current_index, cached_toc=None):
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+        self.book_url = book['bookUrl'] if book else None
+        self.selected_index = None
+        self.target_index = current_index
+        self.streamed = 0
+
         if cached_toc and len(cached_toc) > 0:
             self.on_loaded(cached_toc)
         else:
-            self.loader = ChapterLoader(ip, book_url)
+            self.shown_toc = None
+            self.list_widget.clear()
+            self.list_widget.hide()
+            self.setWindowTitle("📖 目录加载中...")
+            self.status_label.setText("正在从手机获取目录...")
+            self.status_label.show()
+            self.loader = ChapterLoader(endpoint, self.main_window.scheduler, book)
+            self.loader.batch.connect(self.on_batch)
             self.loader.loaded.connect(self.on_loaded)
             self.loader.failed.connect(self.on_failed)
             self.loader.start()
 
+    def release(self):
+        """窗口隐藏时清空列表项，下次打开再按目录重建"""
+        self.shown_toc = None
+        self.list_widget.clear()
+
     def initUI(self):
         layout = QVBoxLayout()
         self.status_label = QLabel("正在从手机获取目录...")
@@ -227,117 +2586,321 @@ class TocSelector(QDialog):
         layout.addWidget(self.status_label)
 
         self.list_widget = QListWidget()
+        self.list_widget.setUniformItemSizes(True)
         self.list_widget.itemDoubleClicked.connect(self.on_item_double_clicked)
         self.list_widget.hide()
         layout.addWidget(self.list_widget)
         self.setLayout(layout)
 
     def on_loaded(self, chapters):
+        # 上一次打开时发出、已被取消的下载，结果直接丢弃
+        if isinstance(self.sender(), ChapterLoader) and self.sender() is not self.loader:
+            return
         try:
             self.setWindowTitle(f"📖 目录 (共 {len(chapters)} 章)")
             self.status_label.hide()
             self.list_widget.show()
 
-            if self.main_window:
-                self.main_window.current_toc = chapters
-
-            for i, chapter in enumerate(chapters):
-                title = str(chapter.get('title', f'第 {i + 1} 章'))
-                item = QListWidgetItem(title)
-                idx = chapter.get('index', i)
-                item.setData(Qt.UserRole, idx)
-                self.list_widget.addItem(item)
-                if i == self.target_index:
-                    item.setSelected(True)
-                    self.list_widget.scrollToItem(item, QListWidget.PositionAtCenter)
+            if self.main_window and self.book_url:
+                self.main_window.on_toc_loaded(self.book_url, chapters)
+
+            # 边下载边加入的列表项已是完整目录：不再重建，也不打断用户已经开始的选择
+            streamed_all = isinstance(self.sender(), ChapterLoader) and self.streamed == len(chapters)
+            if chapters is not self.shown_toc and not streamed_all:
+                self.list_widget.clear()
+                self.append_items(chapters, 0)
+            self.shown_toc = chapters
+
+            if not (streamed_all and self.list_widget.currentItem() is not None):
+                self.select_target()
         except Exception as e:
+            self.shown_toc = None
             self.status_label.setText(f"数据解析错误: {str(e)}")
             self.status_label.show()
 
+    def on_batch(self, chapters):
+        if self.sender() is not self.loader:
+            return
+        if self.streamed == 0:
+            self.list_widget.clear()
+            self.status_label.hide()
+            self.list_widget.show()
+        self.append_items(chapters, self.streamed)
+        self.streamed += len(chapters)
+        self.setWindowTitle(f"📖 目录加载中... (已收到 {self.streamed} 章)")
+        # 当前章一到就定位，不必等整个目录下载完
+        if self.list_widget.currentItem() is None and self.target_index < self.streamed:
+            self.select_target()
+
+    def append_items(self, chapters, start):
+        for i, chapter in enumerate(chapters, start):
+            item = QListWidgetItem(str(chapter.get('title') or f'第 {i + 1} 章'))
+            item.setData(Qt.UserRole, chapter.get('index', i))
+            self.list_widget.addItem(item)
+
+    def select_target(self):
+        item = self.list_widget.item(self.target_index)
+        if item is not None:
+            self.list_widget.setCurrentItem(item)
+            self.list_widget.scrollToItem(item, QListWidget.PositionAtCenter)
+
     def on_failed(self, msg):
+        if self.sender() is not self.loader:
+            return
         self.status_label.setText(f"目录加载失败: {msg}")
+        self.status_label.show()
 
     def on_item_double_clicked(self, item):
         self.selected_index = item.data(Qt.UserRole)
         self.accept()
 
-    def closeEvent(self, event):
-        if self.loader and self.loader.isRunning():
-            self.loader.terminate()
-            self.loader.wait()
-        super().closeEvent(event)
+    def done(self, result):
+        if self.loader:
+            self.loader.cancel()
+        super().done(result)
+
+
+# ================= 独立窗口：书内搜索 =================
+class SearchDialog(QDialog):
+    # 信号都带搜索批次号，重新搜索后旧批次的回报直接丢弃
+    hits_found = pyqtSignal(int, list)
+    progress_changed = pyqtSignal(int, int, int)
+    search_finished = pyqtSignal(int, int, int, int, bool)
+
+    def __init__(self, main_window, keyword="", parent=None):
+        super().__init__(parent)
+        self.main_window = main_window
+        self.local = main_window.is_local_mode
+        book_name = local_book_name(main_window.local_file_path) if self.local else main_window.current_book['name']
+        self.setWindowTitle(f"🔍 书内搜索 - {book_name}")
+        self.resize(450, 600)
+        self.setStyleSheet(DARK_STYLESHEET)
+        self.searcher = None
+        self.generation = 0
+        self.selected = None  # (章节序号, 章内位置)
+        self.hit_keys = []  # 与列表行一一对应的排序键 (章节序号, 命中位置)
+
+        self.hits_found.connect(self.on_hits)
+        self.progress_changed.connect(self.on_progress)
+        self.search_finished.connect(self.on_finished)
+        self.initUI()
+        self.search_input.setText(keyword)
+
+    def initUI(self):
+        layout = QVBoxLayout()
+        top_layout = QHBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("🔍 输入关键词，回车搜索全书...")
+        self.search_input.returnPressed.connect(self.start_search)
+        top_layout.addWidget(self.search_input)
+
+        btn_search = QPushButton("搜索")
+        btn_search.setFixedWidth(60)
+        btn_search.clicked.connect(self.start_search)
+        top_layout.addWidget(btn_search)
+        layout.addLayout(top_layout)
+
+        self.status_label = QLabel("在全文中逐章查找" if self.local else "已缓存的章节优先搜索，其余章节从手机拉取")
+        layout.addWidget(self.status_label)
+
+        self.list_widget = QListWidget()
+        self.list_widget.itemDoubleClicked.connect(self.on_item_double_clicked)
+        layout.addWidget(self.list_widget)
+        self.setLayout(layout)
+
+    def start_search(self):
+        keyword = self.search_input.text().strip()
+        if not keyword:
+            return
+        self.stop_search()
+        self.generation += 1
+        gen = self.generation
+        self.list_widget.clear()
+        self.hit_keys = []
+        reader = self.main_window
+        callbacks = dict(
+            on_hits=lambda hits: self.hits_found.emit(gen, hits),
+            on_progress=lambda done, total: self.progress_changed.emit(gen, done, total),
+            on_finished=lambda done, total, count, truncated: self.search_finished.emit(
+                gen, done, total, count, truncated))
+        if self.local:
+            self.searcher = LocalBookSearcher(reader.local_full_text, reader.local_chapters, reader.local_line_index,
+                                              local_book_name(reader.local_file_path), keyword, **callbacks)
+        else:
+            self.searcher = BookSearcher(
+                reader.endpoint, reader.scheduler, reader.current_book['bookUrl'], reader.current_toc,
+                keyword, reader.chapter_cache, engine=reader.replace_engine, **callbacks)
+        self.searcher.start()
+        self.status_label.setText(f"正在搜索“{keyword}”...")
+
+    def stop_search(self):
+        if self.searcher:
+            self.searcher.cancel()
+            self.searcher = None
+
+    def on_hits(self, gen, hits):
+        if gen != self.generation:
+            return
+        # 各章结果到达顺序不定，按章节顺序插入
+        for chapter_index, title, anchor, pos, snippet in hits:
+            key = (chapter_index, pos)
+            row = bisect.bisect(self.hit_keys, key)
+            self.hit_keys.insert(row, key)
+            item = QListWidgetItem(f"{title}\n    {snippet}")
+            item.setData(Qt.UserRole, (chapter_index, anchor))
+            self.list_widget.insertItem(row, item)
+
+    def on_progress(self, gen, done, total):
+        if gen == self.generation:
+            self.status_label.setText(f"已搜索 {done}/{total} 章，命中 {len(self.hit_keys)} 处")
+
+    def on_finished(self, gen, done, total, hit_count, truncated):
+        if gen != self.generation:
+            return
+        summary = f"搜索完成：{done}/{total} 章，命中 {hit_count} 处"
+        if truncated:
+            summary += f" (仅显示前 {SEARCH_MAX_HITS} 处)"
+        elif done < total:
+            summary += f"，{total - done} 章未能获取"
+        self.status_label.setText(summary)
+        self.searcher = None
+
+    def on_item_double_clicked(self, item):
+        self.selected = item.data(Qt.UserRole)
+        self.accept()
+
+    def done(self, result):
+        self.stop_search()
+        super().done(result)
 
 
 # ================= 设置窗口 =================
+_font_families = None  # 系统字体族列表，进程内只枚举一次
+
+
+def font_families():
+    global _font_families
+    if _font_families is None:
+        _font_families = QFontDatabase().families()
+    return _font_families
+
+
+class LazyFontComboBox(QComboBox):
+    """字体下拉框：平时只放当前字体，第一次展开时才填入系统字体列表。
+    QFontComboBox 每次创建都枚举全部字体并逐个绘制预览，字体多时打开设置明显卡顿。"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.populated = False
+        self.setMaxVisibleItems(20)
+
+    def set_family(self, family):
+        index = self.findText(family)
+        if index < 0:
+            self.addItem(family)
+            index = self.count() - 1
+        self.setCurrentIndex(index)
+
+    def showPopup(self):
+        if not self.populated:
+            current = self.currentText()
+            self.blockSignals(True)
+            self.clear()
+            self.addItems(font_families())
+            self.blockSignals(False)
+            self.populated = True
+            self.set_family(current)
+        super().showPopup()
+
+
 class SettingsDialog(QDialog):
+    """创建一次反复使用：每次打开前 reset() 用当前配置刷新各控件"""
+
     def __init__(self, config, parent=None):
         super().__init__(parent)
-        self.config = config
         self.main_window = parent
-        self.original_opacity = self.config.get("opacity", 0.9)
-        self.temp_text_color = self.config.get("text_color")
-        self.temp_bg_color = self.config.get("bg_color")
 
         self.setWindowTitle("设置")
         self.resize(350, 560)
         self.setStyleSheet(DARK_STYLESHEET)
         self.initUI()
+        self.reset(config)
 
     def initUI(self):
         layout = QFormLayout()
-        self.ip_input = QLineEdit(self.config.get("ip"))
+        self.ip_input = QLineEdit()
         layout.addRow("Legado地址:", self.ip_input)
 
         self.check_auto_mode = QCheckBox("🦎 自动挡 (变色龙)")
         self.check_auto_mode.setToolTip("开启后，背景变为背景色+极低透明度。\n字体颜色自动反转。")
-        self.check_auto_mode.setChecked(self.config.get("auto_mode", False))
         self.check_auto_mode.toggled.connect(self.on_auto_mode_toggled)
         layout.addRow(self.check_auto_mode)
 
         self.check_antishot = QCheckBox("🛡️ 系统级防截屏")
         self.check_antishot.setToolTip("开启后，肉眼可见，但截图/录屏时窗口会完全消失（透明）。\n使用 Windows 系统底层保护。")
-        self.check_antishot.setChecked(self.config.get("antishot_mode", False))
         self.check_antishot.toggled.connect(self.on_antishot_toggled)
         layout.addRow(self.check_antishot)
 
         self.opacity_slider = QSlider(Qt.Horizontal)
         self.opacity_slider.setRange(10, 100)
-        self.opacity_slider.setValue(int(self.config.get("opacity") * 100))
         self.opacity_slider.valueChanged.connect(self.on_opacity_change)
         layout.addRow("不透明度:", self.opacity_slider)
 
         self.font_spin = QSpinBox()
         self.font_spin.setRange(8, 60)
-        self.font_spin.setValue(self.config.get("font_size"))
         layout.addRow("字体大小:", self.font_spin)
 
-        self.font_combo = QFontComboBox()
-        current_font_family = self.config.get("font_family", "Microsoft YaHei")
-        self.font_combo.setCurrentFont(QFont(current_font_family))
+        self.font_combo = LazyFontComboBox()
         layout.addRow("字体样式:", self.font_combo)
 
+        self.scroll_speed_spin = QSpinBox()
+        self.scroll_speed_spin.setRange(AUTO_SCROLL_MIN_SPEED, AUTO_SCROLL_MAX_SPEED)
+        self.scroll_speed_spin.setSuffix(" 像素/秒")
+        layout.addRow("滚屏速度:", self.scroll_speed_spin)
+
         self.btn_text_color = QPushButton("文字颜色 (手动)")
-        self.btn_text_color.setStyleSheet(f"background-color: {self.temp_text_color};")
         self.btn_text_color.clicked.connect(self.pick_text_color)
         self.btn_bg_color = QPushButton("背景颜色 (手动)")
-        self.btn_bg_color.setStyleSheet(f"background-color: {self.temp_bg_color};")
         self.btn_bg_color.clicked.connect(self.pick_bg_color)
         layout.addRow(self.btn_text_color, self.btn_bg_color)
 
         self.check_ghost_mode = QCheckBox("👻 幽灵模式 (移开变透明)")
-        self.check_ghost_mode.setChecked(self.config.get("ghost_mode", False))
         layout.addRow(self.check_ghost_mode)
 
-        self.boss_key_input = QLineEdit(self.config.get("boss_key", "Esc"))
+        self.boss_key_input = QLineEdit()
         layout.addRow("全局老板键:", self.boss_key_input)
 
         btn_save = QPushButton("💾 保存并应用")
         btn_save.clicked.connect(self.accept)
         layout.addRow(btn_save)
+        self.setLayout(layout)
+
+    def reset(self, config):
+        self.config = config
+        self.original_opacity = config.get("opacity", 0.9)
+        self.temp_text_color = config.get("text_color")
+        self.temp_bg_color = config.get("bg_color")
+
+        self.ip_input.setText(config.get("ip"))
+        # 填值时不触发预览/防截屏的即时生效
+        live_widgets = (self.check_auto_mode, self.check_antishot, self.opacity_slider)
+        for widget in live_widgets:
+            widget.blockSignals(True)
+        self.check_auto_mode.setChecked(config.get("auto_mode", False))
+        self.check_antishot.setChecked(config.get("antishot_mode", False))
+        self.opacity_slider.setValue(int(config.get("opacity") * 100))
+        for widget in live_widgets:
+            widget.blockSignals(False)
+        self.font_spin.setValue(config.get("font_size"))
+        self.font_combo.set_family(config.get("font_family", "Microsoft YaHei"))
+        self.scroll_speed_spin.setValue(config.get("auto_scroll_speed", AUTO_SCROLL_SPEED))
+        self.btn_text_color.setStyleSheet(f"background-color: {self.temp_text_color};")
+        self.btn_bg_color.setStyleSheet(f"background-color: {self.temp_bg_color};")
+        self.check_ghost_mode.setChecked(config.get("ghost_mode", False))
+        self.boss_key_input.setText(config.get("boss_key", "Esc"))
 
         self.on_auto_mode_toggled(self.check_auto_mode.isChecked())
         self.on_antishot_toggled(self.check_antishot.isChecked())
-        self.setLayout(layout)
 
     def on_auto_mode_toggled(self, checked):
         self.btn_bg_color.setEnabled(not checked)
@@ -370,7 +2933,8 @@ class SettingsDialog(QDialog):
     def accept(self):
         self.config["ip"] = self.ip_input.text().strip()
         self.config["font_size"] = self.font_spin.value()
-        self.config["font_family"] = self.font_combo.currentFont().family()
+        self.config["font_family"] = self.font_combo.currentText()
+        self.config["auto_scroll_speed"] = self.scroll_speed_spin.value()
         self.config["boss_key"] = self.boss_key_input.text().strip()
         self.config["text_color"] = self.temp_text_color
         self.config["bg_color"] = self.temp_bg_color
@@ -388,11 +2952,123 @@ class SettingsDialog(QDialog):
         super().reject()
 
 
+# ================= 会话录制 =================
+TRACE_VERSION = 1
+# 回放时需要还原的配置项 (决定启动时打开的书、位置与排版)
+TRACE_CONFIG_KEYS = ("ip", "font_size", "font_family", "text_color", "bg_color", "opacity",
+                     "ghost_mode", "auto_mode", "window_width", "window_height",
+                     "last_local_file", "last_local_pos")
+
+
+class SessionRecorder:
+    """把阅读器收到的输入流写成紧凑的 JSON Lines 轨迹：首行为配置快照，其后每行 [毫秒, 类型, 参数...]
+
+    类型：k 按键 / w 滚轮 / r 窗口尺寸 / e 鼠标移入 / l 鼠标移出 / a 菜单动作 / c 设置变更
+    """
+
+    def __init__(self, path, config):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.t0 = time.perf_counter()
+        snapshot = {k: config.get(k) for k in TRACE_CONFIG_KEYS}
+        if snapshot.get("last_local_file"):
+            snapshot["last_local_file"] = absolute_book_path(snapshot["last_local_file"])
+        self._write({"v": TRACE_VERSION, "config": snapshot})
+
+    def record(self, kind, *args):
+        self._write([round((time.perf_counter() - self.t0) * 1000, 1), kind, *args])
+
+    def _write(self, obj):
+        self.file.write(json.dumps(obj, ensure_ascii=False, separators=(',', ':')) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+# ================= 最近打开的书 (内存热缓存) =================
+BOOK_STATE_BUDGET = 128 << 20  # 热缓存内各书状态的估算总内存上限
+BOOK_STATE_CAPACITY = 6         # 最多保留的书数
+RESUME_POINT_BYTES = 40 << 10   # gzip 末尾续解状态 (32 KB 窗口 + 状态)
+
+# 切换书籍时整体搬走/搬回的阅读器字段
+LOCAL_STATE_FIELDS = ("local_file_path", "local_archive", "local_full_text", "local_start_index",
+                      "local_page_history", "local_chapters", "local_encoding", "local_byte_length",
+                      "local_bytes_crc", "local_pending_cr", "local_prefix_edges", "local_prefix_checked_at",
+                      "local_page_index", "local_line_index")
+LEGADO_STATE_FIELDS = ("current_book", "current_chapter_index", "current_toc", "chapter_text",
+                       "loaded_chapter_index", "chapter_header_len", "chapter_start_index", "chapter_page_history")
+VIEW_STATE_FIELDS = ("replace_engine", "page_frames", "page_text_version")
+
+
+def estimate_state_bytes(state):
+    """粗略估算一本书状态占用的内存：正文、章节/分页表、目录、解压续解状态与页帧"""
+    total = 0
+    for key in ("local_full_text", "chapter_text", "local_line_index"):
+        total += sys.getsizeof(state.get(key) or "")
+    total += sum(sys.getsizeof(title) + 72 for _, title in state.get("local_chapters", ()))
+    total += sum(36 * len(starts) for starts in state.get("local_page_index", {}).values())
+    toc = state.get("current_toc")
+    if isinstance(toc, CompactToc):
+        total += (sum(sys.getsizeof(t) for t in toc.titles) + sys.getsizeof(toc.url_blob) +
+                  toc.indices.itemsize * len(toc.indices) + toc.url_offsets.itemsize * len(toc.url_offsets))
+    elif toc:
+        total += 320 * len(toc)
+    archive = state.get("local_archive")
+    if archive is not None:
+        total += RESUME_POINT_BYTES if archive.resume_point is not None else 0
+    for frame in state.get("page_frames", {}).values():
+        if frame.pixmap is not None:
+            total += frame.pixmap.width() * frame.pixmap.height() * frame.pixmap.depth() // 8
+        total += 32 * frame.doc.characterCount()
+    return total
+
+
+class BookStateCache:
+    """最近打开的书的完整阅读状态，按总内存预算 LRU 淘汰。
+    正在读的书不在缓存里：切走时放入 (put)，切回时取出 (take)，状态只有一份。"""
+
+    def __init__(self, budget=BOOK_STATE_BUDGET, capacity=BOOK_STATE_CAPACITY):
+        self.budget = budget
+        self.capacity = capacity
+        self._data = OrderedDict()  # key -> (state, 估算字节数)
+        self.total = 0
+
+    def put(self, key, state):
+        self.take(key)
+        size = estimate_state_bytes(state)
+        if size > self.budget:
+            return  # 单本就超预算，不缓存
+        self._data[key] = (state, size)
+        self.total += size
+        while self.total > self.budget or len(self._data) > self.capacity:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.total -= evicted
+
+    def take(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return None
+        self.total -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.total = 0
+
+
 # ================= 主程序 =================
 class StealthReader(QWidget):
-    update_text_signal = pyqtSignal(str, bool)
+    status_signal = pyqtSignal(str, int)  # 后台线程发出的状态提示 (文字, 显示毫秒)
+    chapter_loaded_signal = pyqtSignal(str, int, str, bool, int)
     hotkey_signal = pyqtSignal()
     bookshelf_updated_signal = pyqtSignal(list)
+    download_progress_signal = pyqtSignal(int, int)
+    download_finished_signal = pyqtSignal(str)
+    endpoint_state_signal = pyqtSignal(bool)
+    toc_loaded_signal = pyqtSignal(str, object)
+    local_anchor_signal = pyqtSignal(str, int, int)  # 文件, 原位置, 按指纹找回的位置 (-1 为没找到)
+    local_book_read_signal = pyqtSignal(object, object)  # 打开请求 (文件, 目标位置, 是否换书), read_local_book 的结果或异常
+    local_text_reloaded_signal = pyqtSignal(str, object)  # 文件, 重新读回的全文 (None 为已被改动) 或读取时的异常
+    local_growth_signal = pyqtSignal(str, int, bool, object)  # 文件, 核对时的已读字节数, 是否整段核对, 新增字节 (None 为前文被改)
 
     def __init__(self):
         super().__init__()
@@ -404,13 +3080,51 @@ class StealthReader(QWidget):
         self.current_book = None
         self.current_chapter_index = 0
         self.current_toc = []
+        self.chapter_cache = ChapterTextCache()  # 规整后的章节正文，重复访问不再请求/清洗
+        self.chapter_text = ""  # 当前章节全文 (标题 + 正文)
+        self.loaded_chapter_index = None  # chapter_text 对应的章节 (加载下一章期间与 current_chapter_index 不同)
+        self.chapter_header_len = 0  # 标题部分长度，durChapterPos 从正文起算
+        self.chapter_start_index = 0  # 当前页起始字符在章节中的索引 (锚点)
+        self.chapter_page_history = []
+        self.book_downloader = None  # 正在进行的离线下载
+        self.last_search_keyword = ""
+        self.book_states = BookStateCache()  # 最近读过的书，切回时免重新加载
+        self.warming = None  # 书架上选中的书正在预热的 (书, 章节, Future)
+        self.open_clock = None  # 正在打开的书与开始时刻，首屏显示后记入 first_page_times
+        self.first_page_times = []  # 每次打开书到首屏显示的耗时 (毫秒)
+        self.tray_status = ""  # 托盘提示的状态行 (连接/下载)，首屏耗时附在其后
+
+        # --- 内容净化规则 ---
+        self.replace_rules = load_replace_rules()
+        self.replace_engines = {}  # 书名 -> 引擎 (规则按范围筛选后各书不同)
+        self.replace_engine = None  # 当前书使用的引擎，无适用规则时为 None
 
         # --- 本地书籍数据 ---
         self.is_local_mode = False  # 模式标记
         self.local_full_text = ""  # 本地文件全文内容
+        self.local_archive = None  # 压缩书籍的读取器 (保留末尾续解状态)
         self.local_start_index = 0  # 当前页起始字符在全文中的索引 (锚点)
         self.local_page_history = []  # 记录翻页历史，用于"上一页"
         self.local_file_path = ""  # 当前文件路径
+        self.local_chapters = []  # 章节索引 [(字符偏移, 标题)]
+        self.local_encoding = ""  # 解码所用编码
+        self.local_byte_length = 0  # 已解码的字节数
+        self.local_bytes_crc = 0  # 已解码字节的 CRC，标识文件内容 (位置指纹、重新读入时核对)
+        self.pending_anchor = None  # 文件改动后正在后台按指纹查找的原位置指纹
+        self.local_read_request = None  # 正在后台读取的本地书 (文件, 目标位置, 是否换书)
+        self.local_pending_cr = False  # 已读内容以 \r 结尾，追加部分可能以 \n 开头
+        self.local_prefix_edges = (b"", b"")  # 已解码字节的开头与末尾各一小段，文件变化时先核对这两段
+        self.local_prefix_checked_at = 0.0  # 上次整段 crc 核对的时刻 (monotonic)
+        self.growth_future = None  # 正在后台核对文件变化的任务
+        self.local_page_index = {}  # 预处理得到的整书页首 {排版方案: [页首偏移]}
+        self.local_line_index = None  # 预处理得到的行首偏移表 (打包字符串)，书内搜索定位段落用
+        self.local_toc = []  # 目录窗口用的章节列表，由 local_chapters 生成
+        self.local_toc_source = None
+
+        # --- 页帧缓存 (当前页 + 空闲时预备的相邻页) ---
+        self.page_frames = {}  # 起始索引 -> PageFrame
+        self.current_frame = None  # 正在显示的页帧，持有其文档的引用
+        self.page_text_version = 0  # 正文内容变化时递增，使旧页帧失效
 
         # --- 界面控制 ---
         self.single_line_height = 20
@@ -419,36 +3133,112 @@ class StealthReader(QWidget):
         self.is_moving = False
         self.resize_margin = 15
         self.last_toggle_time = 0
+        self.suspended = False  # 老板键隐藏后的低占用状态
+        self.hidden_snapshot = None  # 隐藏前当前页的位图
+        self.hidden_file_stat = None  # 隐藏时本地书文件的 (大小, 修改时间)，重新显示时据此判断是否被改动
         self.local_shortcut = None
-        self.book_selector_dialog = None
+        self.book_selector_dialog = None  # 书架/目录/设置窗口首次打开时创建，之后复用
+        self.toc_dialog = None
+        self.settings_dialog = None
         self.oldPos = QPoint(0, 0)
+        self.recorder = None  # 会话录制 (--record)
+
+        # 后台任务统一调度 (交互/预取/索引/同步)
+        self.scheduler = TaskScheduler()
+
+        # 阅读APP连接监测：断线时请求立即失败，恢复后补同步
+        self.endpoint = EndpointMonitor(self.config["ip"], self.endpoint_state_signal.emit)
 
         self.chameleon_timer = QTimer(self)
         self.chameleon_timer.setInterval(500)
         self.chameleon_timer.timeout.connect(self.adjust_color_to_background)
 
+        # 零超时定时器：事件队列空闲时才预备相邻页
+        self.prerender_timer = QTimer(self)
+        self.prerender_timer.setSingleShot(True)
+        self.prerender_timer.setInterval(0)
+        self.prerender_timer.timeout.connect(self.prerender_adjacent_pages)
+
+        # --- 自动滚屏：精确定时器按屏幕刷新周期推进 ---
+        self.auto_scroll_enabled = False
+        self.auto_scroll_offset = 0.0  # 当前页帧内已滚动的像素
+        self.auto_scroll_clock = QElapsedTimer()
+        self.auto_scroll_timer = QTimer(self)
+        self.auto_scroll_timer.setTimerType(Qt.PreciseTimer)
+        self.auto_scroll_timer.timeout.connect(self.auto_scroll_tick)
+
+        # --- 翻页输入合并：按键自动重复、触控板细粒度滚轮在空闲时一次结算 ---
+        self.pending_page_steps = 0
+        self.wheel_delta_accum = 0
+        self.last_wheel_time = 0
+        self.loading_chapter_index = None  # 正在加载的章节，加载期间不重复跨章
+        self.page_turn_timer = QTimer(self)
+        self.page_turn_timer.setSingleShot(True)
+        self.page_turn_timer.setInterval(0)
+        self.page_turn_timer.timeout.connect(self.flush_page_turns)
+        # 章内翻页也要让手机端跟上：连续翻页停下后才同步一次
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setSingleShot(True)
+        self.sync_timer.setInterval(SYNC_DEBOUNCE)
+        self.sync_timer.timeout.connect(self.sync_progress_async)
+
+        # --- 本地文件监视：连载文件被追加时增量更新 ---
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.fileChanged.connect(self.on_local_file_changed)
+        self.file_change_timer = QTimer(self)  # 写入往往是一串事件，合并后再检查
+        self.file_change_timer.setSingleShot(True)
+        self.file_change_timer.setInterval(300)
+        self.file_change_timer.timeout.connect(self.check_local_file_growth)
+
         self.initUI()
         self.initTray()
 
-        self.update_text_signal.connect(self.on_update_text_safe)
+        self.status_signal.connect(self.show_status)
+        self.chapter_loaded_signal.connect(self.on_chapter_loaded)
         self.hotkey_signal.connect(self.toggle_window)
         self.bookshelf_updated_signal.connect(self.on_bookshelf_updated)
+        self.download_progress_signal.connect(self.on_download_progress)
+        self.download_finished_signal.connect(self.on_download_finished)
+        self.endpoint_state_signal.connect(self.on_endpoint_state_changed)
+        self.toc_loaded_signal.connect(self.on_toc_loaded)
+        self.local_anchor_signal.connect(self.on_local_anchor_found)
+        self.local_book_read_signal.connect(self.on_local_book_read)
+        self.local_growth_signal.connect(self.on_local_growth)
+        self.local_text_reloaded_signal.connect(self.on_local_text_reloaded)
 
         self.refresh_hotkeys()
+        self.endpoint.start()
 
         # 尝试恢复上次打开的本地文件
-        if self.config.get("last_local_file") and os.path.exists(self.config["last_local_file"]):
-            self.update_text_signal.emit("正在恢复上次阅读...", False)
+        if self.config.get("last_local_file") and book_path_exists(self.config["last_local_file"]):
+            self.show_status("正在恢复上次阅读...")
             QTimer.singleShot(500, self.restore_last_local_file)
         elif self.config["ip"] and self.config["ip"].startswith("http"):
             self.fetch_bookshelf_silent()
-            self.update_text_signal.emit("初始化完成。\n右键菜单可打开本地TXT文件。", False)
+            self.show_status("初始化完成。\n右键菜单可打开本地TXT文件。")
         else:
-            self.update_text_signal.emit("欢迎使用。\n右键打开本地书籍或设置Legado。", False)
+            self.show_status("欢迎使用。\n右键打开本地书籍或设置Legado。")
 
         if self.config.get("antishot_mode", False):
             QTimer.singleShot(100, lambda: set_window_protection(int(self.winId()), True))
 
+    # --- 会话录制 ---
+    def start_recording(self, path):
+        self.recorder = SessionRecorder(path, self.config)
+        self.record_input("r", self.width(), self.height())
+
+    def stop_recording(self):
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+
+    def record_input(self, kind, *args):
+        if self.recorder:
+            if kind == "a" and args[0] == "load_local_file":
+                # 回放在临时目录中进行，相对路径要先转成绝对路径
+                args = (args[0], absolute_book_path(args[1]), *args[2:])
+            self.recorder.record(kind, *args)
+
     def restore_last_local_file(self):
         path = self.config["last_local_file"]
         pos = self.config.get("last_local_pos", 0)
@@ -464,10 +3254,13 @@ class StealthReader(QWidget):
             self,
             "选择文本文件",
             "",
-            "Text Files (*.txt);;All Files (*)",
+            "Text Files (*.txt *.gz *.bz2 *.xz *.zip);;All Files (*)",
             options=options
         )
 
+        if file_path and file_path.lower().endswith('.zip'):
+            file_path = self.choose_zip_member(file_path)
+
         if file_path:
             # 检查是否是同一本书
             last_file = self.config.get("last_local_file", "")
@@ -481,34 +3274,143 @@ class StealthReader(QWidget):
 
             if is_same_file:
                 # 是同一本书：恢复上次进度
-                saved_pos = self.config.get("last_local_pos", 0)
-                self.load_local_file(file_path, target_pos=saved_pos)
+                target_pos = self.config.get("last_local_pos", 0)
             else:
                 # 是新书：从头开始
-                self.load_local_file(file_path, target_pos=0)
+                target_pos = 0
+            self.record_input("a", "load_local_file", file_path, target_pos)
+            self.load_local_file(file_path, target_pos=target_pos)
+
+    def choose_zip_member(self, zip_path):
+        """zip 书库包里有多本书时让用户挑一本，返回 "包路径::成员名"；取消时返回 None"""
+        try:
+            members = zip_text_members(zip_path)
+        except (OSError, zipfile.BadZipFile) as e:
+            self.show_status(f"打开压缩包失败: {e}")
+            return None
+        if not members:
+            self.show_status("压缩包内没有 TXT 文件")
+            return None
+        if len(members) == 1:
+            return zip_path + ARCHIVE_MEMBER_SEP + members[0]
+        labels = [zip_member_label(m) for m in members]
+        label, ok = QInputDialog.getItem(self, "选择书籍", "压缩包内的 TXT：", labels, 0, False)
+        if not ok:
+            return None
+        return zip_path + ARCHIVE_MEMBER_SEP + members[labels.index(label)]
 
     def load_local_file(self, file_path, target_pos=0):
+        self.open_clock = (file_path, time.perf_counter())
+        # 切回最近读过的书：从热缓存直接恢复，不再读取、解码与分页
+        switching = not (self.is_local_mode and file_path == self.local_file_path)
+        if switching:
+            state = self.book_states.take(("local", file_path))
+            if state is not None:
+                self.local_read_request = None
+                self.stash_current_book()
+                self.restore_local_book(file_path, state)
+                self.note_first_page(file_path)
+                return
+        # 读取与解码都在工作线程中进行，读完前当前页照常显示
+        lane = LANE_INTERACTIVE
+        if switching and is_archive_path(file_path):
+            if self.show_archive_preview(file_path, target_pos):
+                # 首屏已从最近的检查点解出 (当前书已移入热缓存)；整本在空闲时后台解压，读完再接管翻页与章节
+                lane, switching = LANE_INDEXING, False
+            else:
+                self.show_status(f"正在解压: {local_book_name(file_path)}", STATUS_TIMEOUT * 10)
+        self.local_read_request = (file_path, target_pos, switching)
+        self.scheduler.submit(lane, self._read_local_task, self.local_read_request, key="local_read")
+
+    def _read_local_task(self, request):
         try:
-            content = ""
-            # 尝试多种编码读取
-            try:
-                with open(file_path, 'r', encoding='utf-8-sig') as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                try:
-                    with open(file_path, 'r', encoding='gb18030') as f:
-                        content = f.read()
-                except Exception as e:
-                    self.update_text_signal.emit(f"编码无法识别，请转为UTF-8或GBK", False)
-                    return
+            result = read_local_book(request[0])
+        except Exception as e:
+            traceback.print_exc()
+            result = e
+        self.local_book_read_signal.emit(request, result)
+
+    def on_local_book_read(self, request, result):
+        if request is not self.local_read_request:
+            return  # 读取期间又打开了别的书 (或同一本书的更新的请求)
+        self.local_read_request = None
+        file_path, target_pos, switching = request
+        if isinstance(result, Exception):
+            self.show_status(f"打开文件失败: {result}")
+            return
+        self.open_local_book(file_path, target_pos, result, switching)
+
+    def show_archive_preview(self, file_path, target_pos):
+        """有检查点索引的压缩书：只解出 target_pos 所在的一段，先把这一页显示出来；没有有效索引时返回 False"""
+        try:
+            preview = read_archive_preview(file_path, max(0, target_pos), PAGE_BUFFER_LENGTH)
+        except (OSError, ValueError, KeyError, zlib.error):
+            return False
+        if preview is None:
+            return False
+        text_start, text = preview
+        start = max(0, target_pos) - text_start
+        if not 0 <= start < len(text):
+            return False
+
+        self.stash_current_book()
+        self.is_local_mode = True
+        self.local_file_path = file_path
+        self.local_archive = None
+        self.local_full_text = ""  # 整本读完之前不翻页
+        self.local_chapters = []
+        self.local_page_index = {}
+        self.local_line_index = None
+        self.local_start_index = max(0, target_pos)
+        self.local_page_history = []
+        self.replace_engine = self.engine_for(local_book_name(file_path))
+        self.invalidate_page_frames(content_changed=True)
+
+        window = display_window(text, start, min(len(text), start + PAGE_BUFFER_LENGTH), self.page_transform())
+        self.current_frame = None
+        self.text_edit.setDocument(layout_plain_document(window.text, self.text_edit.font(),
+                                                         self.text_edit.viewport().width(),
+                                                         self.text_edit.document().defaultTextOption()))
+        self.text_edit.verticalScrollBar().setValue(0)
+        self.note_first_page(file_path)
+        return True
+
+    def open_local_book(self, file_path, target_pos, book, switching):
+        """换上工作线程读入并解码好的整本书 (read_local_book 的结果)"""
+        try:
+            # 预处理过的书直接使用缓存的章节与分页
+            raw, archive, crc, content, encoding, artifact = book
+            if content is None:
+                self.show_status(f"编码无法识别，请转为UTF-8或GBK")
+                return
 
             if not content:
-                self.update_text_signal.emit("文件为空", False)
+                self.show_status("文件为空")
                 return
 
+            # 文件与保存进度时不同 (重新下载/转码/编辑)：先按旧位置显示，再在后台按内容指纹找回原位置
+            anchor = self.saved_anchor(file_path, target_pos)
+            relocate = anchor is not None and tuple(anchor["identity"]) != (len(raw), crc)
+            self.pending_anchor = anchor if relocate else None
+
+            if switching:
+                self.stash_current_book()  # 新书读取成功后再把当前书移入热缓存
             self.is_local_mode = True
             self.local_file_path = file_path
+            self.local_archive = archive
             self.local_full_text = content
+            self.local_encoding = encoding
+            self.local_byte_length = len(raw)
+            self.local_bytes_crc = crc
+            self.local_pending_cr = raw.endswith(b'\r')
+            self.local_prefix_edges = extend_prefix_edges((b"", b""), raw)
+            self.local_prefix_checked_at = time.monotonic()
+            self.local_chapters = artifact["chapters"] if artifact else scan_chapter_headings(content)
+            self.local_page_index = artifact["pages"] if artifact else {}
+            self.local_line_index = artifact.get("lines") if artifact else None
+            self.replace_engine = self.engine_for(local_book_name(file_path))
+            self.invalidate_page_frames(content_changed=True)
+            self.watch_local_file(file_path)
 
             # 安全校验索引
             safe_pos = min(max(0, target_pos), len(content) - 1)
@@ -520,139 +3422,634 @@ class StealthReader(QWidget):
             self.config["last_local_pos"] = safe_pos
             self.save_config()
 
-            self.render_local_page()
+            self.status_toast.dismiss()  # 收起"正在解压"之类的提示
+            self.render_page()
+            self.note_first_page(file_path)
+
+            # 压缩书首次整本读完后在后台建检查点索引，下次打开只解压进度所在的一段就能先显示
+            if archive is not None:
+                index = load_archive_index(file_path)
+                if index is None or index.get("crc") != crc:
+                    self.scheduler.submit(LANE_INDEXING, build_archive_index, file_path, archive, raw, encoding,
+                                          crc, key="archive_index")
 
-            if safe_pos > 0:
-                self.update_text_signal.emit(f"已恢复进度: {os.path.basename(file_path)}", False)
+            if relocate:
+                # 整书找不到时要扫好几秒，放到索引通道，不占用章节/书架请求的交互名额
+                self.scheduler.submit(LANE_INDEXING, self._relocate_task, file_path, content,
+                                      target_pos, safe_pos, anchor, key="reanchor")
+            elif safe_pos > 0:
+                self.show_status(f"已恢复进度: {local_book_name(file_path)}")
 
         except Exception as e:
             traceback.print_exc()
-            self.update_text_signal.emit(f"打开文件失败: {str(e)}", False)
+            self.show_status(f"打开文件失败: {str(e)}")
+
+    # --- 阅读位置指纹：文件被改动后找回原位置 ---
+    def saved_anchor(self, file_path, pos):
+        """file_path 在 pos 处的内容指纹：正在读这本书时现算，否则取配置里随进度保存的指纹"""
+        if (self.is_local_mode and file_path == self.local_file_path and self.local_full_text
+                and pos == self.local_start_index):
+            if self.pending_anchor is not None:
+                return self.pending_anchor  # 上次的查找还没结束，沿用原指纹
+            return position_fingerprint(self.local_full_text, pos, (self.local_byte_length, self.local_bytes_crc))
+        if file_path == self.config.get("last_local_file") and pos == self.config.get("last_local_pos"):
+            return self.config.get("last_local_anchor")
+        return None
+
+    def _relocate_task(self, file_path, text, old_pos, origin_pos, anchor):
+        new_pos = relocate_position(text, old_pos, anchor)
+        self.local_anchor_signal.emit(file_path, origin_pos, -1 if new_pos is None else new_pos)
+
+    def on_local_anchor_found(self, file_path, origin_pos, new_pos):
+        if not self.is_local_mode or file_path != self.local_file_path:
+            return  # 已换书
+        self.pending_anchor = None
+        if self.local_start_index != origin_pos:
+            self.save_config()  # 用户已经翻页，以当前位置为准
+            return
+        if new_pos < 0:
+            self.show_status("文件已改动，未能找回上次位置")
+        elif new_pos != origin_pos:
+            self.local_start_index = min(new_pos, len(self.local_full_text) - 1)
+            self.render_page()
+            self.show_status("文件已改动，已按内容找回上次位置")
+        self.config["last_local_pos"] = self.local_start_index
+        self.save_config()
+
+    # --- 最近打开的书：切换时保留全文、页帧、目录与锚点 ---
+    def book_state_key(self):
+        if self.is_local_mode:
+            return ("local", self.local_file_path) if self.local_full_text else None
+        if self.current_book and self.chapter_text:
+            return ("legado", self.current_book['bookUrl'])
+        return None
+
+    def stash_current_book(self):
+        """把正在读的书整体放进热缓存 (只搬引用，不复制)"""
+        if self.sync_timer.isActive():
+            self.sync_progress_async()  # 换书前先把这本书章内翻页的进度同步出去
+        key = self.book_state_key()
+        if key is None:
+            return
+        fields = LOCAL_STATE_FIELDS if self.is_local_mode else LEGADO_STATE_FIELDS
+        state = {name: getattr(self, name) for name in fields + VIEW_STATE_FIELDS}
+        state["stashed_at"] = int(time.time() * 1000)
+        if self.is_local_mode:
+            state["file_stat"] = local_file_stat(self.local_file_path)
+        self.book_states.put(key, state)
+
+    def apply_book_state(self, state, fields, book_name):
+        """搬回缓存的字段与页帧；净化规则在离开期间被修改过时返回 False (页帧已作废)"""
+        for name in fields + ("page_frames", "page_text_version"):
+            setattr(self, name, state[name])
+        self.replace_engine = self.engine_for(book_name)
+        if self.replace_engine is not state["replace_engine"]:
+            self.invalidate_page_frames(content_changed=True)
+            return False
+        return True
+
+    def restore_local_book(self, file_path, state):
+        self.is_local_mode = True
+        self.apply_book_state(state, LOCAL_STATE_FIELDS, local_book_name(file_path))
+        self.watch_local_file(file_path)
+
+        self.config["last_local_file"] = file_path
+        self.config["last_local_pos"] = self.local_start_index
+        self.save_config()
+        self.render_page()
+        # 离开期间文件有变化：按追加/改动的规则补上
+        if local_file_stat(file_path) != state["file_stat"]:
+            self.file_change_timer.start()
+
+    def restore_legado_book(self, book, state):
+        """切回最近读过的网络书；手机端在离开后又读过 (进度时间更新) 时返回 False，按书架进度重新加载"""
+        if (book.get('durChapterTime') or 0) > state["stashed_at"]:
+            return False
+        self.is_local_mode = False
+        self.loading_chapter_index = None  # 离开前的请求已作废，否则翻页一直被挡住
+        rules_unchanged = self.apply_book_state(state, LEGADO_STATE_FIELDS, book['name'])
+        self.current_book = book  # 书架上的条目更新 (章节数、更新时间)
+        if not rules_unchanged:
+            # 网络章节在加载时整章净化，规则变了只能重新取当前章
+            self.chapter_text = ""
+            self.fetch_chapter_content(book['bookUrl'], self.current_chapter_index, False,
+                                       chapter_pos=max(0, self.chapter_start_index - self.chapter_header_len))
+        else:
+            self.render_page()
+        if not isinstance(self.current_toc, CompactToc) or not self.current_toc.is_current(book):
+            self.fetch_toc_silent(book)
+        return True
+
+    # --- 连载追加：文件只在末尾增长时增量解码，不重新读入与分页 ---
+    def watch_local_file(self, file_path):
+        watched = self.file_watcher.files()
+        if watched:
+            self.file_watcher.removePaths(watched)
+        if file_path:
+            self.file_watcher.addPath(split_book_path(file_path)[0])
+
+    def on_local_file_changed(self, path):
+        if self.suspended:
+            return  # 隐藏期间正文已释放，重新显示时整体核对
+        if self.is_local_mode and self.local_file_path and path == split_book_path(self.local_file_path)[0]:
+            self.file_change_timer.start()
+
+    def check_local_file_growth(self):
+        if not self.is_local_mode or not self.local_file_path or not self.local_full_text:
+            return
+        path = split_book_path(self.local_file_path)[0]
+        if not os.path.exists(path):
+            return
+        # 部分编辑器以“写新文件再改名”的方式保存，监视会随之失效
+        if path not in self.file_watcher.files():
+            self.file_watcher.addPath(path)
+
+        if self.growth_future is not None and not self.growth_future.done():
+            self.file_change_timer.start()  # 上一次核对还没结束，稍后再查
+            return
+
+        # 核对与读取在工作线程中进行；两端字节每次都比，整段 crc 隔一段时间才重算一次
+        full = time.monotonic() - self.local_prefix_checked_at >= PREFIX_FULL_CHECK_INTERVAL
+        if self.local_archive is not None:
+            task = (self.local_archive.read_appended, self.local_byte_length, full)
+        else:
+            task = (read_local_growth, path, self.local_byte_length, self.local_bytes_crc,
+                    self.local_prefix_edges, full)
+        self.growth_future = self.scheduler.submit(LANE_INDEXING, self._growth_task, self.local_file_path,
+                                                   self.local_byte_length, full, *task, key="local_growth")
+
+    def _growth_task(self, file_path, length, full, read, *args):
+        try:
+            data = read(*args)
+        except (OSError, EOFError, zlib.error):
+            return  # 文件可能正在写入，等下一次变化
+        self.local_growth_signal.emit(file_path, length, full, data)
+
+    def on_local_growth(self, file_path, length, full, data):
+        if (not self.is_local_mode or file_path != self.local_file_path or not self.local_full_text
+                or length != self.local_byte_length):
+            return  # 已换书、已重新读入或正文已释放
+        if data is None:
+            # 前文被修改 (或格式不支持续读)：整本重建，尽量停留在原位置
+            self.load_local_file(file_path, target_pos=self.local_start_index)
+            return
+        if full:
+            self.local_prefix_checked_at = time.monotonic()
+        if data:
+            try:
+                self.append_local_text(data)
+            except UnicodeDecodeError:
+                self.load_local_file(file_path, target_pos=self.local_start_index)
+
+    def append_local_text(self, data):
+        """解码新增的尾部字节，扩展全文、章节索引与受影响的页帧，锚点保持不动"""
+        tail, consumed, self.local_pending_cr = decode_appended(data, self.local_encoding, self.local_pending_cr)
+        if not consumed:
+            return
+
+        self.local_bytes_crc = zlib.crc32(data[:consumed], self.local_bytes_crc)
+        self.local_prefix_edges = extend_prefix_edges(self.local_prefix_edges, data[:consumed])
+        self.local_byte_length += consumed
+
+        old_len = len(self.local_full_text)
+        self.local_full_text += tail
+        self.local_page_index = {}  # 预处理的分页与行首索引不含新增内容
+        self.local_line_index = None
+
+        # 原文最后一行可能是写了一半的标题，从该行行首起重新识别
+        rescan_from = self.local_full_text.rfind('\n', 0, old_len) + 1
+        self.local_chapters = ([c for c in self.local_chapters if c[0] < rescan_from] +
+                               scan_chapter_headings(self.local_full_text, rescan_from))
+
+        # 页首与翻页历史都不变；只有排版窗口触及旧文末的页帧需要重建
+        for start in [k for k in self.page_frames if k + PAGE_BUFFER_LENGTH > old_len]:
+            del self.page_frames[start]
+        if self.local_start_index + PAGE_BUFFER_LENGTH > old_len:
+            self.render_page()
+
+    def jump_to_local_offset(self, pos):
+        self.record_input("a", "jump_to_local_offset", pos)
+        self.local_page_history.append(self.local_start_index)
+        self.local_start_index = min(max(0, pos), len(self.local_full_text) - 1)
+        self.render_page()
+        self.config["last_local_pos"] = self.local_start_index
+        self.save_config()
+
+    # --- 内容净化规则 ---
+    def engine_for(self, book_name):
+        """当前书适用的规则引擎；规则关闭或没有适用规则时返回 None"""
+        if not self.config.get("replace_enabled", True):
+            return None
+        if book_name not in self.replace_engines:
+            rules = [r for r in self.replace_rules if rule_in_scope(r, book_name)]
+            self.replace_engines[book_name] = ReplaceRuleEngine(rules) if rules else None
+        return self.replace_engines[book_name]
+
+    def page_transform(self):
+        """本地模式按分页窗口净化 (锚点仍为原文位置)；网络章节加载时已整章净化"""
+        if self.is_local_mode and self.replace_engine:
+            return self.replace_engine.apply
+        return None
+
+    def apply_replace_rules(self):
+        """规则或开关变化后重建引擎，并按新规则重排当前页"""
+        self.replace_engines = {}
+        if self.is_local_mode and self.local_full_text:
+            self.replace_engine = self.engine_for(local_book_name(self.local_file_path))
+            self.invalidate_page_frames(content_changed=True)
+            self.render_page()
+        elif self.current_book:
+            self.replace_engine = self.engine_for(self.current_book['name'])
+            self.fetch_chapter_content(self.current_book['bookUrl'], self.current_chapter_index, False,
+                                       chapter_pos=max(0, self.chapter_start_index - self.chapter_header_len))
+
+    def toggle_replace_rules(self, enabled):
+        self.config["replace_enabled"] = enabled
+        self.save_config()
+        self.apply_replace_rules()
 
-    # --- 本地分页渲染算法 (锚点核心) ---
-    def render_local_page(self):
-        if not self.is_local_mode or not self.local_full_text:
+    def import_replace_rules(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_path, _ = QFileDialog.getOpenFileName(self, "选择阅读APP导出的净化规则", "",
+                                                   "JSON Files (*.json);;All Files (*)", options=options)
+        if not file_path:
             return
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                rules = json.load(f)
+            if isinstance(rules, dict):
+                rules = [rules]
+            rules = [r for r in rules if isinstance(r, dict) and r.get("pattern")]
+            with open(REPLACE_RULES_FILE, 'w', encoding='utf-8') as f:
+                json.dump(rules, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            self.show_status(f"规则导入失败: {e}")
+            return
+        self.replace_rules = rules
+        self.apply_replace_rules()
+
+    # --- 分页引擎的数据源：本地模式为全文，网络模式为当前章节 ---
+    @property
+    def page_text(self):
+        return self.local_full_text if self.is_local_mode else self.chapter_text
+
+    @property
+    def page_start(self):
+        return self.local_start_index if self.is_local_mode else self.chapter_start_index
 
-        # 截取缓冲区（保证填满屏幕，取5000字足以覆盖各种屏幕）
-        buffer_length = 5000
-        end_buffer = min(self.local_start_index + buffer_length, len(self.local_full_text))
+    @page_start.setter
+    def page_start(self, value):
+        if self.is_local_mode:
+            self.local_start_index = value
+        else:
+            self.chapter_start_index = value
 
-        display_text = self.local_full_text[self.local_start_index: end_buffer]
+    @property
+    def page_history(self):
+        return self.local_page_history if self.is_local_mode else self.chapter_page_history
+
+    # --- 分页渲染算法 (锚点核心，本地/网络共用) ---
+    def render_page(self):
+        text = self.page_text
+        if not text:
+            return
 
-        self.text_edit.setPlainText(display_text)
+        # 优先换上空闲时预备好的页帧，没有则当场排版
+        frame = self.page_frames.get(self.page_start)
+        if frame is None or frame.signature != self._frame_signature():
+            frame = self.build_page_frame(self.page_start)
 
-        # 【关键】强制滚动条回顶，确保 local_start_index 对应的字符永远在第一行
+        self.current_frame = frame
+        self.text_edit.setDocument(frame.doc)
+
+        # 【关键】强制滚动条回顶，确保锚点对应的字符永远在第一行
         self.text_edit.verticalScrollBar().setValue(0)
+        self.auto_scroll_offset = 0.0
+
+        # 只保留仍与当前页相邻的页帧，其余交给空闲预备
+        keep = {frame.start, frame.next_start}
+        if self.page_history:
+            keep.add(self.page_history[-1])
+        self.page_frames = {k: v for k, v in self.page_frames.items() if k in keep}
+        self.page_frames[frame.start] = frame
+        self.prerender_timer.start()
+
+    def _frame_signature(self):
+        """页帧依赖的全部排版条件：正文、视图尺寸、字体、文字颜色"""
+        viewport = self.text_edit.viewport()
+        return (self.is_local_mode, self.page_text_version, viewport.width(), viewport.height(),
+                self.text_edit.font().key(), self.text_edit.palette().color(QPalette.Text).rgba())
+
+    def build_page_frame(self, start, rasterize=False):
+        """离屏排版 start 开始的一页，并计算下一页起点；rasterize 时顺带光栅化可见区域 (预热字形缓存)。
+        翻页/调整窗口时当场排版的页不光栅化：编辑器自己绘制文档，位图只会多花时间"""
+        text = self.page_text
+        end_buffer = min(start + PAGE_BUFFER_LENGTH, len(text))
+        window = display_window(text, start, end_buffer, self.page_transform())
+
+        viewport = self.text_edit.viewport()
+        doc = layout_plain_document(window.text, self.text_edit.font(), viewport.width(),
+                                    self.text_edit.document().defaultTextOption())
+
+        # 探测点：视图左下角再往下一点点 (取下一行的开头)
+        pos, _ = page_break_at(doc, viewport.height() + 2)
+        if pos is None:
+            # 一页装不满：探测点落在最后一行之下
+            pos = len(window.text)
+
+        frame = PageFrame(start, doc, start + window.to_source(pos), None, self._frame_signature(), window)
+        if rasterize:
+            self.rasterize_page_frame(frame)
+        return frame
+
+    def rasterize_page_frame(self, frame):
+        if frame.pixmap is None:
+            frame.pixmap = render_document_pixmap(frame.doc, self.text_edit.viewport().size(),
+                                                  self.text_edit.palette().color(QPalette.Text),
+                                                  self.text_edit.devicePixelRatioF())
+        return frame.pixmap
+
+    def invalidate_page_frames(self, content_changed=False):
+        """尺寸/样式/正文变化后丢弃预备的页帧 (正在显示的页帧保留到被替换为止)"""
+        if content_changed:
+            self.page_text_version += 1
+        self.page_frames = {}
+        self.prerender_timer.stop()
+
+    def prerender_adjacent_pages(self):
+        """空闲时每次预备一个相邻页帧，未完成则在下一个空闲时间片继续"""
+        frame = self.current_frame
+        if not self.isVisible() or not self.page_text or frame is None:
+            return
+        # 自动滚屏时锚点按行前进，整页的相邻页帧用不上
+        if self.auto_scroll_timer.isActive():
+            return
+        signature = self._frame_signature()
+        if frame.signature != signature or frame.start != self.page_start:
+            return
+
+        starts = []
+        if frame.next_start < len(self.page_text):
+            starts.append(frame.next_start)
+        if self.page_history:
+            starts.append(self.page_history[-1])
+        elif frame.start > 0:
+            if frame.prev_start is None:
+                frame.prev_start = self.calc_prev_page_start()
+            starts.append(frame.prev_start)
+
+        for start in starts:
+            cached = self.page_frames.get(start)
+            if cached is None or cached.signature != signature:
+                self.page_frames[start] = self.build_page_frame(start, rasterize=True)
+                self.prerender_timer.start()
+                return
+
+    def indexed_page_starts(self):
+        """当前排版方案对应的预处理页首列表，没有则返回 None"""
+        # 预处理的分页基于原文，启用净化规则后不再适用
+        if not self.is_local_mode or not self.local_page_index or self.replace_engine:
+            return None
+        viewport = self.text_edit.viewport()
+        key = layout_profile_key(self.config.get('font_family', 'Microsoft YaHei'), self.config['font_size'],
+                                 viewport.width(), viewport.height(),
+                                 round(QApplication.primaryScreen().logicalDotsPerInchY()))
+        return self.local_page_index.get(key)
+
+    def indexed_page_position(self):
+        """当前页在预处理页首列表中的 (列表, 下标)；锚点不在页首上 (如调整过窗口) 时返回 (None, -1)"""
+        starts = self.indexed_page_starts()
+        if starts:
+            i = bisect.bisect_left(starts, self.page_start)
+            if i < len(starts) and starts[i] == self.page_start:
+                return starts, i
+        return None, -1
 
     # --- 核心：基于几何坐标探测下一页起始位置 ---
     def calc_next_page_start(self):
-        """利用视图几何坐标，探测屏幕底部边缘的字符位置"""
+        """返回当前页容纳的字符数 (由页帧排版时探测屏幕底部边缘得到)"""
         # 【新增保护】防止空内容计算
-        if not self.text_edit.toPlainText():
+        if not self.page_text:
             return 0
 
-        viewport_h = self.text_edit.viewport().height()
-        # 探测点：视图左下角再往下一点点 (取下一行的开头)
-        target_y = viewport_h + 2
-
-        cursor = self.text_edit.cursorForPosition(QPoint(0, target_y))
-        next_pos_in_buffer = cursor.position()
-
-        # 异常处理：如果一页装不满，cursor会指向文档末尾
-        if next_pos_in_buffer >= len(self.text_edit.toPlainText()):
-            return len(self.text_edit.toPlainText())
-
-        return next_pos_in_buffer
+        frame = self.current_frame
+        if frame is None or frame.start != self.page_start or frame.signature != self._frame_signature():
+            frame = self.build_page_frame(self.page_start)
+        return frame.next_start - frame.start
 
     # --- 核心：基于反向排版探测上一页起始位置 ---
     def calc_prev_page_start(self):
-        """通过加载前文并滚到底部，探测上一页的起始位置"""
-        if self.local_start_index == 0:
+        """在离屏文档中排版前文，反推恰好以当前页首行结尾的上一页起始位置"""
+        start = self.page_start
+        if start == 0:
             return 0
 
-        self.text_edit.setUpdatesEnabled(False)
-        try:
-            buffer_size = 5000
-            temp_start = max(0, self.local_start_index - buffer_size)
-            prev_content = self.local_full_text[temp_start: self.local_start_index]
-
-            self.text_edit.setPlainText(prev_content)
+        frame = self.current_frame
+        if (frame is not None and frame.prev_start is not None and frame.start == start
+                and frame.signature == self._frame_signature()):
+            return frame.prev_start
+
+        starts, i = self.indexed_page_position()
+        if i > 0:
+            return starts[i - 1]
+
+        text = self.page_text
+        buffer_size = PAGE_BUFFER_LENGTH
+        temp_start = max(0, start - buffer_size)
+        # 从段首开始排版，保证折行位置与正向翻页时一致
+        para_start = text.rfind('\n', 0, temp_start) + 1
+        if temp_start - para_start < buffer_size:
+            temp_start = para_start
+
+        # 多带一小段后文，使当前页首行在文档中与实际排版相同
+        content = display_window(text, temp_start, min(len(text), start + 200), self.page_transform())
+        doc = layout_plain_document(content.text, self.text_edit.font(),
+                                    self.text_edit.viewport().width(),
+                                    self.text_edit.document().defaultTextOption())
+
+        # 正向规则：下一页首行 = 视图底部 +2px 处的行，反推上一页首行顶部的下限
+        anchor_top, _ = line_geometry(doc, content.to_display(start - temp_start))
+        min_top = anchor_top - self.text_edit.viewport().height() - 2
+        if min_top <= 0:
+            return temp_start
+
+        pos = doc.documentLayout().hitTest(QPointF(0, min_top), Qt.FuzzyHit)
+        top, height = line_geometry(doc, pos)
+        if top < min_top - 0.5:
+            # 命中的行被截断，取其下一行
+            pos = doc.documentLayout().hitTest(QPointF(0, top + height + 0.5), Qt.FuzzyHit)
+
+        return max(0, min(temp_start + content.to_source(pos), start))
+
+    # --- 自动滚屏 (提词器)：在页帧文档内逐像素滚动，滚过一屏后把锚点移到顶行 ---
+    def set_auto_scroll(self, enabled):
+        self.record_input("a", "set_auto_scroll", enabled)
+        self.auto_scroll_enabled = enabled
+        self.update_auto_scroll()
+
+    def set_auto_scroll_speed(self, speed):
+        self.config["auto_scroll_speed"] = min(max(int(speed), AUTO_SCROLL_MIN_SPEED), AUTO_SCROLL_MAX_SPEED)
+        self.save_config()
+        if self.auto_scroll_timer.isActive():
+            self.auto_scroll_timer.setInterval(self.auto_scroll_interval())
+
+    def update_auto_scroll(self):
+        """按当前状态启停滚屏：鼠标悬停在窗口上、窗口隐藏 (老板键)、设置窗口打开时暂停"""
+        hovered = self.rect().contains(self.mapFromGlobal(QCursor.pos()))
+        running = (self.auto_scroll_enabled and self.isVisible() and not hovered
+                   and not self.is_settings_open and bool(self.page_text))
+        if running and not self.auto_scroll_timer.isActive():
+            self.auto_scroll_clock.start()
+            self.auto_scroll_timer.setInterval(self.auto_scroll_interval())
+            self.auto_scroll_timer.start()
+        elif not running and self.auto_scroll_timer.isActive():
+            self.auto_scroll_timer.stop()
+            self.settle_auto_scroll()
+
+    def auto_scroll_interval(self):
+        """定时间隔取屏幕刷新周期的整数倍，且每次至少滚动 1 像素，慢速时不空转"""
+        handle = self.windowHandle()
+        screen = (handle.screen() if handle else None) or QApplication.primaryScreen()
+        frame_ms = 1000.0 / max(screen.refreshRate(), 1.0)
+        pixel_ms = 1000.0 / self.config.get("auto_scroll_speed", AUTO_SCROLL_SPEED)
+        return max(1, round(frame_ms * math.ceil(pixel_ms / frame_ms)))
+
+    def auto_scroll_tick(self):
+        # 按实际流逝时间推进，定时器抖动不影响速度
+        elapsed = self.auto_scroll_clock.restart() / 1000.0
+        frame = self.current_frame
+        if frame is None or not self.page_text or frame.start != self.page_start:
+            return  # 状态文字或章节加载中
+        if not self.is_local_mode and self.loading_chapter_index is not None:
+            return
 
-            scrollbar = self.text_edit.verticalScrollBar()
-            scrollbar.setValue(scrollbar.maximum())
+        self.auto_scroll_offset += self.config.get("auto_scroll_speed", AUTO_SCROLL_SPEED) * elapsed
+        viewport_height = self.text_edit.viewport().height()
+        max_offset = max(0.0, frame.doc.size().height() - viewport_height)
+        if self.auto_scroll_offset >= max_offset and frame.start + PAGE_BUFFER_LENGTH >= len(self.page_text):
+            # 排版窗口已含文末，且已滚到底
+            self.auto_scroll_offset = max_offset
+            self.text_edit.verticalScrollBar().setValue(int(max_offset))
+            if not self.is_local_mode and self.current_toc and self.current_chapter_index + 1 < len(self.current_toc):
+                self.next_chapter()
+            else:
+                self.set_auto_scroll(False)
+            return
 
-            cursor = self.text_edit.cursorForPosition(QPoint(0, 0))
-            chars_in_prev_page = len(prev_content) - cursor.position()
+        if self.auto_scroll_offset >= min(viewport_height, max_offset):
+            self.settle_auto_scroll()
+        else:
+            self.text_edit.verticalScrollBar().setValue(int(self.auto_scroll_offset))
 
-            real_prev_start = self.local_start_index - chars_in_prev_page
+    def settle_auto_scroll(self):
+        """把锚点移到当前顶行 (查行索引)，保留行内像素偏移，并像翻页一样存档"""
+        offset = self.auto_scroll_offset
+        frame = self.current_frame
+        if offset < 1 or frame is None or frame.start != self.page_start or frame.window is None:
+            return
+        if frame.lines is None:
+            frame.lines = document_line_tops(frame.doc)
+        tops, positions = frame.lines
+        i = bisect.bisect_right(tops, offset) - 1
+        start = frame.start + frame.window.to_source(positions[i]) if i > 0 else frame.start
+        if start <= frame.start:
+            return
 
-            return max(0, real_prev_start)
-        finally:
-            self.text_edit.setUpdatesEnabled(True)
+        self.page_history.append(self.page_start)
+        self.page_start = start
+        self.render_page()
+        # 新页帧从顶行开始排版，折行与原文档一致，保留行内偏移画面不跳
+        self.auto_scroll_offset = offset - tops[i]
+        self.text_edit.verticalScrollBar().setValue(int(self.auto_scroll_offset))
 
-    # --- 翻页逻辑 (即时存档 + 几何分页) ---
-    def scroll_page(self, direction):
         if self.is_local_mode:
-            # --- 本地模式 ---
-            # 【新增保护】
-            if not self.local_full_text:
-                return
-
-            if direction > 0:  # 下一页
-                if self.local_start_index >= len(self.local_full_text):
-                    return
-
-                # 几何计算本页内容量
-                step = self.calc_next_page_start()
-                if step == 0 and self.local_start_index < len(self.local_full_text):
-                    step = 1
+            self.config["last_local_pos"] = self.local_start_index
+            self.save_config()
 
-                self.local_page_history.append(self.local_start_index)
-                self.local_start_index += step
+    # --- 翻页输入合并 ---
+    def queue_page_turn(self, steps):
+        """累计翻页请求，待事件队列中的按键/滚轮全部处理完后一次结算"""
+        self.scheduler.note_activity()
+        self.pending_page_steps += steps
+        if not self.page_turn_timer.isActive():
+            self.page_turn_timer.start()
 
-                if self.local_start_index > len(self.local_full_text):
-                    self.local_start_index = len(self.local_full_text)
+    def flush_page_turns(self):
+        steps = self.pending_page_steps
+        self.pending_page_steps = 0
+        if steps:
+            self.turn_pages(steps)
 
-                self.render_local_page()
+    # --- 翻页逻辑 (即时存档 + 几何分页) ---
+    def turn_pages(self, steps):
+        """一次翻过 steps 页 (负数向前)，只渲染最终页、只存档一次"""
+        # 【关键保护】网络模式还没选书时直接拦截，防止崩溃
+        if not self.is_local_mode and not self.current_book:
+            return
+        # 章节加载中，旧章节的翻页与跨章请求都丢弃
+        if not self.is_local_mode and self.loading_chapter_index is not None:
+            return
+        text = self.page_text
+        if not text:
+            return
+        self.settle_auto_scroll()  # 从滚屏停留的顶行起翻
+
+        if steps > 0:  # 向后翻
+            indexed, i = self.indexed_page_position()
+            if indexed:
+                # 预处理过的书：页首直接查表
+                starts = indexed[i + 1: i + 1 + steps]
+            elif steps == 1:
+                # 单页直接用页帧里预先探测好的下一页起点
+                step = max(self.calc_next_page_start(), 1)
+                starts = [self.page_start + step] if self.page_start + step < len(text) else []
+            else:
+                viewport = self.text_edit.viewport()
+                starts = paginate_forward(text, self.page_start, steps, self.text_edit.font(),
+                                          viewport.width(), viewport.height(),
+                                          self.text_edit.document().defaultTextOption(),
+                                          self.page_transform())
+
+            if starts:
+                self.page_history.append(self.page_start)
+                self.page_history.extend(starts[:-1])
+                self.page_start = starts[-1]
+
+            if len(starts) < steps and not self.is_local_mode:
+                # 翻过了章末：网络模式进入下一章，本地模式停在末页
+                self.next_chapter()
+                return
+            if not starts:
+                return
 
-            else:  # 上一页
-                if self.local_page_history:
+        else:  # 向前翻
+            moved = 0
+            while moved < -steps:
+                if self.page_history:
                     # 优先使用历史
-                    self.local_start_index = self.local_page_history.pop()
-                else:
+                    self.page_start = self.page_history.pop()
+                elif self.page_start > 0:
                     # 无历史时，反向排版计算
-                    self.local_start_index = self.calc_prev_page_start()
+                    self.page_start = self.calc_prev_page_start()
+                else:
+                    break
+                moved += 1
 
-                self.render_local_page()
+            if moved < -steps and not self.is_local_mode:
+                self.prev_chapter()
+                return
+            if not moved:
+                return
 
+        self.render_page()
+
+        if self.is_local_mode:
             # 【关键】即时存档
             self.config["last_local_pos"] = self.local_start_index
             self.save_config()
-
         else:
-            # --- 网络模式 ---
-            # 【关键保护】如果还没选书，直接拦截滚动，防止崩溃
-            if not self.current_book:
-                return
-
-            scrollbar = self.text_edit.verticalScrollBar()
-            current_val = scrollbar.value()
-            max_val = scrollbar.maximum()
-            min_val = scrollbar.minimum()
-
-            target_val = current_val + (direction * (self.text_edit.viewport().height() - 30))
-
-            if direction > 0:
-                if current_val >= max_val - 5:
-                    self.next_chapter()
-                else:
-                    scrollbar.setValue(min(target_val, max_val))
-            else:
-                if current_val <= min_val + 5:
-                    self.prev_chapter()
-                else:
-                    scrollbar.setValue(max(target_val, min_val))
+            self.sync_timer.start()
 
     def load_config(self):
         if os.path.exists(CONFIG_FILE):
@@ -669,24 +4066,120 @@ class StealthReader(QWidget):
         try:
             self.config["window_width"] = self.width()
             self.config["window_height"] = self.height()
+            if self.is_local_mode and self.local_full_text and self.pending_anchor is None:
+                # 进度旁存一份内容指纹，文件被替换或改动后据此找回位置
+                self.config["last_local_anchor"] = position_fingerprint(
+                    self.local_full_text, self.config["last_local_pos"],
+                    (self.local_byte_length, self.local_bytes_crc))
             with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
                 json.dump(self.config, f, indent=4)
         except Exception as e:
             print(f"Failed to save config: {e}")
 
-    def on_update_text_safe(self, text, is_bottom):
+    def show_status(self, text, timeout=STATUS_TIMEOUT):
+        """状态提示：页面上有正文时浮在正文上、到时自动消失，正文不重排；还没有正文时作为占位文字显示。
+        本地书的预览页、重新显示时的快照也算有正文，提示不能覆盖它们"""
+        if (self.page_text and self.current_frame is not None) or (self.is_local_mode and self.local_file_path):
+            self.status_toast.show_message(text, self.text_edit.palette().color(QPalette.Text), timeout)
+        else:
+            self.show_placeholder(text)
+
+    def show_placeholder(self, text):
+        self.status_toast.dismiss()
+        if self.current_frame is not None:
+            # 页帧的文档是缓存，不能被占位文字覆盖：换回编辑器自有的占位文档
+            self.text_edit.setDocument(self.placeholder_document)
+            self.current_frame = None
         self.text_edit.setPlainText(text)
-        if "加载" in text or "连接" in text or "失败" in text:
-            return
+        self.text_edit.verticalScrollBar().setValue(0)
 
-        scrollbar = self.text_edit.verticalScrollBar()
-        if is_bottom:
-            scrollbar.setValue(scrollbar.maximum())
+    def on_chapter_loaded(self, book_url, chapter_index, content, to_last_page, chapter_pos):
+        # 丢弃过期结果 (已切换书籍/章节或回到本地模式)
+        if self.is_local_mode or not self.current_book:
+            return
+        if book_url != self.current_book['bookUrl']:
+            return
+        if chapter_index != self.current_chapter_index:
+            if self.loading_chapter_index == chapter_index:
+                self.loading_chapter_index = None  # 过期的章节也要解除加载标记，否则翻页一直被挡住
+            return
+        self.loading_chapter_index = None
+        self.status_toast.dismiss()  # 收起"加载中"之类的提示
+
+        # 标题在界面线程按当时的目录生成；目录还没到就先占位，到了再换上
+        header = self.chapter_header(chapter_index)
+        self.chapter_text = header + content
+        self.loaded_chapter_index = chapter_index
+        self.chapter_header_len = len(header)
+        self.chapter_page_history = []
+        self.invalidate_page_frames(content_changed=True)
+
+        if to_last_page:
+            self.chapter_start_index = len(self.chapter_text)
+            self.chapter_start_index = self.calc_prev_page_start()
+        elif chapter_pos > 0:
+            # durChapterPos 是正文内的字符偏移
+            self.chapter_start_index = min(self.chapter_header_len + chapter_pos, len(self.chapter_text) - 1)
         else:
-            scrollbar.setValue(0)
+            self.chapter_start_index = 0
+
+        self.render_page()
+        self.note_first_page(book_url)
+        self.sync_progress_async()
+        self.prefetch_chapter(book_url, chapter_index + 1)
+
+    def chapter_header(self, chapter_index):
+        title = ""
+        if self.current_toc and 0 <= chapter_index < len(self.current_toc):
+            title = self.current_toc[chapter_index].get('title', '')
+        return f"【 {title or f'第 {chapter_index + 1} 章'} 】\n\n"
+
+    def patch_chapter_header(self):
+        """目录晚于正文到达：把占位标题换成真标题，页首与翻页历史随标题长度平移，位置不变"""
+        if self.is_local_mode or not self.chapter_text or self.loaded_chapter_index is None:
+            return
+        header = self.chapter_header(self.loaded_chapter_index)
+        old_len = self.chapter_header_len
+        if self.chapter_text[:old_len] == header:
+            return
+        self.settle_auto_scroll()
+        delta = len(header) - old_len
+        self.chapter_text = header + self.chapter_text[old_len:]
+        self.chapter_header_len = len(header)
+        if self.chapter_start_index >= old_len:
+            self.chapter_start_index += delta
+        self.chapter_page_history = [p + delta if p >= old_len else p for p in self.chapter_page_history]
+        self.invalidate_page_frames(content_changed=True)
+        self.render_page()
+
+    def note_first_page(self, book_key):
+        """打开书到首屏显示的耗时 (本地书以路径、网络书以 bookUrl 区分)"""
+        if self.open_clock and self.open_clock[0] == book_key:
+            self.first_page_times.append((time.perf_counter() - self.open_clock[1]) * 1000)
+            self.open_clock = None
+            self.update_tray_tooltip()
+
+    def set_tray_status(self, text):
+        self.tray_status = text
+        self.update_tray_tooltip()
+
+    def update_tray_tooltip(self):
+        """托盘提示：状态行 + 最近一次与历次中位的打开到首屏耗时"""
+        lines = [self.tray_status] if self.tray_status else []
+        if self.first_page_times:
+            times = sorted(self.first_page_times)
+            lines.append(f"打开到首屏: 最近 {self.first_page_times[-1]:.0f} ms，"
+                         f"中位 {times[len(times) // 2]:.0f} ms ({len(times)} 次)")
+        self.tray_icon.setToolTip("\n".join(lines))
 
     def on_bookshelf_updated(self, books):
         self.books = books
+        # 正在读的书有更新 (章节数或更新时间变了)：后台重新核对目录
+        if not self.is_local_mode and self.current_book and isinstance(self.current_toc, CompactToc):
+            for book in books:
+                if book.get('bookUrl') == self.current_book['bookUrl'] and not self.current_toc.is_current(book):
+                    self.fetch_toc_silent(book)
+                    break
         if self.book_selector_dialog and self.book_selector_dialog.isVisible():
             self.book_selector_dialog.update_data(books)
 
@@ -721,7 +4214,7 @@ class StealthReader(QWidget):
         self.content_frame = CornerFrame()
         self.content_layout = QVBoxLayout(self.content_frame)
 
-        self.content_layout.setContentsMargins(5, 0, 5, 0)
+        self.content_layout.setContentsMargins(TEXT_SIDE_MARGIN, 0, TEXT_SIDE_MARGIN, 0)
         self.content_layout.setSpacing(0)
 
         self.text_edit = QTextEdit()
@@ -734,7 +4227,10 @@ class StealthReader(QWidget):
 
         self.text_edit.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Ignored)
         self.text_edit.setMinimumHeight(0)
-        self.text_edit.document().setDocumentMargin(0)
+        # 编辑器自有的占位文档：显示提示文字、或隐藏时释放页帧后换上它
+        self.placeholder_document = QTextDocument(self.text_edit)
+        self.placeholder_document.setDocumentMargin(0)
+        self.text_edit.setDocument(self.placeholder_document)
 
         self.text_edit.installEventFilter(self)
 
@@ -742,6 +4238,14 @@ class StealthReader(QWidget):
         self.main_layout.addWidget(self.content_frame)
         self.setLayout(self.main_layout)
 
+        # 隐藏前的页面快照：重新显示时先贴上，正文排好后撤下
+        self.snapshot_label = QLabel(self.content_frame)
+        self.snapshot_label.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.snapshot_label.hide()
+
+        # 状态提示浮在正文上，不替换正文文档
+        self.status_toast = StatusToast(self.content_frame)
+
         w = self.config.get("window_width", 400)
         h = self.config.get("window_height", 300)
         self.resize(w, h)
@@ -756,23 +4260,20 @@ class StealthReader(QWidget):
             if not self.is_local_mode and not self.current_book:
                 return True
 
+            # 累计滚轮增量，每满一格 (120) 翻一页；反向或停顿后重新累计
             delta = event.angleDelta().y()
-            if self.is_local_mode:
-                if delta < 0:
-                    self.scroll_page(1)
-                elif delta > 0:
-                    self.scroll_page(-1)
-                return True
-            else:
-                scrollbar = self.text_edit.verticalScrollBar()
-                if delta < 0:
-                    if scrollbar.value() >= scrollbar.maximum() - 2:
-                        self.next_chapter()
-                        return True
-                elif delta > 0:
-                    if scrollbar.value() <= scrollbar.minimum() + 2:
-                        self.prev_chapter()
-                        return True
+            self.record_input("w", delta)
+            now = time.time()
+            if (self.wheel_delta_accum * delta < 0) or now - self.last_wheel_time > 0.5:
+                self.wheel_delta_accum = 0
+            self.last_wheel_time = now
+            self.wheel_delta_accum += delta
+
+            notches = int(self.wheel_delta_accum / 120)
+            if notches:
+                self.wheel_delta_accum -= notches * 120
+                self.queue_page_turn(-notches)
+            return True
         return super().eventFilter(source, event)
 
     def initTray(self):
@@ -795,14 +4296,20 @@ class StealthReader(QWidget):
         if current_time - self.last_toggle_time < 0.3:
             return
         self.last_toggle_time = current_time
+        self.record_input("a", "toggle_window")
 
         if self.isVisible():
+            self.settle_auto_scroll()
             self.sync_progress_async()
             self.hide()
+            self.update_auto_scroll()
+            self.suspend_hidden()
         else:
+            self.resume_shown()
             self.showNormal()
             self.apply_style()
             self.activateWindow()
+            self.update_auto_scroll()
             if self.config.get("auto_mode", False):
                 self.chameleon_timer.start()
                 self.adjust_color_to_background()
@@ -810,6 +4317,115 @@ class StealthReader(QWidget):
             if self.config.get("antishot_mode", False):
                 set_window_protection(int(self.winId()), True)
 
+    # --- 老板键隐藏：低占用挂起与一帧内恢复 ---
+    def suspend_hidden(self):
+        """隐藏后停掉全部定时器与后台工作，释放可重建的缓存与排版，只留下锚点和当前页快照"""
+        if self.page_turn_timer.isActive():
+            self.flush_page_turns()
+        self.suspended = True
+        self.scheduler.pause()
+        self.endpoint.pause()
+        for timer in (self.chameleon_timer, self.prerender_timer, self.page_turn_timer,
+                      self.file_change_timer, self.auto_scroll_timer):
+            timer.stop()
+
+        frame = self.current_frame
+        if frame is not None and frame.start == self.page_start:
+            # 快照在隐藏时才光栅化 (当场排版的页帧不带位图)
+            pixmap = self.rasterize_page_frame(frame)
+            if not pixmap.isNull():
+                self.hidden_snapshot = pixmap
+        if self.is_local_mode and self.local_full_text:
+            self.config["last_local_pos"] = self.local_start_index
+            self.save_config()  # 进度与内容指纹先落盘，正文释放后重新读入时据此核对
+
+        # 页帧与排版文档、最近读过的书、章节与净化缓存、目录/书架列表项都能随时重建
+        self.status_toast.dismiss()
+        if self.current_frame is not None:
+            self.show_placeholder("")
+        self.page_frames = {}
+        self.book_states.clear()
+        self.chapter_cache.clear()
+        for engine in self.replace_engines.values():
+            if engine:
+                engine.clear_cache()
+        for dialog in (self.toc_dialog, self.book_selector_dialog):
+            if dialog and not dialog.isVisible():
+                dialog.release()
+        # 普通 TXT 全文可从磁盘快速重读；压缩书籍重读要整本解压，全文与读取器都留着
+        if self.is_local_mode and self.local_full_text:
+            self.hidden_file_stat = local_file_stat(self.local_file_path)
+            if self.local_archive is None and book_path_exists(self.local_file_path):
+                self.local_full_text = ""
+        trim_working_set()
+
+    def resume_shown(self):
+        """重新显示：先贴上隐藏前的页面快照，正文在下一轮事件循环里读回并排版"""
+        if not self.suspended:
+            return
+        self.suspended = False
+        self.scheduler.resume()
+        self.endpoint.resume()
+        if self.hidden_snapshot is not None:
+            self.snapshot_label.setGeometry(self.text_edit.geometry())
+            self.snapshot_label.setPixmap(self.hidden_snapshot)
+            self.snapshot_label.show()
+            self.snapshot_label.raise_()
+            self.status_toast.raise_()
+        QTimer.singleShot(0, self.finish_resume)
+
+    def finish_resume(self):
+        if self.suspended:
+            return  # 还没来得及恢复又被隐藏
+        if self.local_read_request is not None:
+            pass  # 整本还在后台读取 (如压缩书预览中)，读完自会换上
+        elif self.is_local_mode and self.local_file_path and not self.local_full_text:
+            if local_file_stat(self.local_file_path) == self.hidden_file_stat:
+                # 文件没动过：快照先顶着，全文在工作线程读回并解码，好了再换上
+                self.scheduler.submit(LANE_INTERACTIVE, self._reload_text_task, self.local_file_path,
+                                      self.local_encoding, self.local_byte_length, self.local_bytes_crc,
+                                      key="local_read")
+                return
+            # 隐藏期间被改动：按改动重新打开 (内容指纹找回位置)
+            self.load_local_file(self.local_file_path, target_pos=self.local_start_index)
+        elif self.page_text:
+            self.render_page()
+            # 隐藏期间的文件变化没有处理，改动过才按追加/改动的规则补上
+            if self.is_local_mode and local_file_stat(self.local_file_path) != self.hidden_file_stat:
+                self.file_change_timer.start()
+        self.hide_snapshot()
+
+    def hide_snapshot(self):
+        self.snapshot_label.hide()
+        self.snapshot_label.clear()
+        self.hidden_snapshot = None
+        self.update_auto_scroll()  # 本地书的正文刚读回，滚屏此时才能继续
+
+    def _reload_text_task(self, file_path, encoding, length, crc):
+        """读回隐藏时释放的全文 (工作线程中调用)；字节与隐藏前不同时交回 None"""
+        try:
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+            if (len(raw), zlib.crc32(raw)) != (length, crc):
+                result = None
+            else:
+                result = translate_newlines(raw.decode(encoding))
+        except (OSError, UnicodeDecodeError) as e:
+            result = e
+        self.local_text_reloaded_signal.emit(file_path, result)
+
+    def on_local_text_reloaded(self, file_path, result):
+        if self.suspended or not self.is_local_mode or file_path != self.local_file_path or self.local_full_text:
+            return  # 又被隐藏、已换书或已重新打开
+        if isinstance(result, str):
+            self.local_full_text = result
+            self.render_page()
+        elif result is None:
+            self.load_local_file(file_path, target_pos=self.local_start_index)
+        else:
+            self.show_status(f"打开文件失败: {result}")
+        self.hide_snapshot()
+
     def adjust_color_to_background(self):
         if not self.isVisible() or not self.config.get("auto_mode"):
             self.chameleon_timer.stop()
@@ -884,18 +4500,22 @@ class StealthReader(QWidget):
             """
             self.text_edit.setStyleSheet(text_style)
 
-            # 本地模式下修改样式需要重绘页面
-            if self.is_local_mode:
-                self.render_local_page()
+            # 修改样式后从锚点重绘页面 (页帧签名包含字体与颜色，样式变化的旧帧自动失效)
+            if self.page_text:
+                self.render_page()
 
     def enterEvent(self, event):
+        self.record_input("e")
         self.is_mouse_in = True
+        self.update_auto_scroll()
         if self.config.get("ghost_mode", False):
             self.apply_style()
         super().enterEvent(event)
 
     def leaveEvent(self, event):
+        self.record_input("l")
         self.is_mouse_in = False
+        self.update_auto_scroll()
         if self.is_settings_open or self.is_resizing or self.is_moving: return
 
         global_pos = QCursor.pos()
@@ -922,35 +4542,39 @@ class StealthReader(QWidget):
         super().leaveEvent(event)
 
     def fetch_bookshelf_silent(self):
-        threading.Thread(target=self._fetch_bookshelf_thread, daemon=True).start()
+        # 断线期间沿用已有书架，恢复连接后会自动刷新
+        if not self.endpoint.is_available():
+            return
+        self.scheduler.submit(LANE_INTERACTIVE, self._fetch_bookshelf_thread, key="bookshelf")
 
     def _fetch_bookshelf_thread(self):
         try:
-            url = f"{self.config['ip']}/getBookshelf"
-            res = requests.get(url, timeout=3)
+            res = self.endpoint.get("/getBookshelf", "bookshelf")
             if res.status_code == 200:
                 data = res.json()
                 self.bookshelf_updated_signal.emit(data.get("data", []))
         except:
             pass
 
-    def fetch_toc_silent(self, book_url):
-        threading.Thread(target=self._fetch_toc_thread, args=(book_url,), daemon=True).start()
+    def fetch_toc_silent(self, book, lane=LANE_PREFETCH):
+        self.scheduler.submit(lane, self._fetch_toc_thread, book, key=("toc", book['bookUrl']))
 
-    def _fetch_toc_thread(self, book_url):
+    def _fetch_toc_thread(self, book):
         try:
-            url = f"{self.config['ip']}/getChapterList"
-            res = requests.get(url, params={"url": book_url}, timeout=10)
-            if res.status_code == 200:
-                data = res.json()
-                if data['isSuccess']:
-                    self.current_toc = data['data']
+            self.toc_loaded_signal.emit(book['bookUrl'], fetch_compact_toc(self.endpoint, book))
         except:
             pass
 
+    def on_toc_loaded(self, book_url, toc):
+        if not self.is_local_mode and self.current_book and self.current_book['bookUrl'] == book_url:
+            self.current_toc = toc
+            self.patch_chapter_header()
+
     def open_book_selector(self):
         self.fetch_bookshelf_silent()
-        self.book_selector_dialog = BookSelector(self, self)
+        if self.book_selector_dialog is None:
+            self.book_selector_dialog = BookSelector(self, self)
+        self.book_selector_dialog.prepare()
 
         was_auto = self.config.get("auto_mode")
         if was_auto:
@@ -960,14 +4584,23 @@ class StealthReader(QWidget):
 
         if self.book_selector_dialog.exec_() == QDialog.Accepted:
             if self.book_selector_dialog.selected_book:
+                self.record_input("a", "load_book", self.book_selector_dialog.selected_book)
                 self.load_book(self.book_selector_dialog.selected_book)
 
         self.apply_style()
-        self.book_selector_dialog = None
+
+    def reusable_toc_dialog(self):
+        if self.toc_dialog is None:
+            self.toc_dialog = TocSelector(self)
+        return self.toc_dialog
 
     def open_toc_selector(self):
+        if self.is_local_mode:
+            self.open_local_toc()
+            return
+
         if not self.current_book:
-            self.update_text_signal.emit("请先选择一本书！", False)
+            self.show_status("请先选择一本书！")
             return
 
         if not hasattr(self, 'current_toc') or self.current_toc is None:
@@ -979,83 +4612,271 @@ class StealthReader(QWidget):
             self.content_frame.setStyleSheet(f"background-color: {self.config['bg_color']};")
             self.content_frame.set_mode(False)
 
-        toc = TocSelector(self.config['ip'], self.current_book['bookUrl'],
-                          self.current_chapter_index, self.current_toc, self)
+        toc = self.reusable_toc_dialog()
+        toc.prepare(self.endpoint, self.current_book, self.current_chapter_index, self.current_toc)
+
+        if toc.exec_() == QDialog.Accepted:
+            if toc.selected_index is not None:
+                self.jump_to_chapter(toc.selected_index)
+
+        self.apply_style()
+
+    def open_search_dialog(self):
+        if not (self.local_full_text if self.is_local_mode else self.current_book):
+            return
+
+        was_auto = self.config.get("auto_mode")
+        if was_auto:
+            self.setWindowOpacity(0.95)
+            self.content_frame.setStyleSheet(f"background-color: {self.config['bg_color']};")
+            self.content_frame.set_mode(False)
+
+        dialog = SearchDialog(self, self.last_search_keyword, self)
+        accepted = dialog.exec_() == QDialog.Accepted
+        self.last_search_keyword = dialog.search_input.text().strip()
+        if accepted and dialog.selected:
+            if self.is_local_mode:
+                self.jump_to_local_offset(dialog.selected[1])
+            else:
+                self.jump_to_chapter(*dialog.selected)
+
+        self.apply_style()
+
+    def jump_to_chapter(self, chapter_index, chapter_pos=0):
+        self.record_input("a", "jump_to_chapter", chapter_index, chapter_pos)
+        self.current_chapter_index = chapter_index
+        self.show_status(f"跳转到章节: {self.current_chapter_index}", timeout=0)
+        self.fetch_chapter_content(self.current_book['bookUrl'], self.current_chapter_index, False,
+                                   chapter_pos=chapter_pos)
+
+    def open_local_toc(self):
+        if not self.local_chapters:
+            self.show_status("未识别到章节标题")
+            return
+
+        was_auto = self.config.get("auto_mode")
+        if was_auto:
+            self.setWindowOpacity(0.95)
+            self.content_frame.setStyleSheet(f"background-color: {self.config['bg_color']};")
+            self.content_frame.set_mode(False)
+
+        offsets = [offset for offset, _ in self.local_chapters]
+        current = max(0, bisect.bisect_right(offsets, self.local_start_index) - 1)
+        # 章节表没变时沿用上次的目录对象，对话框不必重建列表
+        if self.local_toc_source is not self.local_chapters:
+            self.local_toc = [{'title': title, 'index': i} for i, (_, title) in enumerate(self.local_chapters)]
+            self.local_toc_source = self.local_chapters
+        toc = self.reusable_toc_dialog()
+        toc.prepare(None, None, current, self.local_toc)
 
         if toc.exec_() == QDialog.Accepted:
             if toc.selected_index is not None:
-                self.current_chapter_index = toc.selected_index
-                self.update_text_signal.emit(f"跳转到章节: {self.current_chapter_index}", False)
-                self.fetch_chapter_content(self.current_book['bookUrl'], self.current_chapter_index, False)
+                self.jump_to_local_offset(offsets[toc.selected_index])
 
         self.apply_style()
 
     def load_book(self, book):
+        self.open_clock = (book['bookUrl'], time.perf_counter())
+        self.local_read_request = None  # 还在后台读取的本地书不再接管
+        cached_toc = None
+        if self.is_local_mode or not self.current_book or self.current_book['bookUrl'] != book['bookUrl']:
+            self.stash_current_book()
+            self.watch_local_file(None)
+            state = self.book_states.take(("legado", book['bookUrl']))
+            if state is not None:
+                if self.restore_legado_book(book, state):
+                    self.note_first_page(book['bookUrl'])
+                    return
+                if isinstance(state["current_toc"], CompactToc):
+                    cached_toc = state["current_toc"]
         self.is_local_mode = False  # 切换回网络模式
+        self.watch_local_file(None)
         self.current_book = book
+        self.replace_engine = self.engine_for(book['name'])
         self.current_chapter_index = book.get('durChapterIndex', 0)
-        self.current_toc = []
-        self.update_text_signal.emit(f"打开: {book['name']}", False)
-        self.fetch_chapter_content(book['bookUrl'], self.current_chapter_index, False)
-        self.fetch_toc_silent(book['bookUrl'])
+        # 目录先用热缓存/磁盘缓存，书架显示有更新时才在后台重新下载
+        cached_toc = cached_toc or load_cached_toc(book['bookUrl'])
+        self.current_toc = cached_toc or []
+        self.chapter_text = ""
+        self.loaded_chapter_index = None
+        self.invalidate_page_frames(content_changed=True)
+        self.show_status(f"打开: {book['name']}")
+        # 正文与目录同时请求：正文一到就显示 (标题先占位)，目录到后再补上标题
+        self.fetch_chapter_content(book['bookUrl'], self.current_chapter_index, False,
+                                   chapter_pos=book.get('durChapterPos', 0) or 0)
+        if cached_toc is None:
+            self.fetch_toc_silent(book, LANE_INTERACTIVE)
+        elif not cached_toc.is_current(book):
+            self.fetch_toc_silent(book)
+
+    def fetch_chapter_content(self, book_url, chapter_index, scroll_to_bottom=False, chapter_pos=0):
+        self.loading_chapter_index = chapter_index
+        # 同一时间只需要最后请求的那一章
+        self.scheduler.submit(LANE_INTERACTIVE, self._fetch_chapter_thread,
+                              book_url, chapter_index, scroll_to_bottom, chapter_pos, key="chapter")
+
+    def prefetch_chapter(self, book_url, chapter_index):
+        """空闲时把下一章拉进内存缓存，翻到章末时不用等网络"""
+        if self.current_toc and chapter_index >= len(self.current_toc):
+            return
+        self.scheduler.submit(LANE_PREFETCH, self._prefetch_chapter_task, book_url, chapter_index, key="prefetch")
 
-    def fetch_chapter_content(self, book_url, chapter_index, scroll_to_bottom=False):
-        t = threading.Thread(target=self._fetch_chapter_thread,
-                             args=(book_url, chapter_index, scroll_to_bottom), daemon=True)
-        t.start()
+    def warm_book(self, book):
+        """书架上选中 (还没双击) 的书：空闲时先把它当前读到的章节拉进缓存，打开时正文直接命中"""
+        if not book or not self.endpoint.is_available():
+            return
+        book_url, chapter_index = book['bookUrl'], book.get('durChapterIndex', 0)
+        if not self.is_local_mode and self.current_book and self.current_book['bookUrl'] == book_url:
+            return
+        future = self.scheduler.submit(LANE_PREFETCH, self._prefetch_chapter_task, book_url, chapter_index,
+                                       key="warm")
+        self.warming = (book_url, chapter_index, future)
+
+    def await_warming(self, book_url, chapter_index):
+        """要打开的正是预热中的那一章：还在排队就撤掉，由打开流程自己拉取；
+        请求已经发出就等它回来，不重复请求 (在工作线程中调用)"""
+        warming = self.warming
+        if warming is None or warming[:2] != (book_url, chapter_index):
+            return None
+        if not warming[2].cancel():
+            try:
+                warming[2].result(timeout=READ_TIMEOUTS["content"][2])
+            except Exception:
+                pass
+        return self.chapter_cache.get(book_url, chapter_index)
 
-    def _fetch_chapter_thread(self, book_url, chapter_index, scroll_to_bottom):
+    def _prefetch_chapter_task(self, book_url, chapter_index):
+        if self.chapter_cache.get(book_url, chapter_index) is not None:
+            return
+        if ChapterStore(book_url).has(chapter_index) or not self.endpoint.is_available():
+            return
         try:
-            chapter_title = ""
-            if hasattr(self, 'current_toc') and self.current_toc:
-                if 0 <= chapter_index < len(self.current_toc):
-                    chapter_title = self.current_toc[chapter_index].get('title', '')
-
-            if not chapter_title:
-                chapter_title = f"第 {chapter_index + 1} 章"
+            res = self.endpoint.get("/getBookContent", "content", params={'url': book_url, 'index': chapter_index})
+            if res.status_code != 200:
+                return
+            data = res.json()
+            if data.get("isSuccess"):
+                self.chapter_cache.put(book_url, chapter_index, normalize_chapter_text(data.get("data", "")))
+        except Exception:
+            pass
 
-            url = f"{self.config['ip']}/getBookContent"
-            params = {'url': book_url, 'index': chapter_index}
-            res = requests.get(url, params=params, timeout=5)
+    def _fetch_chapter_thread(self, book_url, chapter_index, scroll_to_bottom, chapter_pos=0):
+        try:
+            content = self.chapter_cache.get(book_url, chapter_index)
+            if content is None:
+                # 离线下载过的章节直接读盘
+                content = ChapterStore(book_url).load(chapter_index)
+                if content is not None:
+                    self.chapter_cache.put(book_url, chapter_index, content)
+            if content is None:
+                content = self.await_warming(book_url, chapter_index)
+            if content is None:
+                params = {'url': book_url, 'index': chapter_index}
+                res = self.endpoint.get("/getBookContent", "content", params=params)
+
+                if res.status_code != 200:
+                    self._chapter_load_failed(chapter_index, f"HTTP错误: {res.status_code}")
+                    return
 
-            if res.status_code == 200:
                 data = res.json()
                 if not data.get("isSuccess"):
-                    self.update_text_signal.emit(f"读取失败: {data.get('errorMsg')}", False)
+                    self._chapter_load_failed(chapter_index, f"读取失败: {data.get('errorMsg')}")
                     return
 
-                raw_content = data.get("data", "")
-                content = raw_content.replace("<br>", "\n").replace("&nbsp;", " ")
+                # 在工作线程中一次性规整，结果进缓存
+                content = normalize_chapter_text(data.get("data", ""))
+                self.chapter_cache.put(book_url, chapter_index, content)
 
-                full_text = f"【 {chapter_title} 】\n\n{content}"
+            # 网络章节整章净化一次 (结果由引擎缓存)，章内位置即为净化后的位置，与手机端一致
+            engine = self.replace_engine
+            if engine:
+                content = engine.apply(content).text
 
-                self.update_text_signal.emit(full_text, scroll_to_bottom)
-                self.sync_progress_async()
-            else:
-                self.update_text_signal.emit(f"HTTP错误: {res.status_code}", False)
+            self.chapter_loaded_signal.emit(book_url, chapter_index, content, scroll_to_bottom, chapter_pos)
         except Exception as e:
-            self.update_text_signal.emit(f"网络错误: {str(e)}", False)
+            self._chapter_load_failed(chapter_index, f"网络错误: {str(e)}")
+
+    def _chapter_load_failed(self, chapter_index, message):
+        if self.loading_chapter_index == chapter_index:
+            self.loading_chapter_index = None
+        self.status_signal.emit(message, STATUS_TIMEOUT)
+
+    # --- 离线下载 ---
+    def download_book(self, count=None):
+        """下载全书 (count=None) 或从当前章起的 count 章到本地仓库"""
+        if not self.current_book:
+            self.show_status("请先选择一本书！")
+            return
+        if self.book_downloader and self.book_downloader.is_running():
+            return
+
+        book = self.current_book
+        first_index = self.current_chapter_index if count else 0
+
+        def on_finished(done, total, failed, cancelled):
+            state = "已停止" if cancelled else "完成"
+            summary = f"离线下载{state}: {book['name']} {done}/{total} 章"
+            if failed:
+                summary += f"，失败 {failed} 章 (再次下载可续传)"
+            self.download_finished_signal.emit(summary)
+
+        self.book_downloader = BookDownloader(self.endpoint, self.scheduler, book['bookUrl'], self.current_toc,
+                                              first_index, count,
+                                              on_progress=self.download_progress_signal.emit,
+                                              on_finished=on_finished)
+        self.content_frame.set_progress(0.0)
+        self.book_downloader.start()
+
+    def download_next_chapters(self):
+        count, ok = QInputDialog.getInt(self, "下载后续章节", "章节数:", 50, 1, 100000)
+        if ok:
+            self.download_book(count)
+
+    def cancel_download(self):
+        if self.book_downloader:
+            self.book_downloader.cancel()
+
+    def on_download_progress(self, done, total):
+        self.content_frame.set_progress(done / total if total else 0.0)
+        self.set_tray_status(f"离线下载 {done}/{total}")
+
+    def on_download_finished(self, summary):
+        self.content_frame.set_progress(None)
+        self.set_tray_status(summary)
+        self.show_status(summary)
+
+    def on_endpoint_state_changed(self, available):
+        if available:
+            self.set_tray_status("阅读APP 已连接")
+            # 恢复连接：刷新书架，并补上断线期间没同步成功的进度
+            self.fetch_bookshelf_silent()
+            self.sync_progress_async()
+        else:
+            self.set_tray_status("阅读APP 未连接，使用缓存内容")
 
     def sync_progress_async(self):
+        self.sync_timer.stop()
         if not self.current_book or self.is_local_mode: return
-        threading.Thread(target=self._sync_task, daemon=True).start()
-
-    def _sync_task(self):
+        # 只需同步最新进度：排队中的旧同步直接被取代
+        self.scheduler.submit(LANE_SYNC, self._sync_task, self.progress_payload(), key="sync")
+
+    def progress_payload(self):
+        """当前网络书的阅读进度 (在主线程取值，后台发送时书可能已经换了)"""
+        title = ""
+        if self.current_toc and 0 <= self.current_chapter_index < len(self.current_toc):
+            title = self.current_toc[self.current_chapter_index].get("title", "")
+        return {
+            "name": self.current_book['name'],
+            "author": self.current_book['author'],
+            "durChapterIndex": self.current_chapter_index,
+            "durChapterPos": max(0, self.chapter_start_index - self.chapter_header_len),
+            "durChapterTime": int(time.time() * 1000),
+            "durChapterTitle": title
+        }
+
+    def _sync_task(self, data):
         try:
-            title = ""
-            if self.current_toc and 0 <= self.current_chapter_index < len(self.current_toc):
-                title = self.current_toc[self.current_chapter_index].get("title", "")
-
-            data = {
-                "name": self.current_book['name'],
-                "author": self.current_book['author'],
-                "durChapterIndex": self.current_chapter_index,
-                "durChapterPos": 0,
-                "durChapterTime": int(time.time() * 1000),
-                "durChapterTitle": title
-            }
-            url = f"{self.config['ip']}/saveBookProgress"
-            requests.post(url, json=data, timeout=3)
+            self.endpoint.post("/saveBookProgress", "sync", json=data)
         except:
             pass
 
@@ -1064,7 +4885,7 @@ class StealthReader(QWidget):
         if not self.current_book:
             return
         self.current_chapter_index += 1
-        self.update_text_signal.emit("加载下一章...", False)
+        self.show_status("加载下一章...", timeout=0)
         self.fetch_chapter_content(self.current_book['bookUrl'], self.current_chapter_index, False)
 
     def prev_chapter(self):
@@ -1073,7 +4894,7 @@ class StealthReader(QWidget):
             return
         if self.current_chapter_index > 0:
             self.current_chapter_index -= 1
-            self.update_text_signal.emit("加载上一章...", False)
+            self.show_status("加载上一章...", timeout=0)
             self.fetch_chapter_content(self.current_book['bookUrl'], self.current_chapter_index, True)
 
     def is_in_resize_area(self, pos):
@@ -1105,10 +4926,7 @@ class StealthReader(QWidget):
                 min_h = getattr(self, 'single_line_height', 20)
                 new_h = max(event.pos().y(), min_h)
                 self.resize(new_w, new_h)
-
-                # 【核心逻辑】调整大小时基于锚点重绘
-                if self.is_local_mode:
-                    self.render_local_page()
+                self.reflow_page()
 
             elif self.is_moving:
                 delta = QPoint(event.globalPos() - self.oldPos)
@@ -1118,6 +4936,17 @@ class StealthReader(QWidget):
             if self.config.get("auto_mode"):
                 self.adjust_color_to_background()
 
+    def reflow_page(self):
+        # 【核心逻辑】调整大小时基于锚点重绘
+        self.settle_auto_scroll()
+        self.invalidate_page_frames()
+        if self.page_text:
+            self.render_page()
+
+    def resizeEvent(self, event):
+        self.record_input("r", event.size().width(), event.size().height())
+        super().resizeEvent(event)
+
     def mouseReleaseEvent(self, event):
         self.is_resizing = False
         self.is_moving = False
@@ -1129,8 +4958,26 @@ class StealthReader(QWidget):
         cmenu.addAction("📂 打开本地 TXT").triggered.connect(self.open_local_file_dialog)
         cmenu.addSeparator()
         cmenu.addAction("📚 网络书架 (搜索)").triggered.connect(self.open_book_selector)
-        cmenu.addAction("📖 章节目录 (网络)").triggered.connect(self.open_toc_selector)
+        cmenu.addAction("📖 章节目录").triggered.connect(self.open_toc_selector)
+        if self.local_full_text if self.is_local_mode else self.current_book:
+            cmenu.addAction("🔍 书内搜索").triggered.connect(self.open_search_dialog)
+        if not self.is_local_mode and self.current_book:
+            if self.book_downloader and self.book_downloader.is_running():
+                cmenu.addAction("⏹ 停止离线下载").triggered.connect(self.cancel_download)
+            else:
+                cmenu.addAction("⬇️ 下载全书 (离线)").triggered.connect(lambda: self.download_book())
+                cmenu.addAction("⬇️ 下载后续 N 章...").triggered.connect(self.download_next_chapters)
+        scroll_action = cmenu.addAction("📜 自动滚屏 (鼠标移入暂停，+/- 调速)")
+        scroll_action.setCheckable(True)
+        scroll_action.setChecked(self.auto_scroll_enabled)
+        scroll_action.toggled.connect(self.set_auto_scroll)
         cmenu.addSeparator()
+        rules_menu = cmenu.addMenu("🧹 净化规则")
+        enabled_action = rules_menu.addAction(f"启用 (共 {len(self.replace_rules)} 条)")
+        enabled_action.setCheckable(True)
+        enabled_action.setChecked(self.config.get("replace_enabled", True))
+        enabled_action.toggled.connect(self.toggle_replace_rules)
+        rules_menu.addAction("导入规则文件...").triggered.connect(self.import_replace_rules)
         cmenu.addAction("⚙️ 设置").triggered.connect(self.open_settings)
         cmenu.addSeparator()
         cmenu.addAction("❌ 退出").triggered.connect(self.quit_app)
@@ -1138,16 +4985,24 @@ class StealthReader(QWidget):
 
     def open_settings(self):
         self.is_settings_open = True
+        self.update_auto_scroll()
         was_auto = self.config.get("auto_mode")
         if was_auto:
             self.content_frame.set_mode(False)
             self.setWindowOpacity(0.95)
             self.content_frame.setStyleSheet(f"background-color: {self.config['bg_color']};")
 
-        dialog = SettingsDialog(self.config, self)
+        if self.settings_dialog is None:
+            self.settings_dialog = SettingsDialog(self.config, self)
+        else:
+            self.settings_dialog.reset(self.config)
+        dialog = self.settings_dialog
 
         if dialog.exec_() == QDialog.Accepted:
+            if dialog.config["ip"].rstrip('/') != self.endpoint.ip:
+                self.endpoint.set_ip(dialog.config["ip"])
             self.config = dialog.config
+            self.record_input("c", {k: self.config.get(k) for k in TRACE_CONFIG_KEYS})
             self.save_config()
             self.apply_style()
             self.refresh_hotkeys()
@@ -1159,15 +5014,23 @@ class StealthReader(QWidget):
         self.is_settings_open = False
         self.showNormal()
         self.activateWindow()
+        self.update_auto_scroll()
 
     def keyPressEvent(self, event):
         key = event.key()
+        self.record_input("k", key, int(event.isAutoRepeat()))
         if key in [Qt.Key_Right, Qt.Key_Down, Qt.Key_Space, Qt.Key_PageDown]:
-            self.scroll_page(1)
+            self.queue_page_turn(1)
         elif key in [Qt.Key_Left, Qt.Key_Up, Qt.Key_PageUp]:
-            self.scroll_page(-1)
+            self.queue_page_turn(-1)
+        elif key in [Qt.Key_Plus, Qt.Key_Equal, Qt.Key_Minus] and self.auto_scroll_enabled:
+            # 每次调 20%，至少 1 像素/秒
+            speed = self.config.get("auto_scroll_speed", AUTO_SCROLL_SPEED)
+            step = max(1, round(speed * 0.2))
+            self.set_auto_scroll_speed(speed - step if key == Qt.Key_Minus else speed + step)
 
     def closeEvent(self, event):
+        self.stop_recording()
         self.sync_progress_async()
         if self.is_local_mode:
             self.config["last_local_pos"] = self.local_start_index
@@ -1179,14 +5042,164 @@ class StealthReader(QWidget):
         if self.is_local_mode:
             self.config["last_local_pos"] = self.local_start_index
             self.save_config()
-
+        elif self.current_book:
+            # 网络书：排队中的同步不等了，当场同步最新进度，连不上也最多等 QUIT_SYNC_TIMEOUT
+            self.sync_timer.stop()
+            self.scheduler.cancel("sync")
+            sync = threading.Thread(target=self._sync_task, args=(self.progress_payload(),), daemon=True)
+            sync.start()
+            sync.join(QUIT_SYNC_TIMEOUT)
+
+        self.stop_recording()
         keyboard.unhook_all()
         QApplication.instance().quit()
 
 
+# ================= 会话回放 (性能回归) =================
+# 可回放的菜单动作：均为阅读器上参数可 JSON 化的方法
+REPLAY_ACTIONS = ("load_local_file", "load_book", "jump_to_local_offset", "jump_to_chapter", "toggle_window",
+                  "set_auto_scroll")
+
+
+class SessionReplayer:
+    """在无界面平台上驱动 StealthReader 重放轨迹，记录每个事件从分发到重绘完成的耗时"""
+
+    def __init__(self, app, reader):
+        self.app = app
+        self.reader = reader
+        self.latencies = {}  # 事件类型 -> [毫秒]
+
+    def dispatch(self, kind, args):
+        reader = self.reader
+        if kind == "k":
+            key, autorepeat = args
+            self.app.sendEvent(reader, QKeyEvent(QEvent.KeyPress, key, Qt.NoModifier, "", bool(autorepeat)))
+        elif kind == "w":
+            pos = QPointF(reader.text_edit.width() / 2, reader.text_edit.height() / 2)
+            event = QWheelEvent(pos, reader.text_edit.mapToGlobal(pos.toPoint()), QPoint(),
+                                QPoint(0, args[0]), Qt.NoButton, Qt.NoModifier, Qt.NoScrollPhase, False)
+            self.app.sendEvent(reader.text_edit, event)
+        elif kind == "r":
+            reader.resize(*args)
+            reader.reflow_page()
+        elif kind == "e":
+            self.app.sendEvent(reader, QEvent(QEvent.Enter))
+        elif kind == "l":
+            self.app.sendEvent(reader, QEvent(QEvent.Leave))
+        elif kind == "c":
+            reader.config.update(args[0])
+            reader.apply_style()
+        elif kind == "a" and args and args[0] in REPLAY_ACTIONS:
+            if args[0] == "toggle_window":
+                reader.last_toggle_time = 0  # 回放不受老板键防抖限制
+            getattr(reader, args[0])(*args[1:])
+        else:
+            return False
+        # 相当于事件循环走到空闲：结算合并后的翻页，并同步重绘
+        reader.flush_page_turns()
+        if reader.isVisible():
+            reader.repaint()
+        return True
+
+    def pump(self, seconds):
+        end = time.perf_counter() + seconds
+        while True:
+            self.app.processEvents()
+            if time.perf_counter() >= end:
+                break
+            time.sleep(0.001)
+
+    def run(self, events, realtime=False):
+        start = time.perf_counter()
+        for event in events:
+            stamp, kind, args = event[0], event[1], event[2:]
+            if realtime:
+                self.pump(max(0.0, start + stamp / 1000 - time.perf_counter()))
+            t0 = time.perf_counter()
+            if self.dispatch(kind, args):
+                self.latencies.setdefault(kind, []).append((time.perf_counter() - t0) * 1000)
+            # 空闲任务 (预排版、网络回调) 在计时之外执行
+            self.app.processEvents()
+
+    def report(self):
+        names = {"k": "按键", "w": "滚轮", "r": "尺寸", "e": "移入", "l": "移出", "a": "动作", "c": "设置",
+                 "f": "首屏"}
+        if self.reader.first_page_times:
+            self.latencies["f"] = self.reader.first_page_times  # 打开书到首屏 (含网络等待)
+        lines = [f"{'事件':<6}{'次数':>6}{'平均ms':>9}{'p50':>8}{'p95':>8}{'最大':>8}"]
+        for kind, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            p50 = values[len(values) // 2]
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            lines.append(f"{names.get(kind, kind):<6}{len(values):>6}{sum(values) / len(values):>9.2f}"
+                         f"{p50:>8.2f}{p95:>8.2f}{values[-1]:>8.2f}")
+        return "\n".join(lines)
+
+
+def replay_session(trace_path, realtime=False):
+    """读取轨迹，在临时目录中以录制时的配置启动阅读器并回放，打印逐事件延迟统计"""
+    with open(trace_path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+
+    # 旧轨迹里的相对路径按录制时的工作目录 (即当前目录) 解析，再切到临时目录
+    config = header.get("config", {})
+    if config.get("last_local_file"):
+        config["last_local_file"] = absolute_book_path(config["last_local_file"])
+    for event in events:
+        if event[1] == "a" and len(event) > 3 and event[2] == "load_local_file":
+            event[3] = absolute_book_path(event[3])
+
+    # 配置与缓存都落在临时目录，不影响真实的 config.json
+    os.chdir(tempfile.mkdtemp(prefix="stealth_replay_"))
+    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump({**DEFAULT_CONFIG, **config}, f)
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    reader = StealthReader()
+    reader.show()
+
+    replayer = SessionReplayer(app, reader)
+    replayer.pump(1.0)  # 等待启动时的进度恢复完成
+    replayer.run(events, realtime)
+    print(replayer.report())
+    return 0
+
+
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    # 【关键】打包成单文件 exe 后，预处理子进程会以本程序启动，必须先交给 multiprocessing 接管
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Stealth Reader")
+    parser.add_argument("--record", metavar="TRACE", help="把本次会话的输入录制到轨迹文件")
+    parser.add_argument("--replay", metavar="TRACE", help="在无界面平台回放轨迹并输出逐事件延迟")
+    parser.add_argument("--realtime", action="store_true", help="回放时按录制时的时间间隔等待")
+    parser.add_argument("--preprocess", metavar="PATH", help="不打开窗口，批量预处理目录下的 TXT 写入缓存")
+    parser.add_argument("--profile", action="append", metavar="字体,字号,宽x高",
+                        help="预处理的排版方案，可重复；默认取 config.json 中的设置")
+    parser.add_argument("--jobs", type=int, default=None, help="预处理的进程数 (默认 CPU 核数)")
+    parser.add_argument("--dpi", type=int, default=PREPROCESS_DPI, help="屏幕逻辑 DPI (缩放 125%% 为 120)")
+    args, qt_args = parser.parse_known_args()
+
+    if args.replay:
+        sys.exit(replay_session(args.replay, args.realtime))
+
+    if args.preprocess:
+        if args.profile:
+            profiles = [parse_layout_profile(spec) for spec in args.profile]
+        else:
+            config = DEFAULT_CONFIG.copy()
+            if os.path.exists(CONFIG_FILE):
+                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    config.update(json.load(f))
+            profiles = [(config["font_family"], config["font_size"],
+                         config["window_width"], config["window_height"])]
+        sys.exit(preprocess_library(args.preprocess, profiles, args.jobs, args.dpi))
+
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setQuitOnLastWindowClosed(False)
     ex = StealthReader()
+    if args.record:
+        ex.start_recording(args.record)
     ex.show()
     sys.exit(app.exec_())
\ No newline at end of file
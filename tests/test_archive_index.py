@@ -0,0 +1,131 @@
+import gzip
+import os
+import random
+import sys
+import tempfile
+import unittest
+import zipfile
+import zlib
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from main import BookArchive, build_archive_index, decode_book_bytes, read_archive_preview, read_book_bytes
+
+
+def make_book(chapters=120):
+    random.seed(11)
+    return "".join(f"第{i}章 标题\r\n" + "".join(random.choice("的一是了我不人在他有这个上们ab\r\n") for _ in range(2000))
+                   + "\r\n" for i in range(chapters))
+
+
+class ArchiveIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)  # 索引写到当前目录的 cache/ 下
+        self.text = make_book()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def assert_previews(self, path):
+        raw, archive = read_book_bytes(path)
+        full, encoding = decode_book_bytes(raw)
+        self.assertTrue(build_archive_index(path, archive, raw, encoding, zlib.crc32(raw)))
+        self.assertGreater(len(main.load_archive_index(path)["points"]), 3)
+        random.seed(5)
+        for pos in [0, 1, len(full) // 2, len(full) - 1] + [random.randrange(len(full)) for _ in range(30)]:
+            start, text = read_archive_preview(path, pos, 500)
+            self.assertLessEqual(start, pos)
+            self.assertEqual(text, full[start:start + len(text)])
+            self.assertGreaterEqual(start + len(text), min(len(full), pos + 500))
+
+    @mock.patch.object(main, "ARCHIVE_CHECKPOINT_SPAN", 32 << 10)
+    def test_multi_member_gzip(self):
+        for encoding in ("utf-8-sig", "gb18030"):
+            with self.subTest(encoding=encoding):
+                raw = self.text.encode(encoding)
+                with open("book.txt.gz", "wb") as f:
+                    f.write(gzip.compress(raw[:len(raw) // 3]) + gzip.compress(raw[len(raw) // 3:]))
+                self.assert_previews("book.txt.gz")
+
+    @mock.patch.object(main, "ARCHIVE_CHECKPOINT_SPAN", 32 << 10)
+    def test_zip_members(self):
+        raw = self.text.encode("gb18030")
+        with zipfile.ZipFile("library.zip", "w") as zf:
+            zf.writestr("deflated.txt", raw, compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr("stored.txt", raw, compress_type=zipfile.ZIP_STORED)
+        for member in ("deflated.txt", "stored.txt"):
+            with self.subTest(member=member):
+                self.assert_previews("library.zip" + main.ARCHIVE_MEMBER_SEP + member)
+
+    def test_index_invalid_after_change(self):
+        raw = self.text.encode("utf-8")
+        with open("book.txt.gz", "wb") as f:
+            f.write(gzip.compress(raw))
+        _, archive = read_book_bytes("book.txt.gz")
+        build_archive_index("book.txt.gz", archive, raw, "utf-8", zlib.crc32(raw))
+        with open("book.txt.gz", "ab") as f:
+            f.write(gzip.compress(b"more"))
+        self.assertIsNone(read_archive_preview("book.txt.gz", 10, 500))
+
+    def build_gzip_index(self):
+        raw = self.text.encode("utf-8")
+        with open("book.txt.gz", "wb") as f:
+            f.write(gzip.compress(raw))
+        _, archive = read_book_bytes("book.txt.gz")
+        self.assertTrue(build_archive_index("book.txt.gz", archive, raw, "utf-8", zlib.crc32(raw)))
+        return raw, main.load_archive_index("book.txt.gz")["points"]
+
+    @mock.patch.object(main, "ARCHIVE_CHECKPOINT_SPAN", 32 << 10)
+    def test_corrupted_archive_rejected(self):
+        raw, points = self.build_gzip_index()
+        bit, out, _, text_pos = points[2][:4]
+        st = os.stat("book.txt.gz")
+        with open("book.txt.gz", "r+b") as f:
+            f.seek((bit >> 3) + 40)  # 检查点之后、核对范围之内
+            byte = f.read(1)[0]
+            f.seek(-1, 1)
+            f.write(bytes([byte ^ 0x5A]))
+        os.utime("book.txt.gz", ns=(st.st_atime_ns, st.st_mtime_ns))  # 大小与修改时间不变，索引仍被当作有效
+        self.assertIsNotNone(main.load_archive_index("book.txt.gz"))
+        with self.assertRaises(zlib.error):
+            read_archive_preview("book.txt.gz", text_pos + 10, 500)
+        start, text = read_archive_preview("book.txt.gz", 10, 500)  # 之前的检查点不受影响
+        self.assertEqual(text, main.translate_newlines(raw.decode("utf-8"))[start:start + len(text)])
+        with self.assertRaises(zlib.error):
+            read_book_bytes("book.txt.gz")  # gzip 尾部 crc 对不上
+        points = BookArchive("book.txt.gz").checkpoints(raw)
+        self.assertTrue(points)
+        self.assertLess(points[-1][1], out)
+
+    @mock.patch.object(main, "ARCHIVE_CHECKPOINT_SPAN", 32 << 10)
+    def test_truncated_archive(self):
+        raw, points = self.build_gzip_index()
+        bit = points[3][0]
+        with open("book.txt.gz", "r+b") as f:
+            f.truncate(bit >> 3)
+        self.assertIsNone(read_archive_preview("book.txt.gz", 10, 500))  # 大小变了，索引失效
+        partial, archive = read_book_bytes("book.txt.gz")  # 写到一半的文件读出已有的部分
+        self.assertTrue(raw.startswith(partial))
+        points = archive.checkpoints(raw)
+        self.assertTrue(points)
+        self.assertLessEqual(points[-1][1], len(partial))
+
+    def test_garbage_after_gzip_header(self):
+        with open("book.txt.gz", "wb") as f:
+            f.write(gzip.compress(b"x")[:10] + random.Random(3).randbytes(200000))
+        with self.assertRaises(zlib.error):
+            read_book_bytes("book.txt.gz")
+        archive = BookArchive("book.txt.gz")
+        raw = self.text.encode("utf-8")
+        self.assertEqual(archive.checkpoints(raw), [])
+        self.assertFalse(build_archive_index("book.txt.gz", archive, raw, "utf-8", zlib.crc32(raw)))
+        self.assertIsNone(read_archive_preview("book.txt.gz", 0, 500))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import ChapterListStream
+
+
+def parse_in_chunks(raw, sizes):
+    """按给定的块大小循环切分 raw 逐块喂入，返回 (章节列表, 顶层字段)"""
+    parser = ChapterListStream()
+    items, pos, i = [], 0, 0
+    while pos < len(raw):
+        size = sizes[i % len(sizes)]
+        items += parser.feed(raw[pos:pos + size])
+        pos += size
+        i += 1
+    items += parser.close()
+    return items, parser.fields
+
+
+class ChapterListStreamTest(unittest.TestCase):
+    def assert_round_trip(self, raw, sizes):
+        items, fields = parse_in_chunks(raw, sizes)
+        expected = json.loads(raw)
+        self.assertEqual(items, expected["data"])
+        self.assertEqual(fields, {k: v for k, v in expected.items() if k != "data"})
+
+    def test_numbers_split_at_chunk_edge(self):
+        raw = b'{"isSuccess": true, "data": [1, 22, 333, 4.5e10, -0.25, 1e-7, 6E+2, 7], "total": 12.5}'
+        for sizes in ([1], [2], [1, 2], [3, 1]):
+            with self.subTest(sizes=sizes):
+                self.assert_round_trip(raw, sizes)
+
+    def test_chapters_random_chunk_sizes(self):
+        chapters = [{"title": f"第{i}章 标题", "index": i, "url": f"http://x/c/{i}", "isVolume": i % 7 == 0,
+                     "tag": None, "wordCount": i * 1.5e3} for i in range(40)]
+        raw = json.dumps({"isSuccess": True, "errorMsg": "", "data": chapters}, ensure_ascii=False).encode('utf-8')
+        random.seed(7)
+        for _ in range(20):
+            sizes = [random.randint(1, 9) for _ in range(5)]
+            with self.subTest(sizes=sizes):
+                self.assert_round_trip(raw, sizes)
+
+    def test_incomplete_response_raises(self):
+        parser = ChapterListStream()
+        parser.feed(b'{"isSuccess": true, "data": [{"title": "a"}')
+        with self.assertRaises(ValueError):
+            parser.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
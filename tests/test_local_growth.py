@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (PREFIX_EDGE_SPAN, decode_appended, extend_prefix_edges, read_local_growth,
+                  translate_newlines)
+
+
+class LocalGrowthTest(unittest.TestCase):
+    """连载追加：核对已读部分、读出新增字节并解码，与整本重新读入的结果一致"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def open_book(self, raw, encoding):
+        with open(self.path, 'wb') as f:
+            f.write(raw)
+        self.encoding = encoding
+        self.text = translate_newlines(raw.decode(encoding))
+        self.length, self.crc = len(raw), zlib.crc32(raw)
+        self.edges = extend_prefix_edges((b"", b""), raw)
+        self.pending_cr = raw.endswith(b'\r')
+
+    def append(self, data, full=False):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        return self.check(full)
+
+    def check(self, full=False):
+        """同阅读器收到文件变化后的处理；返回新增字节，前文被改时返回 None"""
+        data = read_local_growth(self.path, self.length, self.crc, self.edges, full)
+        if data:
+            tail, consumed, self.pending_cr = decode_appended(data, self.encoding, self.pending_cr)
+            self.text += tail
+            self.crc = zlib.crc32(data[:consumed], self.crc)
+            self.edges = extend_prefix_edges(self.edges, data[:consumed])
+            self.length += consumed
+        return data
+
+    def assert_matches_full_read(self):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        self.assertEqual(self.text, translate_newlines(raw.decode(self.encoding)))
+        self.assertEqual((self.length, self.crc), (len(raw), zlib.crc32(raw)))
+
+    def test_plain_append(self):
+        self.open_book("第一章\n正文".encode("utf-8") * 2000, "utf-8")
+        self.assertEqual(self.append("\n第二章 新的一章\n".encode("utf-8")), "\n第二章 新的一章\n".encode("utf-8"))
+        self.assertEqual(self.check(), b"")
+        self.assert_matches_full_read()
+
+    def test_crlf_split_across_old_end(self):
+        self.open_book("第一章\r\n正文\r".encode("gbk"), "gbk")
+        self.append("\n第二行\r".encode("gbk"))
+        self.append(b"\n")
+        self.append("第三行\r\n".encode("gbk"))
+        self.assertFalse(self.pending_cr)
+        self.assert_matches_full_read()
+        self.assertNotIn("\n\n", self.text)
+
+    def test_multibyte_char_split_across_old_end(self):
+        for encoding, char in (("utf-8", "好"), ("gb18030", "好"), ("gb18030", "\U0001F600")):
+            with self.subTest(encoding=encoding, char=char):
+                self.open_book("开头".encode(encoding), encoding)
+                encoded = char.encode(encoding)
+                for i in range(1, len(encoded)):
+                    self.append(encoded[i - 1:i])
+                    self.assertEqual(self.text, "开头")  # 没写完的字符不消耗
+                self.append(encoded[-1:] + "结尾".encode(encoding))
+                self.assertEqual(self.text, "开头" + char + "结尾")
+                self.assert_matches_full_read()
+
+    def test_truncate_or_rewrite_falls_back_to_reload(self):
+        raw = "".join(f"第{i}章\n正文正文\n" for i in range(3000)).encode("utf-8")
+        cases = {
+            "truncated": raw[:len(raw) // 2],
+            "rewritten head": b"X" + raw[1:] + b"more",
+            "rewritten old end": raw[:-3] + b"XYZ" + b"more",
+            "same length, middle": raw[:len(raw) // 2] + b"X" + raw[len(raw) // 2 + 1:],
+        }
+        for name, new in cases.items():
+            with self.subTest(name):
+                self.open_book(raw, "utf-8")
+                with open(self.path, 'wb') as f:
+                    f.write(new)
+                self.assertIsNone(self.check())
+
+    def test_middle_edit_with_growth_needs_full_check(self):
+        raw = "正文".encode("utf-8") * (PREFIX_EDGE_SPAN * 4)
+        self.open_book(raw, "utf-8")
+        middle = len(raw) // 2
+        with open(self.path, 'wb') as f:
+            f.write(raw[:middle] + "改动".encode("utf-8") + raw[middle + 6:] + b"more")
+        # 两端没变时平常只比两端；整段核对时才发现中间的改动
+        self.assertEqual(read_local_growth(self.path, self.length, self.crc, self.edges, False), b"more")
+        self.assertIsNone(read_local_growth(self.path, self.length, self.crc, self.edges, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
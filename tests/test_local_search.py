@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (SEARCH_MAX_HITS, LocalBookSearcher, line_start_offsets, pack_offsets, scan_chapter_headings,
+                  unpack_offsets)
+
+BOOK = ("某书\n简介：林动登场\n"
+        "第一章 开端\n　　林动醒来。\n　　" + "很长的一段" * 40 + "林动起身。\n"
+        "第二章 结尾\n　　没有主角。\n")
+
+
+def run_search(text, keyword, line_index):
+    found, finished = [], []
+    searcher = LocalBookSearcher(text, scan_chapter_headings(text), line_index, "某书", keyword,
+                                 on_hits=found.extend, on_finished=lambda *args: finished.append(args))
+    searcher.start()
+    searcher.thread.join()
+    return found, finished[0]
+
+
+class LocalBookSearcherTest(unittest.TestCase):
+    def test_offsets_round_trip(self):
+        offsets = line_start_offsets(BOOK)
+        self.assertEqual(list(unpack_offsets(pack_offsets(offsets))), list(offsets))
+        self.assertEqual([BOOK[i - 1] for i in offsets[1:]], ["\n"] * (len(offsets) - 1))
+
+    def test_hits_grouped_by_chapter(self):
+        for line_index in (None, pack_offsets(line_start_offsets(BOOK))):
+            with self.subTest(indexed=line_index is not None):
+                hits, (done, total, count, truncated) = run_search(BOOK, "林动", line_index)
+                self.assertEqual([(h[0], h[1]) for h in hits], [(-1, "某书"), (0, "第一章 开端"), (0, "第一章 开端")])
+                self.assertEqual([h[3] for h in hits], [i for i in range(len(BOOK)) if BOOK.startswith("林动", i)])
+                # 段首附近的命中从段首跳转，段落中很靠后的命中直接跳到命中处
+                self.assertEqual(hits[1][2], BOOK.index("　　林动醒来"))
+                self.assertEqual(hits[2][2], hits[2][3])
+                self.assertEqual((done, total, count, truncated), (3, 3, 3, False))
+
+    def test_hit_limit(self):
+        text = "第一章 甲\n" + "乙\n" * (SEARCH_MAX_HITS + 10)
+        hits, (_, _, count, truncated) = run_search(text, "乙", None)
+        self.assertEqual((len(hits), count, truncated), (SEARCH_MAX_HITS, SEARCH_MAX_HITS, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
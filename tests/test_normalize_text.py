@@ -0,0 +1,71 @@
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import PARAGRAPH_INDENT, normalize_chapter_text
+
+
+class NormalizeChapterTextTest(unittest.TestCase):
+    def test_prose_angle_brackets_survive(self):
+        text = "他说<我不信>然后a<b 与 c>d"
+        self.assertEqual(normalize_chapter_text(text), PARAGRAPH_INDENT + text)
+
+    def test_html_tags_with_attributes_removed(self):
+        raw = ('<p class="x">第一段<span style=\'color:red\'>红字</span></p>'
+               '<p id=p2 >第二段<img src="a.png" /><b>粗</B></p><br/><div\n  data-x="1">第三段</div>')
+        self.assertEqual(normalize_chapter_text(raw),
+                         "\n".join(PARAGRAPH_INDENT + line for line in ("第一段红字", "第二段粗", "第三段")))
+
+    def test_unknown_or_malformed_tags_kept(self):
+        self.assertEqual(normalize_chapter_text("x<bra>y<b 2>z"), PARAGRAPH_INDENT + "x<bra>y<b 2>z")
+
+    def test_entities_decoded_once(self):
+        raw = "&nbsp;&emsp;甲&amp;lt;乙&lt;丙&#20320;&#x597D;&hellip;&ldquo;AT&T&rdquo;&nosuch;&amp;"
+        self.assertEqual(normalize_chapter_text(raw), PARAGRAPH_INDENT + "甲&lt;乙<丙你好…“AT&T”&nosuch;&")
+
+
+def elapsed(fn, arg):
+    t0 = time.perf_counter()
+    fn(arg)
+    return time.perf_counter() - t0
+
+
+class NormalizeChapterTextSpeedTest(unittest.TestCase):
+    """1 MB 章节的耗时以紧挨着测的一遍整段 str.replace 为单位衡量，不受机器快慢与一时负载影响"""
+    BUDGET = 60  # 单位数；现在最慢的数字实体约 30，原先整段 html.unescape 超过 100
+
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(0)
+        pool = [chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(4000)]
+        paras = ["".join(rng.choice(pool) for _ in range(rng.randint(30, 80))) for _ in range(20000)]
+
+        def cut(text):
+            return text[:1 << 20]
+
+        cls.plain = cut("\n".join(PARAGRAPH_INDENT + p for p in paras))
+        cls.shapes = {
+            "plain": cls.plain,
+            "br_nbsp": cut("".join("&nbsp;" * 4 + p + "<br><br>" for p in paras)),
+            "p": cut("".join("<p>" + p + "</p>\n" for p in paras)),
+            "numeric": cut("".join("".join("&#%d;" % ord(c) if i % 2 else c for i, c in enumerate(p)) + "<br>"
+                                   for p in paras)),
+            "named": cut("".join(p[:10] + "&ldquo;" + p[10:20] + "&rdquo;&hellip;" + p[20:] + "<br/>"
+                                 for p in paras)),
+        }
+
+    def test_one_megabyte_chapter_within_budget(self):
+        def unit(text):
+            return text.replace("\n", "\n" + PARAGRAPH_INDENT)
+
+        for name, raw in self.shapes.items():
+            with self.subTest(shape=name):
+                ratio = min(elapsed(normalize_chapter_text, raw) / elapsed(unit, self.plain) for _ in range(5))
+                self.assertLess(ratio, self.BUDGET, f"{name}: {ratio:.1f} 个单位")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import random
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from main import position_fingerprint, relocate_position
+
+
+def make_text(paragraphs, seed=1):
+    """不重复的随机汉字段落，段首缩进、段间换行"""
+    rng = random.Random(seed)
+    return "".join("    " + "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(rng.randint(20, 60))) + "\n"
+                   for _ in range(paragraphs))
+
+
+class RelocatePositionTest(unittest.TestCase):
+    def setUp(self):
+        self.text = make_text(400)
+        self.pos = self.text.index("\n", len(self.text) // 2) + 5  # 段中某字
+        self.fp = position_fingerprint(self.text, self.pos, (0, 0))
+
+    def test_text_inserted_before(self):
+        inserted = make_text(30, seed=2)
+        new = self.text[:1000] + inserted + self.text[1000:]
+        self.assertEqual(relocate_position(new, self.pos, self.fp), self.pos + len(inserted))
+
+    def test_text_deleted_before(self):
+        new = self.text[:1000] + self.text[1700:]
+        self.assertEqual(relocate_position(new, self.pos, self.fp), self.pos - 700)
+
+    def test_whitespace_changes_ignored(self):
+        new = self.text.replace("    ", "　　").replace("\n", "\r\n\r\n")
+        old_prefix = self.text[:self.pos]
+        expected = len(old_prefix.replace("    ", "　　").replace("\n", "\r\n\r\n"))
+        self.assertEqual(relocate_position(new, self.pos, self.fp), expected)
+
+    def test_fingerprint_straddling_window_seam(self):
+        """只给前段或后段指纹，让命中的窗口正好压在首轮区间的两端接缝上"""
+        span = 256
+        filler = make_text(60, seed=3)
+        with mock.patch.object(main, "REANCHOR_FIRST_SPAN", span), mock.patch.object(main, "REANCHOR_MAX_SPAN", 1 << 14):
+            for shift in range(span - 40, span + 40):
+                for side in ("before", "after"):
+                    fp = dict(self.fp, **{"after" if side == "before" else "before": None})
+                    with self.subTest(shift=shift, side=side, direction="forward"):
+                        new = self.text[:self.pos - 200] + filler[:shift] + self.text[self.pos - 200:]
+                        self.assertEqual(relocate_position(new, self.pos, fp), self.pos + shift)
+                    with self.subTest(shift=shift, side=side, direction="backward"):
+                        old_pos = self.pos + shift
+                        new = self.text
+                        self.assertEqual(relocate_position(new, old_pos, fp), self.pos)
+
+    def test_repeated_passage_prefers_nearest(self):
+        start = self.text.rfind("\n", 0, self.pos) + 1
+        passage = self.text[start:start + 200]
+        fp = position_fingerprint(self.text, start + 10, (0, 0))
+        fp["before"] = None  # 只认段内文字，各处副本的前文不同
+        # 同一段在开头远处、原位后方近处各再出现一次
+        cut = start + 500
+        new = passage + self.text[:cut] + passage + self.text[cut:]
+        original = len(passage) + start + 10
+        near_copy = len(passage) + cut + 10
+        self.assertEqual(relocate_position(new, original - 3, fp), original)
+        self.assertEqual(relocate_position(new, near_copy + 3, fp), near_copy)
+        self.assertEqual(relocate_position(new, 30, fp), 10)
+
+    def test_no_match_returns_none(self):
+        other = make_text(400, seed=9)
+        self.assertIsNone(relocate_position(other, self.pos, self.fp))
+        self.assertIsNone(relocate_position(other, len(other) * 10, self.fp))
+        self.assertIsNone(relocate_position(other, -5, self.fp))
+        self.assertIsNone(relocate_position(other, 0, {"before": None, "after": None}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import QApplication
+
+from main import ReplaceRuleEngine, display_window, paginate_forward
+
+AD_LINE = "　　请收藏本站：www.example.com"
+
+
+def make_chapter(paragraphs=60):
+    lines = []
+    for i in range(paragraphs):
+        lines.append(f"　　第{i}段，" + "正文内容" * (i % 5 + 3))
+        if i % 4 == 1:
+            lines.append(AD_LINE)
+    return "\n".join(lines)
+
+
+class AnchoredRuleWindowTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        self.engine = ReplaceRuleEngine([{"pattern": r"^\s*请收藏本站.*", "replacement": "", "isRegex": True}])
+        self.text = make_chapter()
+        self.full = self.engine.apply(self.text, cache=False)
+
+    def test_window_matches_whole_chapter(self):
+        # 页首落在行首、行中间、广告行上与广告行前一个字符时，窗口结果都与整章净化一致
+        ad = self.text.find("请收藏本站")
+        line_start = self.text.rfind('\n', 0, ad) + 1
+        for start in (0, 6, 12, 16, line_start - 1, line_start, ad, ad + 3, len(self.text) // 2):
+            end = min(len(self.text), start + 300)
+            with self.subTest(start=start):
+                window = display_window(self.text, start, end, self.engine.apply)
+                expected = self.full.text[self.full.to_display(start):self.full.to_display(end)]
+                self.assertEqual(window.text, expected)
+
+    def test_paginate_from_several_offsets(self):
+        font = QFont("Microsoft YaHei", 12)
+        for origin in (0, 6, 12, 16, self.text.find("请收藏本站")):
+            with self.subTest(origin=origin):
+                starts = [origin] + paginate_forward(self.text, origin, 50, font, 300, 120,
+                                                     transform=self.engine.apply)
+                starts.append(len(self.text))
+                for start, end in zip(starts, starts[1:]):
+                    page = display_window(self.text, start, end, self.engine.apply).text
+                    self.assertNotIn("请收藏本站", page)
+
+
+if __name__ == '__main__':
+    unittest.main()